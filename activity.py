@@ -0,0 +1,144 @@
+"""Motion activity of a detector, aggregated per trigger into fixed histograms
+
+Each trigger increments a bin of three histograms of fixed size: the hour
+of week in local time, the day in a ring of the last DAYS days and the
+interval since the previous trigger. No trigger times are kept. The chart
+data for the UI is computed once per change and served from a cache.
+
+The counts tolerate a loss, they are stored along with the other states
+and a trigger requests a store at most once per STORE_INTERVAL.
+"""
+import bisect
+from datetime import datetime
+from app_state import State, Stateful
+
+# Rows of the heatmap
+WEEKDAYS = ("Mo", "Di", "Mi", "Do", "Fr", "Sa", "So")
+
+
+def _encode(counts):
+    """Return a histogram as a compact string of its counts"""
+    return " ".join(map(str, counts))
+
+
+def _decode(text, size):
+    """Restore a histogram, None if it does not have the size"""
+    counts = [int(count) for count in text.split()]
+    return counts if len(counts) == size else None
+
+
+class DetectorActivity(Stateful):
+    """Hour of week, daily and inter-trigger interval histograms of a detector
+
+    Arguments:
+        name (str): Name of the app state
+        app_state (AppState): Persistence of the histograms
+        now_func (callable): Returns the current time as aware datetime
+    """
+    # Days kept in the ring of daily counts
+    DAYS = 28
+    # Upper bounds in s of the interval bins, the last bin is open
+    INTERVALS = (5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600, 3 * 3600, 12 * 3600)
+    # Seconds between stores requested by triggers
+    STORE_INTERVAL = 3600
+
+    def __init__(self, name, app_state=None, now_func=None):
+        self.name = name
+        self.now_func = now_func if now_func is not None else \
+            lambda: datetime.now().astimezone()
+        self.hours = [0] * (7 * 24)
+        self.days = [0] * self.DAYS
+        # Ordinal of the newest day in the ring
+        self.day = self.now_func().toordinal()
+        self.intervals = [0] * (len(self.INTERVALS) + 1)
+        self.bounds_ns = [bound * 10**9 for bound in self.INTERVALS]
+        # Monotonic ns of the last trigger, not persisted
+        self.last = None
+        # Monotonic ns of the last store requested by a trigger
+        self.store_requested = None
+        self.count = 0
+        self.version = 0
+        self._chart = None
+        self._chart_version = -1
+        self.app_state = app_state
+        if app_state is not None:
+            self._register_state(app_state)
+
+    def _register_state(self, app_state):
+        state = app_state.get_state(self.name)
+        if state is not None:
+            hours = _decode(state.state["hours"], len(self.hours))
+            days = _decode(state.state["days"], len(self.days))
+            intervals = _decode(state.state["intervals"], len(self.intervals))
+            if hours is not None and days is not None and intervals is not None:
+                self.hours, self.days, self.intervals = hours, days, intervals
+                self.count = state.state["count"]
+                self.day = state.state["day"]
+                self.__advance(self.now_func().toordinal())
+        app_state.register_client(self)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        return State(self.name, {
+            "count": self.count,
+            "day": self.day,
+            "hours": _encode(self.hours),
+            "days": _encode(self.days),
+            "intervals": _encode(self.intervals),
+        })
+
+    def __advance(self, day):
+        """Make day the newest of the ring, clearing the days skipped"""
+        if day <= self.day:
+            return
+        for skipped in range(max(self.day + 1, day - self.DAYS + 1), day + 1):
+            self.days[skipped % self.DAYS] = 0
+        self.day = day
+        self.version += 1
+
+    def trigger(self, timestamp):
+        """Count a trigger at timestamp in monotonic ns"""
+        now = self.now_func()
+        self.hours[now.weekday() * 24 + now.hour] += 1
+        day = now.toordinal()
+        self.__advance(day)
+        if day > self.day - self.DAYS:
+            self.days[day % self.DAYS] += 1
+        if self.last is not None:
+            self.intervals[bisect.bisect_left(self.bounds_ns, timestamp - self.last)] += 1
+        self.last = timestamp
+        self.count += 1
+        self.version += 1
+        if self.app_state is not None and (
+                self.store_requested is None
+                or timestamp - self.store_requested >= self.STORE_INTERVAL * 10**9):
+            self.store_requested = timestamp
+            self.app_state.request_store()
+
+    def chart_data(self):
+        """Return the heatmap, daily and interval counts for the UI
+
+        Computed once per change of the counts or of the day.
+        """
+        self.__advance(self.now_func().toordinal())
+        if self._chart_version != self.version:
+            labels = [f"≤{self.__label(bound)}" for bound in self.INTERVALS]
+            labels.append(f">{self.__label(self.INTERVALS[-1])}")
+            self._chart = {
+                "heatmap": [[hour, weekday, self.hours[weekday * 24 + hour]]
+                            for weekday in range(7) for hour in range(24)],
+                "max": max(self.hours),
+                "days": [self.days[day % self.DAYS]
+                         for day in range(self.day - self.DAYS + 1, self.day + 1)],
+                "intervals": list(self.intervals),
+                "interval_labels": labels,
+                "count": self.count,
+            }
+            self._chart_version = self.version
+        return self._chart
+
+    @staticmethod
+    def __label(seconds):
+        return f"{seconds // 3600}h" if seconds >= 3600 else \
+            f"{seconds // 60}min" if seconds >= 60 else f"{seconds}s"
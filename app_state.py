@@ -1,6 +1,8 @@
 """Store persistent states in JSON format"""
 from typing import Set, Any
+import asyncio
 import json
+import time
 from dataclasses import dataclass
 from abc import ABCMeta, abstractmethod
 
@@ -36,6 +38,10 @@ class AppState:
         self._file = file
         self._state_dict = {}
         self.clients = set()
+        # Metrics: duration of last store_state in seconds, store count
+        self.store_duration = 0.
+        self.store_count = 0
+        self._store_handle = None
         self.load_state()
 
     def register_client(self, stateful: Stateful):
@@ -71,8 +77,21 @@ class AppState:
             # Ensure file can be created...
             self.store_state()
 
+    def request_store(self, delay=10.):
+        """Store the state soon, changes within delay are stored at once
+
+        Must be called from the event loop thread.
+        """
+        if self._store_handle is None:
+            self._store_handle = asyncio.get_running_loop().call_later(
+                delay, self.store_state)
+
     def store_state(self):
         """Store state to file"""
+        if self._store_handle is not None:
+            self._store_handle.cancel()
+            self._store_handle = None
+        start = time.perf_counter()
         self._fetch_clients()
         try:
             with open(self._file, "w", encoding="utf-8") as state_file:
@@ -80,3 +99,5 @@ class AppState:
                 state_file.write(json_str)
         except (PermissionError, FileNotFoundError) as err:
             print(f"Error storing states at {self._file}: {err}")
+        self.store_duration = time.perf_counter() - start
+        self.store_count += 1
@@ -0,0 +1,31 @@
+"""Setup and output shared by the benchmarks
+
+Importing this module puts the repository root on sys.path, the modules of
+the light control import from there as in the daemon.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def argument_parser(doc):
+    """Return an argument parser showing the docstring doc as is"""
+    return argparse.ArgumentParser(description=doc,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+
+
+def write_result(result, output=None):
+    """Write result as JSON to the file output, print it if output is None"""
+    text = json.dumps(result, indent=4)
+    if output is None:
+        print(text)
+        return
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(text, encoding="utf-8")
+    print(f"Results written to {output}")
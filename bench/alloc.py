@@ -0,0 +1,94 @@
+"""Memory allocated per pulse on the way from GPIO read to the meter
+
+Feeds batches of edges from a SimGpioMap into S0Meters, once via S0Event
+objects and queues (event path) and once via the timestamp buffers and
+S0Meter.pulses (ingest path). Reported is the tracemalloc peak of memory
+allocated while handling a batch, per batch and per pulse. Edge objects are
+created before the measurement, gpiod creates them in its own read.
+
+    python bench/alloc.py --batch 8 64 256
+"""
+import asyncio
+import tempfile
+import tracemalloc
+from array import array
+
+from _common import argument_parser
+from app_state import AppState
+from gpio_sim import SimGpioMap, SimEdgeEvent
+from s0_meter import S0Meter
+
+INPUTS = 8
+
+
+def event_path(gpio, meters, queues):
+    """Read S0Events, pass them through queues to the meters"""
+    for event in gpio.read_input_events(0):
+        queues[event.s0_index].put_nowait(event)
+    for meter, queue in zip(meters, queues):
+        while not queue.empty():
+            meter.pulse(queue.get_nowait().event.timestamp_ns)
+
+
+def ingest_path(gpio, meters, buffers):
+    """Read timestamps into buffers, pass slices to the meters"""
+    timestamps, counts, wanted = buffers
+    gpio.read_input_timestamps(timestamps, counts, wanted, 0)
+    for s0_index, meter in enumerate(meters):
+        with memoryview(timestamps[s0_index]) as view:
+            meter.pulses(view[:counts[s0_index]])
+        counts[s0_index] = 0
+
+
+def measure(path, gpio, meters, state, batch, rounds):
+    """Return the peak bytes allocated while handling a batch"""
+    timestamp = 0
+    peak = 0
+    for _ in range(rounds):
+        edges = []
+        for index in range(batch):
+            timestamp += 10**6
+            edges.append((0, SimEdgeEvent(gpio.s0_pins[index % INPUTS],
+                                          timestamp, index, index)))
+        gpio.pending = edges
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        path(gpio, meters, state)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    return peak
+
+
+async def run(batch, rounds):
+    """Measure both paths, return dict of results"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app_state = AppState(f"{tmp}/state.json")
+        meters = [S0Meter(f"meter_{i}", app_state) for i in range(INPUTS)]
+    gpio = SimGpioMap()
+    queues = [asyncio.Queue() for _ in range(INPUTS)]
+    buffers = ([array("q", bytes(8 * 256)) for _ in range(INPUTS)],
+               [0] * INPUTS, [False] * INPUTS)
+    results = {}
+    tracemalloc.start()
+    for name, path, state in (("event", event_path, queues),
+                              ("ingest", ingest_path, buffers)):
+        measure(path, gpio, meters, state, batch, 10)  # Warm up
+        results[name] = measure(path, gpio, meters, state, batch, rounds)
+    tracemalloc.stop()
+    return results
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--batch", type=int, nargs="*", default=[8, 64, 256],
+                        help="Edges per read")
+    parser.add_argument("--rounds", type=int, default=200, help="Reads to measure")
+    args = parser.parse_args()
+    for batch in args.batch:
+        results = asyncio.run(run(batch, args.rounds))
+        for name, peak in results.items():
+            print(f"batch {batch:4d} {name:8s} peak {peak:8d} bytes, "
+                  f"{peak / batch:8.1f} bytes/pulse")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Resident set size over days of simulated pulses in memory budget mode
+
+Runs the simulation of the installation with a memory budget and samples
+the RSS at the end of every simulated day. The histories fill up within
+the week of their longest zoom level, after this warm up the RSS must stay
+flat. Exits with 1 if it grew by more than the tolerance.
+
+    python bench/memory_soak.py --days 60 --budget 64
+"""
+import sys
+from datetime import datetime
+
+from _common import argument_parser
+from memory_budget import MemoryBudget
+from simulation import Simulation
+
+WARM_UP_DAYS = 8
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--budget", type=int, default=64, help="Memory budget in MB")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="Allowed RSS growth after the warm up in MB")
+    parser.add_argument("--hvac-power", type=float, default=300,
+                        help="Mean W per HVAC, sets the pulse rate")
+    args = parser.parse_args()
+    budget = MemoryBudget(args.budget << 20, interval=3600)
+    simulation = Simulation(datetime.fromisoformat("2026-01-01T00:00:00+01:00"),
+                            args.days, hvac_power=args.hvac_power, memory_budget=budget)
+    report = simulation.run()
+    rss = report["rss_mb"]
+    pulses = sum(meter.total for meter in simulation.light_control.meters.values())
+    print(f"{args.days} days, {pulses} pulses in {report['wall_s']}s")
+    for day in range(0, len(rss), 7):
+        print(f"day {day + 1:4}: {rss[day]:7.2f}MB")
+    for subsystem, usage in report["memory"].items():
+        print(f"{subsystem:>8}: {usage['used'] / 1024:8.1f}kB traced, budget "
+              f"{'-' if usage['budget'] is None else usage['budget'] >> 10}kB")
+    growth = rss[-1] - rss[min(WARM_UP_DAYS, len(rss) - 1)]
+    print(f"growth after warm up: {growth:+.2f}MB, evictions {budget.eviction_count}")
+    sys.exit(1 if growth > args.tolerance else 0)
+
+
+if __name__ == "__main__":
+    main()
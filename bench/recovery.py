@@ -0,0 +1,77 @@
+"""Recovery time of a supervised meter under fault injection
+
+Feeds a supervised S0Meter with events at a fixed rate and injects an
+event that fails its handling every --every seconds. Reports the time from
+each fault until the next event is counted, and whether events queued
+meanwhile were lost. The recovery is bounded by the first backoff delay as
+long as the task ran for the stable time before failing.
+
+    python bench/recovery.py --faults 20
+"""
+import asyncio
+import statistics
+import tempfile
+import time
+from unittest import mock
+
+from _common import argument_parser
+from app_state import AppState
+from s0_meter import S0Meter
+from supervisor import Supervisor
+
+
+class Event:
+    """S0Event stand in, only the timestamp is read by the meter"""
+    # pylint: disable=too-few-public-methods
+    def __init__(self, timestamp_ns):
+        self.event = self
+        self.timestamp_ns = timestamp_ns
+
+
+async def inject(args):
+    """Return the recovery times in s and the events lost"""
+    with tempfile.TemporaryDirectory() as tmp:
+        supervisor = Supervisor(backoff=(args.backoff, 30.), stable=args.stable)
+        meter = S0Meter("bench", AppState(f"{tmp}/state.json"), supervisor=supervisor,
+                        queue=True)
+        fed = 0
+        recoveries = []
+        for _ in range(args.faults):
+            # Healthy operation for a while, then a fault
+            deadline = time.monotonic() + args.every
+            while time.monotonic() < deadline:
+                meter.queue.put_nowait(Event(time.monotonic_ns()))
+                fed += 1
+                await asyncio.sleep(1 / args.rate)
+            counted = meter.total
+            fault = time.perf_counter()
+            meter.queue.put_nowait(None)
+            meter.queue.put_nowait(Event(time.monotonic_ns()))
+            fed += 1
+            while meter.total == counted:
+                await asyncio.sleep(0.001)
+            recoveries.append(time.perf_counter() - fault)
+        while meter.queue.qsize():
+            await asyncio.sleep(0.01)
+        meter.task.cancel()
+        return recoveries, fed - meter.total, supervisor.tasks["bench"].restarts
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--faults", type=int, default=20, help="Faults to inject")
+    parser.add_argument("--every", type=float, default=0.5, help="Seconds between faults")
+    parser.add_argument("--rate", type=float, default=200., help="Events per second")
+    parser.add_argument("--backoff", type=float, default=0.1, help="First restart delay")
+    parser.add_argument("--stable", type=float, default=0.4,
+                        help="Seconds of running that reset the backoff")
+    args = parser.parse_args()
+    with mock.patch("traceback.print_exception"), mock.patch("builtins.print"):
+        recoveries, lost, restarts = asyncio.run(inject(args))
+    print(f"{restarts} restarts, {lost} events lost")
+    print(f"recovery: median {statistics.median(recoveries) * 1e3:.1f}ms, "
+          f"max {max(recoveries) * 1e3:.1f}ms (first backoff {args.backoff * 1e3:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
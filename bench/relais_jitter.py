@@ -0,0 +1,104 @@
+"""Measure relais timing jitter with and without UI load
+
+TimedRelais switches relais from loop.call_at callbacks. The lateness of
+these callbacks is the relais timing jitter. It is measured in three setups:
+
+    idle:        The I/O loop alone
+    ui-inproc:   UI load running on the same event loop (single process)
+    ui-process:  The same UI load running in a separate process (daemon + UI)
+
+UI load is emulated by blocking the loop for a page render every period.
+"""
+import asyncio
+import multiprocessing
+import statistics
+import time
+
+from _common import argument_parser
+
+
+def render(block):
+    """Emulate a blocking page render / websocket burst"""
+    stop = time.perf_counter() + block
+    while time.perf_counter() < stop:
+        pass
+
+
+async def ui_load(block, period):
+    """UI load sharing the loop"""
+    while True:
+        render(block)
+        await asyncio.sleep(period)
+
+
+def ui_process(block, period):
+    """UI load in its own process"""
+    asyncio.run(ui_load(block, period))
+
+
+async def measure(samples, interval):
+    """Return the lateness of call_at callbacks in ms"""
+    loop = asyncio.get_running_loop()
+    lateness = []
+    done = loop.create_future()
+
+    def on_timer(deadline):
+        lateness.append((loop.time() - deadline) * 1e3)
+        if len(lateness) < samples:
+            schedule()
+        elif not done.done():
+            done.set_result(None)
+
+    def schedule():
+        deadline = loop.time() + interval
+        loop.call_at(deadline, on_timer, deadline)
+
+    schedule()
+    await done
+    return lateness
+
+
+async def run(setup, samples, interval, block, period):
+    """Run one setup and return the lateness samples"""
+    load = None
+    proc = None
+    if setup == "ui-inproc":
+        load = asyncio.create_task(ui_load(block, period))
+    elif setup == "ui-process":
+        proc = multiprocessing.Process(target=ui_process, args=(block, period))
+        proc.start()
+    try:
+        return await measure(samples, interval)
+    finally:
+        if load is not None:
+            load.cancel()
+        if proc is not None:
+            proc.terminate()
+            proc.join()
+
+
+def report(setup, lateness):
+    """Print statistics of lateness samples"""
+    lateness = sorted(lateness)
+    p99 = lateness[int(len(lateness) * 0.99) - 1]
+    print(f"{setup:12s} p50 {statistics.median(lateness):7.3f}ms "
+          f"p99 {p99:7.3f}ms max {lateness[-1]:7.3f}ms")
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.013,
+                        help="Timer interval in s")
+    parser.add_argument("--block", type=float, default=0.02,
+                        help="Blocking time of a UI render in s")
+    parser.add_argument("--period", type=float, default=0.1,
+                        help="Period of UI renders in s")
+    args = parser.parse_args()
+    for setup in ("idle", "ui-inproc", "ui-process"):
+        report(setup, asyncio.run(run(setup, args.samples, args.interval,
+                                      args.block, args.period)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Event latency versus S0 channel count
+
+Maps 1 to N simulated S0 shields (8 inputs each) into one SimGpioMap read by
+a single S0EventDispatcher. All inputs pulse with the same Poisson rate. The
+latency from the edge timestamp until a consumer task receives the event is
+reported per channel count.
+"""
+import asyncio
+import time
+
+from _common import argument_parser
+from gpio_sim import SimGpioMap, sim_shields
+from io_control import S0EventDispatcher
+from loadgen import LoadGenerator, PoissonProfile
+
+
+async def consume(queue, latencies):
+    """Record the latency of received events"""
+    while True:
+        event = await queue.get()
+        latencies.append(time.monotonic_ns() - event.event.timestamp_ns)
+
+
+async def measure(shields, rate, duration):
+    """Return sorted latencies in ns for a shield count"""
+    gpio = SimGpioMap(shields=sim_shields(shields))
+    dispatcher = S0EventDispatcher(gpio, 0.1)
+    latencies = []
+    consumers = []
+    for s0_index in range(len(gpio.s0_pins)):
+        queue = asyncio.Queue()
+        dispatcher.register_queue(s0_index, queue)
+        consumers.append(asyncio.create_task(consume(queue, latencies)))
+    generator = LoadGenerator(gpio, {s0: PoissonProfile(rate)
+                                     for s0 in range(len(gpio.s0_pins))})
+    generator.start()
+    await asyncio.sleep(duration)
+    generator.stop()
+    await asyncio.sleep(0.2)
+    dispatcher.cancel = True
+    for consumer in consumers:
+        consumer.cancel()
+    await asyncio.gather(dispatcher.task, *consumers, return_exceptions=True)
+    return sorted(latencies)
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--shields", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--rate", type=float, default=20,
+                        help="Pulses per second per input")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per run")
+    args = parser.parse_args()
+    for shields in args.shields:
+        latencies = asyncio.run(measure(shields, args.rate, args.duration))
+        count = len(latencies)
+        print(f"{shields * 8:4d} channels {count:7d} events "
+              f"p50 {latencies[count // 2] * 1e-3:8.1f}us "
+              f"p99 {latencies[int(count * 0.99)] * 1e-3:8.1f}us "
+              f"max {latencies[-1] * 1e-3:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
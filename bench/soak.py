@@ -0,0 +1,141 @@
+"""Pulse storm soak test of the light control on the simulated GPIO
+
+Runs LightControl on a SimGpioMap with UI clients connected and all S0
+inputs pulsing, for a set time. Reports pulses injected versus counted,
+detector queue high water marks, the largest batch and buffer size of the
+dispatcher per S0 input, loop lag and memory growth. Pulses faster than a
+meter's maximum power are rejected by its pulse filter, they are reported
+and not counted as missed.
+
+    python bench/soak.py --duration 3600 --rate 20 --profile poisson
+"""
+import asyncio
+import tempfile
+import threading
+import time
+
+from _common import argument_parser, write_result
+from gpio_sim import SimGpioMap
+from ipc import IpcServer, LightControlClient
+from light_control_new import LightControl
+from loadgen import LoadGenerator, ConstantProfile, PoissonProfile, BurstyProfile
+from metrics import process_rss
+
+PROFILES = {
+    "constant": ConstantProfile,
+    "poisson": PoissonProfile,
+    "bursty": lambda rate: BurstyProfile(rate / 4, rate * 4, burst=2.0, period=10.0),
+}
+METER_INPUTS = (4, 5, 6, 7)
+
+
+def ui_clients(path, count, stop):
+    """Run UI clients in their own thread and loop, like a UI process"""
+    async def clients():
+        clients = [LightControlClient(path, retry=0.1) for _ in range(count)]
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        while not stop.is_set():
+            await asyncio.sleep(0.5)
+            for client in clients:
+                if client.connected:
+                    try:
+                        await client.get_history("hvac-a", "hour")
+                    except (ConnectionError, KeyError, asyncio.TimeoutError):
+                        pass
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    asyncio.run(clients())
+
+
+async def soak(duration, profiles, clients, sample_interval=1.0):
+    """Run the soak test, return the report"""
+    # pylint: disable=too-many-locals
+    with tempfile.TemporaryDirectory() as tmp:
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, f"{tmp}/state.json")
+        server = IpcServer(light_control, f"{tmp}/io.sock")
+        tasks = [asyncio.create_task(light_control.io_main()),
+                 asyncio.create_task(server.serve())]
+        while not light_control.meters:
+            await asyncio.sleep(0.01)
+
+        stop = threading.Event()
+        client_thread = threading.Thread(
+            target=ui_clients, args=(f"{tmp}/io.sock", clients, stop), daemon=True)
+        client_thread.start()
+        generator = LoadGenerator(gpio, profiles)
+
+        # Meters are pulse sinks of the dispatcher, see its ingest state
+        queues = [(f"detector/{name}", d.queue)
+                  for name, d in light_control.detectors.items()]
+        high_water = dict.fromkeys((name for name, _ in queues), 0)
+        rss_start = process_rss()
+        rss_max = rss_start
+        generator.start()
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            await asyncio.sleep(sample_interval)
+            for name, queue in queues:
+                high_water[name] = max(high_water[name], queue.qsize())
+            rss_max = max(rss_max, process_rss())
+        generator.stop()
+
+        # Drain what is still pending
+        drain_end = time.monotonic() + 5
+        while time.monotonic() < drain_end and \
+                sum(light_control.dispatcher.event_counts) < sum(generator.injected):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(0.1)
+
+        stop.set()
+        client_thread.join()
+        dispatcher = light_control.dispatcher
+        totals = {s0_index: m.total for s0_index, m in
+                  zip(METER_INPUTS, light_control.meters.values())}
+        rejected = {s0_index: {"interval": f.rejected_interval,
+                               "switching": f.rejected_switching}
+                    for s0_index, f in enumerate(dispatcher.filters) if f is not None}
+        report = {
+            "duration_s": duration,
+            "profiles": {s0: repr(p) for s0, p in profiles.items()},
+            "clients": clients,
+            "injected": generator.injected,
+            "dispatched": light_control.dispatcher.event_counts,
+            "missed": sum(generator.injected) - sum(light_control.dispatcher.event_counts),
+            "meter_totals": totals,
+            "meter_rejected": rejected,
+            "meter_missed": sum(generator.injected[s0] - sum(rejected[s0].values()) - total
+                                for s0, total in totals.items()),
+            "queue_high_water": high_water,
+            "batch_max": dispatcher.batch_max,
+            "buffer_size": [len(buffer) if buffer is not None else 0
+                            for buffer in dispatcher.timestamps],
+            "loop_lag_max_s": light_control.lag_monitor.max_lag,
+            "executor_wait_max_s": light_control.dispatcher.executor_wait_max_ns * 1e-9,
+            "rss_start": rss_start,
+            "rss_max": rss_max,
+            "rss_end": process_rss(),
+        }
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return report
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="Pulses per second per S0 input")
+    parser.add_argument("--profile", choices=PROFILES, default="poisson")
+    parser.add_argument("--inputs", type=int, default=8, help="Pulsing S0 inputs")
+    parser.add_argument("--clients", type=int, default=2, help="Connected UI clients")
+    args = parser.parse_args()
+    profiles = {s0: PROFILES[args.profile](args.rate) for s0 in range(args.inputs)}
+    report = asyncio.run(soak(args.duration, profiles, args.clients))
+    write_result(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Startup time of the I/O daemon
+
+Measures two things in fresh interpreters:
+
+    import:       python -X importtime breakdown of importing light_control_new
+    first event:  Time from process start until the first S0 pulse, pending
+                  at start, is counted by a meter. Uses the simulated GPIO.
+    resume:       Time from GPIO init until a lamp, whose on window is active
+                  in the stored state, is switched on again.
+
+Also lists heavy modules that are imported eagerly but shall be lazy.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from _common import ROOT, argument_parser, write_result
+
+# Must not be imported by the I/O core before they are needed
+LAZY_MODULES = ("nicegui", "astral", "gpiod", "semver", "rpi_hardware_pwm",
+                "RPi", "zoneinfo")
+
+# Budgets in seconds, chosen for a Pi Zero
+IMPORT_BUDGET = 1.0
+FIRST_EVENT_BUDGET = 3.0
+RESUME_BUDGET = 0.1
+# Seconds a measuring subprocess may take before it is considered hung
+TIMEOUT = 60
+
+
+def import_times(module="light_control_new"):
+    """Return (cumulative us, [(self us, name), ...]) of importing module"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True, timeout=TIMEOUT)
+    total = 0
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative)
+    return total, sorted(modules, reverse=True)
+
+
+def eager_modules(module="light_control_new"):
+    """Return the LAZY_MODULES imported by importing module"""
+    code = f"import sys, {module}; " \
+           f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                          capture_output=True, text=True, check=True, timeout=TIMEOUT)
+    return proc.stdout.split()
+
+
+def time_to_first_event():
+    """Return seconds from spawning the daemon until the first pulse counted"""
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.monotonic_ns()
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", os.path.join(tmp, "state.json")],
+            cwd=ROOT, capture_output=True, text=True, check=True, timeout=TIMEOUT)
+    for line in proc.stdout.splitlines():
+        if line.startswith("first_event "):
+            return (int(line.split()[1]) - start) * 1e-9
+    raise RuntimeError(f"No event seen: {proc.stdout} {proc.stderr}")
+
+
+def time_to_resume():
+    """Return seconds from GPIO init until a stored on window is resumed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        state_file = os.path.join(tmp, "state.json")
+        now = time.time()
+        with open(state_file, "w", encoding="utf-8") as state:
+            json.dump({"Lampe Garage": {"mode": "AUTO", "window": [now - 1, now + 60]}},
+                      state)
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child-resume", state_file],
+            cwd=ROOT, capture_output=True, text=True, check=True, timeout=TIMEOUT)
+    for line in proc.stdout.splitlines():
+        if line.startswith("resume "):
+            return int(line.split()[1]) * 1e-9
+    raise RuntimeError(f"Not resumed: {proc.stdout} {proc.stderr}")
+
+
+def raise_failed(task):
+    """Raise the exception of the I/O core task if it has failed"""
+    if task.done():
+        raise task.exception() or RuntimeError("I/O core stopped")
+
+
+async def child_resume(state_file):
+    """Start the I/O core, report when the garage lamp is on again"""
+    # pylint: disable=import-outside-toplevel
+    from gpio_sim import SimGpioMap
+    from gpio_map import RelaisState
+    from light_control_new import LightControl
+
+    class Gpio(SimGpioMap):
+        """Records the time the garage lamp is switched on"""
+        switched_on = None
+
+        def set_relais(self, relais, state):
+            if relais == 3 and state == RelaisState.ON and self.switched_on is None:
+                self.switched_on = time.monotonic_ns()
+            super().set_relais(relais, state)
+
+    gpio = Gpio()
+    init = []
+
+    def gpio_factory(consumer):  # pylint: disable=unused-argument
+        init.append(time.monotonic_ns())
+        return gpio
+
+    light_control = LightControl(gpio_factory, state_file)
+    task = asyncio.create_task(light_control.io_main())
+    while gpio.switched_on is None:
+        raise_failed(task)
+        await asyncio.sleep(0.001)
+    print(f"resume {gpio.switched_on - init[0]}", flush=True)
+    task.cancel()
+
+
+async def child(state_file):
+    """Start the I/O core with a pulse pending, report when it is counted"""
+    # pylint: disable=import-outside-toplevel
+    from gpio_sim import SimGpioMap
+    from light_control_new import LightControl
+
+    gpio = SimGpioMap()
+    gpio.inject(4)
+    light_control = LightControl(lambda consumer: gpio, state_file)
+    task = asyncio.create_task(light_control.io_main())
+    while "hvac-a" not in light_control.meters \
+            or light_control.meters["hvac-a"].total == 0:
+        raise_failed(task)
+        await asyncio.sleep(0.001)
+    print(f"first_event {time.monotonic_ns()}", flush=True)
+    task.cancel()
+
+
+def measure():
+    """Run all startup measurements, return a result dict"""
+    total, modules = import_times()
+    first_event = time_to_first_event()
+    resume = time_to_resume()
+    eager = eager_modules()
+    within_budget = (not eager and total * 1e-6 < IMPORT_BUDGET
+                     and first_event < FIRST_EVENT_BUDGET and resume < RESUME_BUDGET)
+    return {
+        "import_s": total * 1e-6,
+        "import_top": [{"module": name, "self_us": us} for us, name in modules[:10]],
+        "first_event_s": first_event,
+        "resume_s": resume,
+        "eager_modules": eager,
+        "within_budget": within_budget,
+    }
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--json", action="store_true", help="Print result as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-resume", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(args.child))
+        return
+    if args.child_resume:
+        asyncio.run(child_resume(args.child_resume))
+        return
+    result = measure()
+    if args.json:
+        write_result(result)
+        return
+    print(f"import light_control_new: {result['import_s'] * 1e3:7.1f}ms "
+          f"(budget {IMPORT_BUDGET * 1e3:.0f}ms)")
+    for entry in result["import_top"]:
+        print(f"    {entry['self_us'] / 1e3:7.1f}ms {entry['module']}")
+    print(f"time to first event:      {result['first_event_s'] * 1e3:7.1f}ms "
+          f"(budget {FIRST_EVENT_BUDGET * 1e3:.0f}ms)")
+    print(f"resume of on window:      {result['resume_s'] * 1e3:7.1f}ms "
+          f"(budget {RESUME_BUDGET * 1e3:.0f}ms)")
+    print(f"eagerly imported:         {' '.join(result['eager_modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Cost per pulse of the meter statistics as the history grows
+
+Feeds pulses into a MeterStats with the rules of an HVAC meter and reports,
+after each decade of pulses, the time per pulse of the next batch and the
+size of the pickled statistics. Both stay flat, no pulse history is kept.
+
+    python bench/stats_cost.py --decades 6
+"""
+import pickle
+import random
+import time
+
+from _common import argument_parser
+from meter_stats import MeterStats, PowerAbove, Deviation
+
+BATCH = 10000
+INTERVAL = 10**8  # 10 pulses/s, 18kW
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("--decades", type=int, default=6,
+                        help="Measure up to 10^decades pulses of history")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    stats = MeterStats("bench", (PowerAbove("night load", 500, 4 * 3600, (22, 6)),
+                                 Deviation("deviation", 5, 200, 1800)))
+    timestamp = time.monotonic_ns()
+    fed = 0
+    for decade in range(3, args.decades + 1):
+        while fed < 10**decade:
+            timestamp += INTERVAL
+            stats.add(timestamp, rng.gauss(600, 50))
+            fed += 1
+        powers = [rng.gauss(600, 50) for _ in range(BATCH)]
+        start = time.perf_counter()
+        for power in powers:
+            timestamp += INTERVAL
+            stats.add(timestamp, power)
+        elapsed = time.perf_counter() - start
+        fed += BATCH
+        size = len(pickle.dumps(stats))
+        print(f"after 10^{decade} pulses: {elapsed / BATCH * 1e6:6.2f}us/pulse, "
+              f"state {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Benchmarks of the I/O hot paths against the simulated GPIO backend
+
+Results are written as JSON to bench/results/<commit>.json. Pass a former
+result file with --compare to print the change per benchmark.
+
+    python bench/suite.py
+    python bench/suite.py --compare bench/results/2431510.json
+"""
+import asyncio
+import itertools
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+from _common import ROOT, argument_parser, write_result
+from app_state import AppState, State, Stateful
+from gpio_sim import SimGpioMap, SimEdgeEvent
+from io_control import S0EventDispatcher, TimedRelais
+from light_control_new import LightControl
+from meter_shm import MeterShmReader, MeterShmWriter
+from pulse_log import PulseLog, DAY_NS
+from ipc import IpcServer
+from s0_meter import S0Meter
+from timespan import Timespan
+
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    """Register a benchmark returning the seconds per unit"""
+    def register(func):
+        BENCHMARKS[func.__name__.removeprefix("bench_")] = (func, unit)
+        return func
+    return register
+
+
+def measure(func, number, repeat=5):
+    """Return the best time per call of func in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+@benchmark("event")
+def bench_gpio_read_input_events():
+    """GpioMap.read_input_events mapping of edge events to S0 indexes"""
+    gpio = SimGpioMap()
+    batch = [(0, SimEdgeEvent(gpio.s0_pins[i % 8], i, i, i)) for i in range(64)]
+
+    def read():
+        gpio.pending = batch.copy()
+        gpio.read_input_events(0)
+    return measure(read, 2000) / len(batch)
+
+
+@benchmark("event")
+async def bench_dispatcher_fanout():
+    """S0EventDispatcher fan out to 4 queues per S0 input"""
+    events = 20000
+    gpio = SimGpioMap()
+    for i in range(events):
+        gpio.inject(i % 8, i)
+    queues = [asyncio.Queue() for _ in range(32)]
+    start = time.perf_counter()
+    dispatcher = S0EventDispatcher(gpio, 0.01)
+    for index, queue in enumerate(queues):
+        dispatcher.register_queue(index % 8, queue)
+    while sum(q.qsize() for q in queues) < events * 4:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    dispatcher.cancel = True
+    await dispatcher.task
+    return elapsed / events
+
+
+@benchmark("pulse")
+async def bench_meter_pulse():
+    """S0Meter.pulse"""
+    with tempfile.TemporaryDirectory() as tmp:
+        meter = S0Meter("bench", AppState(f"{tmp}/state.json"))
+    timestamps = itertools.count(0, 10**6)
+    result = measure(lambda: meter.pulse(next(timestamps)), 20000)
+    return result
+
+
+@benchmark("call")
+async def bench_meter_power():
+    """S0Meter.power"""
+    with tempfile.TemporaryDirectory() as tmp:
+        meter = S0Meter("bench", AppState(f"{tmp}/state.json"))
+    result = measure(lambda: meter.power, 20000)
+    return result
+
+
+@benchmark("read")
+async def bench_meter_shm_read():
+    """MeterShmReader.read of one meter including the pulse ring"""
+    with tempfile.TemporaryDirectory() as tmp:
+        meter = S0Meter("bench", AppState(f"{tmp}/state.json"))
+    writer = MeterShmWriter({"bench": meter}, "light-control-bench")
+    writer.slots["bench"].pulses(range(0, 64 * 10**6, 10**6))
+    with MeterShmReader("light-control-bench") as reader:
+        result = measure(lambda: reader.read(0), 20000)
+    writer.close()
+    return result
+
+
+@benchmark("day")
+def bench_pulse_log_reconcile():
+    """PulseLog.count_after over a day of 10 pulses/s per meter, 4 meters"""
+    with tempfile.TemporaryDirectory() as tmp:
+        logs = [PulseLog(f"{tmp}/{index}") for index in range(4)]
+        base = time.monotonic_ns()
+        pulses = range(base, base + DAY_NS, 10**8)
+        for log in logs:
+            for start in range(0, len(pulses), 4096):
+                log.pulses(pulses[start:start + 4096])
+            log.close()
+        after = logs[0].last - DAY_NS
+        return measure(lambda: [log.count_after(after) for log in logs], 1, 3)
+
+
+@benchmark("call")
+def bench_timespan_update():
+    """Timespan.update"""
+    timespan = Timespan(time.monotonic)
+    return measure(lambda: timespan.update(0, 600), 50000)
+
+
+@benchmark("trigger")
+async def bench_timed_relais_storm():
+    """TimedRelais.update rescheduling under a trigger storm"""
+    relais = TimedRelais("bench", SimGpioMap(), 0)
+    result = measure(lambda: relais.update(0, 600), 20000)
+    relais.timer.cancel()
+    return result
+
+
+@benchmark("store")
+def bench_app_state_store():
+    """AppState.store_state with 200 clients"""
+    class Client(Stateful):
+        """Minimal state client"""
+        def __init__(self, name):
+            self.name = name
+
+        @property
+        def state(self):
+            return State(self.name, {"total": 123456789})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_state = AppState(f"{tmp}/state.json")
+        for index in range(200):
+            app_state.register_client(Client(f"client_{index}"))
+        return measure(app_state.store_state, 20)
+
+
+@benchmark("tick")
+async def bench_newui_update_ui():
+    """newui.update_ui talking to an in process daemon"""
+    try:
+        import newui  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, f"{tmp}/state.json")
+        server = IpcServer(light_control, f"{tmp}/io.sock", interval=0.01)
+        tasks = [asyncio.create_task(light_control.io_main()),
+                 asyncio.create_task(server.serve())]
+        newui.light_control.path = f"{tmp}/io.sock"
+        tasks.append(asyncio.create_task(newui.light_control.run()))
+        while "meters" not in newui.light_control.state:
+            await asyncio.sleep(0.01)
+        ticks = 50
+        start = time.perf_counter()
+        for _ in range(ticks):
+            await newui.update_ui()
+        elapsed = time.perf_counter() - start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return elapsed / ticks
+
+
+def run(names):
+    """Run benchmarks, return dict of results"""
+    results = {}
+    for name in names:
+        func, unit = BENCHMARKS[name]
+        seconds = asyncio.run(func()) if asyncio.iscoroutinefunction(func) else func()
+        if seconds is None:
+            print(f"{name:28s} skipped")
+            continue
+        results[name] = {"unit": unit, "seconds": seconds}
+        print(f"{name:28s} {seconds * 1e6:10.3f}us/{unit}")
+    return results
+
+
+def commit():
+    """Return the short hash of the checked out commit"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, former_file):
+    """Print the change of results relative to a former result file"""
+    with open(former_file, encoding="utf-8") as former:
+        former = json.load(former)
+    print(f"\nCompared to {former['commit']}:")
+    for name, result in results.items():
+        if name in former["results"]:
+            ratio = result["seconds"] / former["results"][name]["seconds"]
+            print(f"{name:28s} {ratio:6.2f}x")
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"Benchmarks to run, default all: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="Result file, default bench/results/<commit>.json")
+    parser.add_argument("--compare", help="Former result file to compare with")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = run(args.benchmarks or BENCHMARKS)
+    head = commit()
+    write_result({
+        "commit": head,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }, args.output or ROOT / "bench" / "results" / f"{head}.json")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
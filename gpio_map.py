@@ -1,17 +1,29 @@
 """
 Map the relais, S0 inputs and PWM output of the I/O Shield
+
+The HW access packages (gpiod, rpi_hardware_pwm, RPi) are imported when the
+first GpioMap is created, not on import of this module. This keeps importing
+the I/O core cheap and allows using it with a simulated GPIO backend.
 """
 
+import select
+import time
+from collections import deque
 from enum import IntEnum
 from dataclasses import dataclass
-import gpiod
-from gpiod.line import Direction, Value, Edge
-from gpiod import EdgeEvent
-from rpi_hardware_pwm import HardwarePWM
-import RPi.version
+from typing import TYPE_CHECKING
 import version_check
 
-version_check.check_version(gpiod, "2.1.0")
+if TYPE_CHECKING:
+    import gpiod
+
+
+def __getattr__(name):
+    """Lazily provide the gpiod line enums Direction, Value and Edge"""
+    if name in ("Direction", "Value", "Edge"):
+        from gpiod import line  # pylint: disable=import-outside-toplevel
+        return getattr(line, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class RelaisState(IntEnum):
@@ -20,60 +32,117 @@ class RelaisState(IntEnum):
     OFF = 1
 
 
-@dataclass
+@dataclass(slots=True)
 class S0Event:
     """Extend gpiod::EdgeEvent with S0 index
 
     S0 index is provided to get upper layer code away from Raspberry PI pin
     naming schema. Enumeration is done based on a count starting as 0.
+
+    The trace slot is set if the event is traced, see latency_trace.
     """
     s0_index: int
-    event: EdgeEvent
+    event: "gpiod.EdgeEvent"
+    trace: int = -1
+
+
+@dataclass(frozen=True)
+class Shield:
+    """Pin assignment of one I/O shield or expander
+
+    Pins are line offsets on the gpiod chip. PWM channels are pairs of
+    hardware PWM channel and frequency.
+    """
+    chip_path: str
+    relais_pins: tuple
+    s0_pins: tuple
+    pwm_channels: tuple = ()
 
 
 class GpioMap():
     """Map I/O shield design to RPI GPIOs, provide common class
 
-    A single class for interfacing the I/O shield. Maps the GPIO-Pins to
+    A single class for interfacing the I/O shields. Maps the GPIO-Pins to
     relais and PWM outputs and S0 inputs. Uses gpiod and rpi_hardware_pwm
     packages for acessing HW.
 
+    Multiple shields, also on different chips, are mapped into one index
+    space. Relais, S0 inputs and PWMs are numbered in the order of the
+    shields. The S0 inputs of all shields are read by a single reader that
+    multiplexes the event file descriptors of all line requests.
+
     Arguments:
         consumer (str): Name of application registered with gpiod
+        shields (tuple[Shield]): Shields to map, default the S0 shield
     """
     RELAIS_PINS = (18, 23, 24, 25, 12, 16, 20, 21)
-    if RPi.version.board_type.startswith("Zero"):
-        S0_PINS = ( 4, 17, 27, 22, 5, 6, 19, 26)
-    else:
-        S0_PINS = (15, 17, 27, 22, 5, 6, 19, 26)
+    S0_PINS = (15, 17, 27, 22, 5, 6, 19, 26)
+    S0_PINS_ZERO = (4, 17, 27, 22, 5, 6, 19, 26)
     PWM_CHANNELS = ((1, 2000),)  # Channel 1, 2000Hz
     CHIP_PATH = "/dev/gpiochip0"
     S0_INDEX_LOOKUP = dict(zip(S0_PINS, range(len(S0_PINS))))
-
-    def __init__(self, consumer="GpioMap"):
-        self.relais = gpiod.request_lines(
-            self.CHIP_PATH,
-            consumer=consumer,
-            config={
-                l: gpiod.LineSettings(
-                    direction=Direction.OUTPUT,
-                    output_value=Value(RelaisState.OFF))
-                for l in self.RELAIS_PINS
-            },
-        )
+    GPIOD_MIN_VERSION = "2.1.0"
+
+    def __init__(self, consumer="GpioMap", shields=None):
+        # pylint: disable=import-outside-toplevel
+        import gpiod
+        from gpiod.line import Direction, Value, Edge
+        from rpi_hardware_pwm import HardwarePWM
+        import RPi.version
+
+        version_check.check_version(gpiod, self.GPIOD_MIN_VERSION)
+        self._value = Value
+
+        if shields is None:
+            s0_pins = self.S0_PINS_ZERO \
+                if RPi.version.board_type.startswith("Zero") else self.S0_PINS
+            shields = (Shield(self.CHIP_PATH, self.RELAIS_PINS, s0_pins,
+                              self.PWM_CHANNELS),)
+        self.shields = tuple(shields)
+        self.relais_pins = tuple(p for s in self.shields for p in s.relais_pins)
+        self.s0_pins = tuple(p for s in self.shields for p in s.s0_pins)
+        self.pwm_channels = tuple(c for s in self.shields for c in s.pwm_channels)
+
+        # Relais index to (line request, line offset)
+        self.relais_lines = []
+        self.relais_requests = []
+        # Event fd to (line request, line offset to S0 index)
+        self.s0_requests = {}
+        self.poll = select.poll()
+        for shield in self.shields:
+            if shield.relais_pins:
+                relais = gpiod.request_lines(
+                    shield.chip_path,
+                    consumer=consumer,
+                    config={
+                        pin: gpiod.LineSettings(
+                            direction=Direction.OUTPUT,
+                            output_value=Value(RelaisState.OFF))
+                        for pin in shield.relais_pins
+                    },
+                )
+                self.relais_requests.append((relais, shield.relais_pins))
+                self.relais_lines += [(relais, pin) for pin in shield.relais_pins]
+
+            if shield.s0_pins:
+                s0s = gpiod.request_lines(
+                    shield.chip_path,
+                    consumer=consumer,
+                    config={pin: gpiod.LineSettings(
+                        edge_detection=Edge.RISING) for pin in shield.s0_pins},
+                )
+                base = sum(len(lookup) for _, lookup in self.s0_requests.values())
+                self.s0_requests[s0s.fd] = (
+                    s0s, {pin: base + i for i, pin in enumerate(shield.s0_pins)})
+                self.poll.register(s0s.fd, select.POLLIN)
 
         # Shadow of release states. The state of an GPIO ouput can not be read
         # using gpiod.
-        self.relais_states = [RelaisState.OFF] * len(self.RELAIS_PINS)
+        self.relais_states = [RelaisState.OFF] * len(self.relais_pins)
+        # CLOCK_MONOTONIC ns of recent relais switching, the clock of edges
+        self.switch_times = deque(maxlen=16)
 
-        self.s0s = gpiod.request_lines(
-            self.CHIP_PATH,
-            consumer=consumer,
-            config={l: gpiod.LineSettings(
-                edge_detection=Edge.RISING) for l in self.S0_PINS},
-        )
-
-        self.pwms = list(map(lambda p: HardwarePWM(*p), self.PWM_CHANNELS))
+        self.pwms = list(map(lambda p: HardwarePWM(*p), self.pwm_channels))
         for pwm in self.pwms:
             pwm.start(100)
 
@@ -81,8 +150,8 @@ class GpioMap():
         return self
 
     def __exit__(self, exp_type, value, traceback):
-        self.relais.set_values({r: Value(RelaisState.OFF)
-                                for r in self.RELAIS_PINS})
+        for request, pins in self.relais_requests:
+            request.set_values({r: self._value(RelaisState.OFF) for r in pins})
         list(map(lambda p: p.stop(), self.pwms))
         return exp_type is None
 
@@ -90,11 +159,13 @@ class GpioMap():
         """Set the state of one relais
 
         Arguments:
-        relais (int): Index of the Relais, see self.RELAIS_PINS
+        relais (int): Index of the Relais, see self.relais_pins
         state (RelaisState): RelaisState.ON or RelaisState.OFF
         """
         self.relais_states[relais] = state
-        self.relais.set_value(self.RELAIS_PINS[relais], Value(state))
+        request, line = self.relais_lines[relais]
+        request.set_value(line, self._value(state))
+        self.switch_times.append(time.monotonic_ns())
 
     def get_relais(self, relais):
         """Get the state of a relais
@@ -103,7 +174,7 @@ class GpioMap():
         tracked in a instance variable to enable state query.
 
         Arguments:
-        relais (int): Index of the Relais, see self.RELAIS_PINS
+        relais (int): Index of the Relais, see self.relais_pins
         """
         return self.relais_states[relais]
 
@@ -111,7 +182,7 @@ class GpioMap():
         """Set the duty cycle of a PWM
 
         Arguments:
-        pwm (int): Index of PWM, see self.PWM_CHANNELS
+        pwm (int): Index of PWM, see self.pwm_channels
         value (int): Duty cycle in percent, max is 100
         """
         value = int(min(100, max(0, value)))
@@ -120,7 +191,8 @@ class GpioMap():
     def read_input_events(self, wait_timeout=0):
         """Read edge events from gpiod. Map event to S0 index
 
-        This is a blocking call for reading edge events from S0 inputs.
+        This is a blocking call for reading edge events from S0 inputs. Waits
+        for events on the line requests of all shields at once.
 
         Arguments:
         wait_timeout (int): Time to wait for an event. None = infinite wait
@@ -128,7 +200,50 @@ class GpioMap():
         Returns:
         list[S0Event]: The list is empty on timeout
         """
-        if self.s0s.wait_edge_events(wait_timeout):
-            events = self.s0s.read_edge_events()
-            return [S0Event(self.S0_INDEX_LOOKUP[e.line_offset], e) for e in events]
-        return []
+        timeout = None if wait_timeout is None else int(wait_timeout * 1000)
+        events = []
+        for fd, _ in self.poll.poll(timeout):
+            request, lookup = self.s0_requests[fd]
+            events += [S0Event(lookup[e.line_offset], e)
+                       for e in request.read_edge_events()]
+        return events
+
+    def read_input_timestamps(self, timestamps, counts, wanted, wait_timeout=0):
+        """Read edge events, write timestamps into per S0 input buffers
+
+        Ingest variant of read_input_events. For S0 inputs having a buffer,
+        the kernel timestamp is written into the buffer, no objects are
+        created. S0Events are only created for inputs marked as wanted.
+
+        Arguments:
+        timestamps (list[array]): Per S0 index an array('q') or None
+        counts (list[int]): Per S0 index, incremented by the events read.
+            Also the write position of the buffer, reset by the caller.
+        wanted (list[bool]): Per S0 index, create S0Events
+        wait_timeout (int): Time to wait for an event. None = infinite wait
+
+        Returns:
+        list[S0Event]: Events of wanted S0 inputs
+        """
+        timeout = None if wait_timeout is None else int(wait_timeout * 1000)
+        events = []
+        for fd, _ in self.poll.poll(timeout):
+            request, lookup = self.s0_requests[fd]
+            for edge in request.read_edge_events():
+                s0_index = lookup[edge.line_offset]
+                _ingest(s0_index, edge, timestamps, counts)
+                if wanted[s0_index]:
+                    events.append(S0Event(s0_index, edge))
+        return events
+
+
+def _ingest(s0_index, edge, timestamps, counts):
+    """Write the timestamp of an edge into the buffer of its S0 input"""
+    count = counts[s0_index]
+    buffer = timestamps[s0_index]
+    if buffer is not None:
+        if count == len(buffer):
+            # Grow on overflow only, buffers are sized for a usual batch
+            buffer.extend(buffer)
+        buffer[count] = edge.timestamp_ns
+    counts[s0_index] = count + 1
@@ -0,0 +1,128 @@
+"""Simulated I/O shield for running the I/O core without hardware
+
+SimGpioMap provides the interface of gpio_map.GpioMap. S0 edges are injected
+by calling inject() from any thread, relais and PWM outputs are recorded.
+"""
+import threading
+import time
+from collections import deque
+from gpio_map import GpioMap, RelaisState, S0Event, Shield, _ingest
+
+
+class SimEdgeEvent:
+    """Stand-in for gpiod.EdgeEvent of a rising edge"""
+    __slots__ = ("line_offset", "timestamp_ns", "global_seqno", "line_seqno")
+
+    def __init__(self, line_offset, timestamp_ns, global_seqno, line_seqno):
+        self.line_offset = line_offset
+        self.timestamp_ns = timestamp_ns
+        self.global_seqno = global_seqno
+        self.line_seqno = line_seqno
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(line_offset={self.line_offset}, "\
+               f"timestamp_ns={self.timestamp_ns})"
+
+
+class SimGpioMap:
+    """Simulated GpioMap
+
+    Arguments:
+        consumer (str): Name of application, unused
+        loopback (bool): Inject an S0 edge when a relais is switched on, like
+            the HW test setup wiring relais contacts to S0 inputs 1:1
+        shields (tuple[Shield]): Shields to simulate, default the S0 shield
+        now_func (callable): Monotonic clock in ns of edges and relais
+            switches, default time.monotonic_ns
+    """
+    def __init__(self, consumer="SimGpioMap", loopback=False, shields=None, now_func=None):
+        self.consumer = consumer
+        self.loopback = loopback
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        if shields is None:
+            shields = (Shield(GpioMap.CHIP_PATH, GpioMap.RELAIS_PINS,
+                              GpioMap.S0_PINS, GpioMap.PWM_CHANNELS),)
+        self.shields = tuple(shields)
+        self.relais_pins = tuple(p for s in self.shields for p in s.relais_pins)
+        self.s0_pins = tuple(p for s in self.shields for p in s.s0_pins)
+        self.pwm_channels = tuple(c for s in self.shields for c in s.pwm_channels)
+        # S0 index to (shield, line offset) and back
+        self.s0_lines = [(shield, line) for shield, s in enumerate(self.shields)
+                         for line in s.s0_pins]
+        self.s0_lookup = {line: index for index, line in enumerate(self.s0_lines)}
+        self.relais_states = [RelaisState.OFF] * len(self.relais_pins)
+        self.pwm_duty = [100] * len(self.pwm_channels)
+        self.switch_times = deque(maxlen=16)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.seqno = 0
+        self.line_seqno = [0] * len(self.s0_pins)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exp_type, value, traceback):
+        self.relais_states = [RelaisState.OFF] * len(self.relais_pins)
+        return exp_type is None
+
+    def inject(self, s0_index, timestamp_ns=None):
+        """Inject a rising edge at an S0 input
+
+        Arguments:
+            s0_index (int): Index of the S0 input
+            timestamp_ns (int): Edge time, CLOCK_MONOTONIC. Default is now.
+        """
+        timestamp_ns = self.now_func() if timestamp_ns is None else timestamp_ns
+        shield, line = self.s0_lines[s0_index]
+        with self.condition:
+            self.seqno += 1
+            self.line_seqno[s0_index] += 1
+            self.pending.append((shield, SimEdgeEvent(
+                line, timestamp_ns, self.seqno, self.line_seqno[s0_index])))
+            self.condition.notify()
+
+    def set_relais(self, relais, state):
+        """Set the state of one relais"""
+        self.relais_states[relais] = state
+        self.switch_times.append(self.now_func())
+        if self.loopback and state == RelaisState.ON and relais < len(self.s0_pins):
+            self.inject(relais)
+
+    def get_relais(self, relais):
+        """Get the state of a relais"""
+        return self.relais_states[relais]
+
+    def set_pwm(self, pwm, value):
+        """Set the duty cycle of a PWM"""
+        self.pwm_duty[pwm] = int(min(100, max(0, value)))
+
+    def read_input_events(self, wait_timeout=0):
+        """Return injected edge events mapped to S0 index, see GpioMap"""
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(wait_timeout)
+            events, self.pending = self.pending, []
+        lookup = self.s0_lookup
+        return [S0Event(lookup[(shield, e.line_offset)], e) for shield, e in events]
+
+    def read_input_timestamps(self, timestamps, counts, wanted, wait_timeout=0):
+        """Ingest injected edges into per S0 input buffers, see GpioMap"""
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(wait_timeout)
+            pending, self.pending = self.pending, []
+        lookup = self.s0_lookup
+        events = []
+        for shield, edge in pending:
+            s0_index = lookup[(shield, edge.line_offset)]
+            _ingest(s0_index, edge, timestamps, counts)
+            if wanted[s0_index]:
+                events.append(S0Event(s0_index, edge))
+        return events
+
+
+def sim_shields(count):
+    """Return count copies of the S0 shield on separate chips"""
+    return tuple(Shield(f"/dev/gpiochip{chip}", GpioMap.RELAIS_PINS,
+                        GpioMap.S0_PINS, GpioMap.PWM_CHANNELS if chip == 0 else ())
+                 for chip in range(count))
@@ -4,10 +4,16 @@ GpioMaps is mapping I/O pins to local indexes. This module provides a async
 based interface to control relais and handle incomping edge events.
 """
 from enum import IntEnum
+from array import array
 import asyncio
+import time
 from gpio_map import GpioMap, RelaisState, S0Event
 from timespan import Timespan
 from sun import SunEvent, SunEventType
+from latency_trace import LatencyTrace
+from app_state import State, Stateful
+from supervisor import create_task
+from memory_budget import put_latest, LatestQueue
 
 
 class RelaisMode(IntEnum):
@@ -17,20 +23,119 @@ class RelaisMode(IntEnum):
     AUTO = 2
 
 
+class PulseFilter:
+    """Validation of the edges of an S0 input by their kernel timestamps
+
+    Rejects edges closer to the last accepted one than a meter can pulse,
+    e.g. contact bounce, and edges coinciding with switching of our own
+    relais, which may couple into the S0 lines. Applies to the pulse sinks
+    of meter inputs only, see S0EventDispatcher.
+
+    Arguments:
+        min_interval (float): Minimum seconds between two pulses
+        blanking (tuple): Seconds before and after a relais switch in which
+            edges are rejected
+    """
+    def __init__(self, min_interval=0., blanking=(0.001, 0.02)):
+        self.min_interval = int(min_interval * 1e9)
+        self.before, self.after = (int(b * 1e9) for b in blanking)
+        self.last = -1 << 62
+        # Metrics: edges rejected as too close, as coinciding with switching
+        self.rejected_interval = 0
+        self.rejected_switching = 0
+
+    @classmethod
+    def for_meter(cls, pulse_per_kwh, max_power, blanking=(0.001, 0.02)):
+        """Return the filter of a meter, not pulsing faster than at max_power
+
+        Arguments:
+            pulse_per_kwh (int): Pulses of the meter per kWh
+            max_power (float): Maximum power of the meter in W
+            blanking (tuple): See PulseFilter
+        """
+        return cls(3.6e6 / pulse_per_kwh / max_power, blanking)
+
+    def apply(self, timestamps, count, switch_times):
+        """Filter a batch of timestamps in place
+
+        Accepted timestamps are moved to the front of the buffer in order.
+
+        Arguments:
+            timestamps (array): Buffer of timestamps in ns
+            count (int): Timestamps in the buffer
+            switch_times (iterable): Times of relais switches in ns
+
+        Returns the amount of accepted timestamps.
+        """
+        if count == 0:
+            return 0
+        first = timestamps[0]
+        # Only switching from shortly before the batch matters
+        windows = [(t - self.before, t + self.after)
+                   for t in switch_times if t + self.after >= first]
+        last = self.last
+        min_interval = self.min_interval
+        accepted = 0
+        for index in range(count):
+            timestamp = timestamps[index]
+            if windows and any(lo <= timestamp <= hi for lo, hi in windows):
+                self.rejected_switching += 1
+            elif timestamp - last < min_interval:
+                self.rejected_interval += 1
+            else:
+                timestamps[accepted] = timestamp
+                accepted += 1
+                last = timestamp
+        self.last = last
+        return accepted
+
+
 class S0EventDispatcher:
     """Async interface to GPIO and adding of input/output functionality
 
+    Events are delivered in two ways. Queues registered for an S0 input
+    receive an S0Event object per edge. Pulse sinks registered for an S0
+    input receive the kernel timestamps of all edges of a batch at once.
+    The timestamps are written into a preallocated buffer per S0 input, no
+    objects are created per edge. A PulseFilter of an S0 input validates
+    the timestamps before the sinks receive them. Queued S0Events are not
+    filtered: queues feed detectors, whose edges have no pulse rate to
+    validate, and a repeated trigger only extends the on window.
+
     Arguments:
         gpio (GpioMap): GPIO abstraction to use for accessing shield
+        tracer (LatencyTrace): Trace latency of events if given
+        supervisor (Supervisor): Restart the dispatching if it fails
+        read (bool): Read the GPIO in a task. If False the owner calls
+            read_now(), e.g. a simulation in virtual time.
     """
-    def __init__(self, gpio=None, wait_timeout=1):
+    BUFFER_SIZE = 256
+
+    def __init__(self, gpio=None, wait_timeout=1, tracer=None, supervisor=None, read=True):
+        # pylint: disable=too-many-arguments
         self.gpio = gpio if gpio is not None else GpioMap("S0EventDispatcher")
-        self.queues = [[] for s in range(len(gpio.S0_PINS))]
+        self.tracer = tracer
+        self.queues = [[] for s in range(len(self.gpio.s0_pins))]
+        self.sinks = [[] for s in range(len(self.gpio.s0_pins))]
+        # Ingest state: timestamp buffers, edges per batch, inputs with queues
+        self.timestamps = [None] * len(self.gpio.s0_pins)
+        self.counts = [0] * len(self.gpio.s0_pins)
+        self.wanted = [False] * len(self.gpio.s0_pins)
+        self.filters = [None] * len(self.gpio.s0_pins)
+        # Metrics: events and largest batch per S0 input, executor hand over time
+        self.event_counts = [0] * len(self.gpio.s0_pins)
+        self.batch_max = [0] * len(self.gpio.s0_pins)
+        self.executor_wait_ns = 0
+        self.executor_wait_max_ns = 0
+        self.executor_reads = 0
+        # Metrics: events dropped from full queues
+        self.dropped = 0
         self.cancel = False
-        self.task = asyncio.create_task(
-            self.__handle_detector_events(wait_timeout),
-            name=self.__class__,
-        )
+        self.task = create_task(
+            "S0EventDispatcher",
+            lambda: self.__handle_detector_events(wait_timeout),
+            supervisor,
+        ) if read else None
 
     async def __handle_detector_events(self, wait_timeout=1):
         """Add this method to your asyncio loop to receive edge events
@@ -44,17 +149,144 @@ class S0EventDispatcher:
         loop = asyncio.get_running_loop()
         while not self.cancel:
             # await handles exceptions and signals
-            for event in await loop.run_in_executor(
+            events, read_ns = await loop.run_in_executor(
                 None,
-                self.gpio.read_input_events,
+                self.__read_input_events,
                 wait_timeout
-            ):
-                for queue in self.queues[event.s0_index]:
-                    await queue.put(event)
+            )
+            # Time from events being read until the loop picks them up
+            wait_ns = time.monotonic_ns() - read_ns
+            self.executor_wait_ns += wait_ns
+            self.executor_wait_max_ns = max(self.executor_wait_max_ns, wait_ns)
+            self.executor_reads += 1
+            self.__dispatch(events)
+
+    def read_now(self):
+        """Read and dispatch the pending edges without waiting"""
+        self.__dispatch(self.gpio.read_input_timestamps(
+            self.timestamps, self.counts, self.wanted, 0))
+
+    def __dispatch(self, events):
+        """Pass the ingested timestamps to the sinks, the events to the queues"""
+        counts = self.counts
+        for s0_index, count in enumerate(counts):
+            if count:
+                counts[s0_index] = 0
+                self.__dispatch_pulses(s0_index, count)
+        self.__dispatch_events(events)
+
+    def __dispatch_pulses(self, s0_index, count):
+        """Count a batch of an S0 input, pass its valid timestamps to the sinks"""
+        self.event_counts[s0_index] += count
+        if count > self.batch_max[s0_index]:
+            self.batch_max[s0_index] = count
+        if not self.sinks[s0_index]:
+            # No buffer, the queues take unfiltered S0Events
+            return
+        pulse_filter = self.filters[s0_index]
+        if pulse_filter is not None:
+            count = pulse_filter.apply(self.timestamps[s0_index], count,
+                                       self.gpio.switch_times)
+        if count:
+            with memoryview(self.timestamps[s0_index]) as view:
+                for sink in self.sinks[s0_index]:
+                    sink.pulses(view[:count])
+
+    def __dispatch_events(self, events):
+        """Trace the S0Events and push them to the queues of their inputs"""
+        for event in events:
+            if self.tracer is not None:
+                event.trace = self.tracer.begin(event.event.timestamp_ns)
+            for queue in self.queues[event.s0_index]:
+                # A bounded queue keeps the latest events
+                if put_latest(queue, event):
+                    self.dropped += 1
+
+    def __read_input_events(self, wait_timeout):
+        """Read events in executor thread, return events and time of read"""
+        events = self.gpio.read_input_timestamps(
+            self.timestamps, self.counts, self.wanted, wait_timeout)
+        return events, time.monotonic_ns()
 
     def register_queue(self, s0_index, queue):
         """Register a queue to push incoming S0 events"""
         self.queues[s0_index].append(queue)
+        self.wanted[s0_index] = True
+
+    def set_pulse_filter(self, s0_index, pulse_filter):
+        """Validate the timestamps of an S0 input before passing them to sinks
+
+        The filter is not applied while the input has no pulse sink.
+        """
+        self.filters[s0_index] = pulse_filter
+
+    def register_pulse_sink(self, s0_index, sink):
+        """Register a sink receiving the timestamps of incoming S0 edges
+
+        The sink's pulses(timestamps) is called once per batch of edges with
+        a sequence of kernel timestamps in ns. The sequence is only valid
+        during the call.
+        """
+        self.sinks[s0_index].append(sink)
+        if self.timestamps[s0_index] is None:
+            self.timestamps[s0_index] = array("q", bytes(8 * self.BUFFER_SIZE))
+
+
+class RelaisGuard:
+    """Minimum dwell times of a relais, switching in between is coalesced
+
+    A switch requested before the dwell time of the current state is over
+    is deferred until then. A request returning to the current state
+    meanwhile drops the deferred switch, both switches are suppressed.
+
+    Arguments:
+        min_on (float): Seconds the relais stays on at least
+        min_off (float): Seconds the relais stays off at least
+    """
+    def __init__(self, min_on=0., min_off=0.):
+        self.min_on = min_on
+        self.min_off = min_off
+        self.since = float("-inf")
+        self.pending = None
+        self.requested = None
+        # Metrics: requested state changes that never reached the relais
+        self.suppressed = 0
+
+    def request(self, state, current, switch, urgent=False):
+        """Switch at once or when the dwell time is over
+
+        Arguments:
+            state (RelaisState): Requested state
+            current (RelaisState): Current state of the relais
+            switch (callable): Switches the relais to the passed state
+            urgent (bool): Switch at once, regardless of the dwell time
+        """
+        loop = asyncio.get_running_loop()
+        if self.pending is not None:
+            if state == self.requested and not urgent:
+                return
+            self.pending.cancel()
+            self.pending = None
+            if state == current:
+                # Back to the current state, neither switch happens
+                self.suppressed += 2
+                return
+        elif state == current:
+            return
+        dwell = self.min_on if current == RelaisState.ON else self.min_off
+        ready = self.since + dwell
+        now = loop.time()
+        if urgent or now >= ready:
+            self.since = now
+            switch(state)
+        else:
+            self.requested = state
+            self.pending = loop.call_at(ready, self.__switch_pending, switch)
+
+    def __switch_pending(self, switch):
+        self.pending = None
+        self.since = asyncio.get_running_loop().time()
+        switch(self.requested)
 
 
 class TimedRelais:
@@ -67,18 +299,64 @@ class TimedRelais:
         name (str): Name for the devicd controlled by relais
         gpio (GpioMap): Gpio to be used for controlling the relais
         relais (int): Index of the relais inside gpio
+        tracer (LatencyTrace): Trace latency of triggers if given
+        journal (Journal): Record switching and mode changes if given
+        app_state (AppState): Persist mode and on window, restored at once
+        guard (RelaisGuard): Minimum dwell times of the relais. Switching
+            on by a trigger is not delayed.
+        monitor (LampMonitor): Reported the actual state changes if given
+        wall_func (callable): Wall clock in s since the epoch of the persisted
+            on window, default time.time
     """
 
-    RELAIS = range(len(GpioMap.RELAIS_PINS))
-
-    def __init__(self, name, gpio, relais):
+    def __init__(self, name, gpio, relais, tracer=None, journal=None, app_state=None,
+                 guard=None, monitor=None, wall_func=None):
+        # pylint: disable=too-many-arguments
         self.name = name
+        self.guard = guard
+        self.monitor = monitor
+        self.wall_func = wall_func if wall_func is not None else time.time
+        self.tracer = tracer
+        self.journal = journal
+        self.trace = -1
         self.gpio = gpio
         self.timer = None
         self.finished_event = asyncio.Event()
         self.timespan = Timespan(asyncio.get_running_loop().time)
         self.relais = relais
         self._mode = RelaisMode.AUTO
+        # Metrics: relais switches, timer reschedules in update()
+        self.switch_count = 0
+        self.reschedule_count = 0
+        self.app_state = None
+        if app_state is not None:
+            self._register_state(app_state)
+        self.app_state = app_state
+
+    def _register_state(self, app_state):
+        """Restore mode and resume an on window that is still ahead"""
+        state = app_state.get_state(self.name)
+        if state is not None:
+            self.mode = RelaisMode[state.state["mode"]]
+            if state.state["window"] is not None:
+                start, stop = state.state["window"]
+                now = self.wall_func()
+                if stop > now:
+                    self.update(max(0., start - now), stop - max(start, now))
+                    if start <= now:
+                        # Switch on at once, not after the rest of the startup
+                        self.timer.cancel()
+                        self.timed_on_action()
+        app_state.register_client(_RelaisStateClient(self))
+
+    def persistent_state(self):
+        """Return mode and pending or active on window in wall clock time"""
+        window = None
+        now = self.timespan.now_func()
+        if self.timespan.stop > now:
+            offset = self.wall_func() - now
+            window = [self.timespan.start + offset, self.timespan.stop + offset]
+        return {"mode": self._mode.name, "window": window}
 
     def __repr__(self):
         return f"({self.__class__.__module__}.{self.__class__.__qualname__} "\
@@ -96,37 +374,95 @@ class TimedRelais:
         """Set the mode of the Relais"""
         if self._mode != mode:
             self._mode = mode
+            if self.journal is not None:
+                self.journal.record(self.name, "mode", mode=mode.name)
+            if self.app_state is not None:
+                self.app_state.request_store()
             if self._mode == RelaisMode.ON:
-                self.gpio.set_relais(self.relais, RelaisState.ON)
+                self.set_state(RelaisState.ON)
             elif self._mode == RelaisMode.OFF:
-                self.gpio.set_relais(self.relais, RelaisState.OFF)
+                self.set_state(RelaisState.OFF)
             elif self._mode == RelaisMode.AUTO:
-                self.gpio.set_relais(self.relais, RelaisState.OFF)
+                self.set_state(RelaisState.OFF)
 
     @property
     def state(self):
         """Return the current state of the relais"""
         return self.gpio.get_relais(self.relais)
 
+    def set_state(self, state, urgent=False):
+        """Switch the relais through the guard if any
+
+        Arguments:
+            state (RelaisState): State to switch to
+            urgent (bool): Bypass the dwell time of the guard
+        """
+        if self.guard is not None:
+            self.guard.request(state, self.state, self.__switch, urgent)
+        else:
+            self.__switch(state)
+
+    def __switch(self, state):
+        """Switch the relais, count actual state changes"""
+        if self.gpio.get_relais(self.relais) != state:
+            self.switch_count += 1
+            if self.journal is not None:
+                self.journal.record(self.name, "relais", state=state.name,
+                                    mode=self._mode.name)
+            if self.monitor is not None:
+                self.monitor.switched(self.name, state == RelaisState.ON)
+        self.gpio.set_relais(self.relais, state)
+
     def timed_off_action(self):
         """Turn the relais off, end of time-on-action"""
         if self._mode == RelaisMode.AUTO:
-            self.gpio.set_relais(self.relais, RelaisState.OFF)
+            self.set_state(RelaisState.OFF)
         self.finished_event.set()
 
     def timed_on_action(self):
         """Turn the relais off, plan off action. Intermediate time-on-action"""
         if self._mode == RelaisMode.AUTO:
-            self.gpio.set_relais(self.relais, RelaisState.ON)
+            self.set_state(RelaisState.ON, urgent=True)
+            if self.trace >= 0:
+                self.__trace_on_action()
             loop = asyncio.get_running_loop()
             self.timer = loop.call_at(
                 self.timespan.stop, self.timed_off_action)
 
-    def update(self, delay, duration):
-        """Update the pending action, create a new one if no one is running"""
+    def __trace_on_action(self):
+        """Trace switching on, excluding the intended delay of the trigger
+
+        Only the first relais switched by a traced event is recorded.
+        """
+        if self.tracer.stage_time(self.trace, LatencyTrace.RELAIS):
+            self.trace = -1
+            return
+        update_ns = self.tracer.stage_time(self.trace, LatencyTrace.UPDATE)
+        planned_ns = max(update_ns, int(self.timespan.start * 1e9))
+        self.tracer.mark(self.trace, LatencyTrace.RELAIS,
+                         update_ns + time.monotonic_ns() - planned_ns)
+        self.trace = -1
+
+    def update(self, delay, duration, trace=-1):
+        """Update the pending action, create a new one if no one is running
+
+        Arguments:
+            delay (float): Delay of switching on in seconds
+            duration (float): Time to stay on in seconds
+            trace (int): Trace slot of the triggering S0Event
+        """
+        window = (self.timespan.start, self.timespan.stop)
         self.timespan.update(delay, duration)
+        # Persist a started or extended window, resumed after a power loss
+        if self.app_state is not None and window != (self.timespan.start, self.timespan.stop):
+            self.app_state.request_store()
         if self.timer is not None:
             self.timer.cancel()
+            self.reschedule_count += 1
+        # An untraced update, e.g. of a schedule, is not the traced event's
+        self.trace = trace if self.tracer is not None else -1
+        if self.trace >= 0:
+            self.tracer.mark(trace, LatencyTrace.UPDATE)
         self.finished_event.clear()
         loop = asyncio.get_running_loop()
         self.timer = loop.call_at(self.timespan.start, self.timed_on_action)
@@ -142,12 +478,22 @@ class TimedRelais:
         Instantiate this class for each known relais and call update() for
         each instance.
         """
-        relais = [cls(f"Test_{r}", gpio, r) for r in cls.RELAIS]
+        relais = [cls(f"Test_{r}", gpio, r) for r in range(len(gpio.relais_pins))]
         _ = list(map(lambda t: t[1].update(t[0], 0.5), enumerate(relais)))
         await asyncio.gather(*[r.wait() for r in relais])
 
 
-class S0Detector():
+class _RelaisStateClient(Stateful):
+    """App state client of a TimedRelais, its state property is the relais"""
+    def __init__(self, relais):
+        self.relais = relais
+
+    @property
+    def state(self):
+        return State(self.relais.name, self.relais.persistent_state())
+
+
+class S0Detector(Stateful):
     """Control a set of relais on receiving S0Event
 
     Receive Events from S0 inputs. As a event occurs, trigger TimedRelais from
@@ -157,24 +503,70 @@ class S0Detector():
     An S0Detector can be masked, means it is no longer reacting to incoming
     S0Events. The masking is set/unset automatically based on incomiung
     SUN_SET/SUN_RISE events.
+
+    Arguments:
+        name (str): Name of the detector
+        relais_trigger (tuple): (TimedRelais, delay, duration) to trigger
+        tracer (LatencyTrace): Trace latency of events if given
+        journal (Journal): Record triggers, sun events and mask changes if given
+        app_state (AppState): Persist the mask, restored at once
+        supervisor (Supervisor): Restart the event handling if it fails
+        queue_size (int): Bound of the S0Events queued, default unbounded
+        activity (DetectorActivity): Count the triggers if given
     """
-    def __init__(self, name, relais_trigger):
+    def __init__(self, name, relais_trigger, tracer=None, journal=None, app_state=None,
+                 supervisor=None, queue_size=0, activity=None):
+        # pylint: disable=too-many-arguments
         self.name = name
-        self.event_queue = asyncio.Queue()
+        self.tracer = tracer
+        self.activity = activity
+        self.journal = journal
+        self.event_queue = LatestQueue(queue_size, S0Event)
         self.trigger = relais_trigger
-        self.task = asyncio.create_task(self.__handle_s0_events(), name=name)
+        self.task = create_task(name, self.__handle_s0_events, supervisor)
         self.cancel = False
-        self.mask = False
+        self.__masked = False
+        self.sun = None
+        self.restored_sun = None
+        self.app_state = app_state
+        if app_state is not None:
+            self._register_state(app_state)
+
+    def _register_state(self, app_state):
+        state = app_state.get_state(self.name)
+        if state is not None:
+            self.__masked = state.state["mask"]
+            self.sun = self.restored_sun = state.state["sun"]
+        app_state.register_client(self)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        return State(self.name, {"mask": self.mask, "sun": self.sun})
 
     async def __handle_s0_events(self):
         while not self.cancel:
             event = await self.event_queue.get()
             match event:
                 case S0Event():
+                    if event.trace >= 0 and self.tracer is not None:
+                        self.tracer.mark(event.trace, LatencyTrace.DETECTOR)
+                    if self.journal is not None:
+                        self.journal.record(self.name, "trigger", masked=self.mask)
+                    if self.activity is not None:
+                        self.activity.trigger(event.event.timestamp_ns)
                     if not self.mask:
                         for relais, delay, duration in self.trigger:
-                            relais.update(delay, duration)
+                            relais.update(delay, duration, event.trace)
                 case SunEvent():
+                    if self.journal is not None:
+                        self.journal.record(self.name, "sun", type=event.type.name)
+                    restored, self.restored_sun = self.restored_sun, None
+                    self.sun = event.type.name
+                    if event.type.name == restored:
+                        # Sun state as before the restart, keep the restored
+                        # mask and relais modes, they may be set by the UI
+                        continue
                     match event.type:
                         case SunEventType.SUN_RISE:
                             self.mask = True
@@ -191,6 +583,11 @@ class S0Detector():
     @mask.setter
     def mask(self, other):
         """Set the mask state"""
+        if other != self.__masked:
+            if self.journal is not None:
+                self.journal.record(self.name, "mask", mask=other)
+            if self.app_state is not None:
+                self.app_state.request_store()
         self.__masked = other
 
     @property
@@ -201,16 +598,45 @@ class S0Detector():
         """
         return self.event_queue
 
-class Dimmer:
-    """Control a (the one) dimming output"""
-    def __init__(self, name, gpio, pwm=0):
+
+class Dimmer(Stateful):
+    """Control a (the one) dimming output
+
+    Arguments:
+        name (str): Name of the dimmer
+        gpio (GpioMap): Gpio providing the PWM
+        pwm (int): Index of the PWM inside gpio
+        app_state (AppState): Persist the duty cycle, restored at once
+        supervisor (Supervisor): Restart the event handling if it fails
+        queue_size (int): Bound of the S0Events queued, default unbounded
+    """
+    def __init__(self, name, gpio, pwm=0, app_state=None, supervisor=None, queue_size=0):
+        # pylint: disable=too-many-arguments
         self.name = name
         self.gpio = gpio
         self.pwm = pwm
+        self.app_state = None
         self.duty = 100
-        self.event_queue = asyncio.Queue()
+        self.sun = None
+        self.restored_sun = None
+        self.event_queue = LatestQueue(queue_size, S0Event)
         self.cancel = False
-        self.task = asyncio.create_task(self.__handle_events(), name=name)
+        self.task = create_task(name, self.__handle_events, supervisor)
+        if app_state is not None:
+            self._register_state(app_state)
+        self.app_state = app_state
+
+    def _register_state(self, app_state):
+        state = app_state.get_state(self.name)
+        if state is not None:
+            self.duty = state.state["duty"]
+            self.sun = self.restored_sun = state.state["sun"]
+        app_state.register_client(self)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        return State(self.name, {"duty": self.duty, "sun": self.sun})
 
     @property
     def duty(self):
@@ -223,6 +649,8 @@ class Dimmer:
         # limit the range....
         self.__duty = min(100, max(0, duty))
         self.gpio.set_pwm(self.pwm, self.__duty)
+        if self.app_state is not None:
+            self.app_state.request_store()
 
     def set_duty(self, duty):
         """Set the duty cycle"""
@@ -241,6 +669,11 @@ class Dimmer:
             event = await self.event_queue.get()
             match event:
                 case SunEvent():
+                    restored, self.restored_sun = self.restored_sun, None
+                    self.sun = event.type.name
+                    if event.type.name == restored:
+                        # Sun state as before the restart, keep the duty
+                        continue
                     match event.type:
                         case SunEventType.SUN_RISE:
                             self.duty = 100
@@ -0,0 +1,336 @@
+"""Unix socket protocol between the headless I/O daemon and UI clients
+
+Messages are compact JSON objects, one per line. Clients send commands:
+
+    {"cmd": "subscribe"}
+    {"cmd": "snapshot", "id": 1}
+    {"cmd": "history", "id": 2, "name": "hvac-a", "zoom": "day", "version": 17}
+    {"cmd": "activity", "id": 6, "name": "yard", "version": 3}
+    {"cmd": "metrics", "id": 3}
+    {"cmd": "trace", "id": 4}
+    {"cmd": "profile", "id": 5, "seconds": 30, "mode": "sample", "memory": false}
+    {"cmd": "set_relais_mode", "name": "garage", "mode": 2}
+    {"cmd": "set_detector", "name": "yard", "mode": 1}
+    {"cmd": "set_duty", "duty": 50}
+    {"cmd": "set_energy", "name": "light", "value": 123.4}
+    {"cmd": "sun_event", "type": 1}
+
+Commands carrying an "id" are answered by a message with the same "id".
+Subscribers receive the full snapshot once and then a stream of changes:
+
+    {"snapshot": {...}}
+    {"change": {"lamps": {"garage": {"state": "yellow"}}}}
+
+The server never waits for a client. A client not reading its socket is
+disconnected when its write buffer exceeds a limit.
+"""
+import asyncio
+import json
+
+SOCKET_PATH = "/run/light-control/io.sock"
+
+
+def _diff(old, new):
+    """Return the nested items of new that differ from old"""
+    changes = {}
+    for key, value in new.items():
+        prev = old.get(key)
+        if isinstance(value, dict) and isinstance(prev, dict):
+            sub = _diff(prev, value)
+            if sub:
+                changes[key] = sub
+        elif prev != value:
+            changes[key] = value
+    return changes
+
+
+def _merge(target, changes):
+    """Apply changes as created by _diff to target"""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class IpcServer:
+    """Serve a LightControl on a Unix socket
+
+    Arguments:
+        light_control (LightControl): The controlled installation
+        path (str): Path of the Unix socket
+        interval (float): Period of the change stream in seconds
+    """
+    WRITE_LIMIT = 256 * 1024
+
+    def __init__(self, light_control, path=SOCKET_PATH, interval=0.5):
+        self.light_control = light_control
+        self.path = path
+        self.interval = interval
+        self.subscribers = set()
+        self.server = None
+        self.snapshot = {}
+
+    async def serve(self):
+        """Serve clients and publish changes. Runs forever."""
+        self.server = await asyncio.start_unix_server(
+            self.__handle_client, path=self.path)
+        async with self.server:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.publish()
+
+    def publish(self):
+        """Send the changes since the last call to all subscribers"""
+        snapshot = self.light_control.snapshot()
+        changes = _diff(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        if changes and self.subscribers:
+            self.send_all({"change": changes})
+
+    def send_all(self, message):
+        """Send a message to all subscribers"""
+        data = _encode(message)
+        for writer in list(self.subscribers):
+            self.send(writer, data)
+
+    def send(self, writer, data):
+        """Write data to a client without waiting, drop slow clients"""
+        if writer.transport.get_write_buffer_size() > self.WRITE_LIMIT:
+            print(f"{self.__class__.__name__}: dropping slow client")
+            self.subscribers.discard(writer)
+            writer.transport.abort()
+            return
+        writer.write(data)
+
+    async def __handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                message = {}
+                try:
+                    message = json.loads(line)
+                    reply = self.execute(writer, message)
+                except (ValueError, KeyError, TypeError) as err:
+                    reply = {"error": str(err)}
+                if isinstance(message, dict) and "id" in message:
+                    reply["id"] = message["id"]
+                    self.send(writer, _encode(reply))
+        except ConnectionError:
+            pass
+        except ValueError as err:
+            # A line over the limit, readline raises the LimitOverrunError as
+            # ValueError. The stream cannot be resynced, drop the client.
+            print(f"{self.__class__.__name__}: {err}, dropping client")
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    def execute(self, writer, message):
+        """Execute a command message, return the reply"""
+        light_control = self.light_control
+        match message["cmd"]:
+            case "subscribe":
+                self.subscribers.add(writer)
+                self.send(writer, _encode({"snapshot": self.snapshot}))
+            case "snapshot":
+                return {"snapshot": light_control.snapshot()}
+            case "history":
+                return {"history": light_control.get_history(
+                    message["name"], message["zoom"], message.get("version"))}
+            case "activity":
+                return {"activity": light_control.get_activity(
+                    message["name"], message.get("version"))}
+            case "metrics":
+                return {"metrics": light_control.get_metrics()}
+            case "trace":
+                return {"trace": light_control.get_trace()}
+            case "profile":
+                return {"profile": light_control.start_profile(
+                    message.get("seconds", 30), message.get("mode", "sample"),
+                    message.get("memory", False))}
+            case "set_relais_mode":
+                light_control.set_relais_mode(message["name"], message["mode"])
+            case "set_detector":
+                light_control.set_detector(message["name"], message["mode"])
+            case "set_duty":
+                light_control.set_duty(message["duty"])
+            case "set_energy":
+                light_control.set_energy(message["name"], message["value"])
+            case "sun_event":
+                light_control.send_sun_event(message["type"])
+            case cmd:
+                raise KeyError(f"Unknown command {cmd}")
+        return {}
+
+
+class LightControlClient:
+    """UI side replacement of LightControl talking to the I/O daemon
+
+    Provides the UI getters and setters of LightControl. Getters are served
+    from a local mirror of the daemon state that is kept up to date by the
+    change stream. Setters are forwarded to the daemon.
+
+    Arguments:
+        path (str): Path of the daemon Unix socket
+        retry (float): Delay in seconds between connection attempts
+    """
+    def __init__(self, path=SOCKET_PATH, retry=1.0):
+        self.path = path
+        self.retry = retry
+        self.state = {}
+        self.writer = None
+        self.requests = {}
+        self.request_id = 0
+
+    @property
+    def connected(self):
+        """Return true if connected to the daemon"""
+        return self.writer is not None
+
+    async def run(self):
+        """Connect and keep connected to the daemon. Runs forever."""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=2**20)
+            except (FileNotFoundError, ConnectionError):
+                await asyncio.sleep(self.retry)
+                continue
+            self.writer = writer
+            self.send({"cmd": "subscribe"})
+            try:
+                while line := await reader.readline():
+                    self.receive(json.loads(line))
+            except ConnectionError:
+                pass
+            except ValueError as err:
+                # Malformed JSON or a line over the limit, readline raises the
+                # LimitOverrunError as ValueError. The new subscription resyncs.
+                print(f"{self.__class__.__name__}: {err}, reconnecting")
+            finally:
+                self.writer = None
+                writer.close()
+                for future in self.requests.values():
+                    future.cancel()
+                self.requests.clear()
+            # A daemon closing each connection is not polled in a tight loop
+            await asyncio.sleep(self.retry)
+
+    def receive(self, message):
+        """Handle a message received from the daemon"""
+        if "id" in message:
+            future = self.requests.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        elif "change" in message:
+            _merge(self.state, message["change"])
+        elif "snapshot" in message:
+            self.state = message["snapshot"]
+
+    def send(self, message):
+        """Send a message to the daemon, dropped if not connected"""
+        if self.writer is not None:
+            self.writer.write(_encode(message))
+
+    async def request(self, message, timeout=2.0):
+        """Send a message and wait for the reply"""
+        if self.writer is None:
+            raise ConnectionError("Not connected to light control daemon")
+        self.request_id += 1
+        message["id"] = self.request_id
+        future = asyncio.get_running_loop().create_future()
+        self.requests[self.request_id] = future
+        self.send(message)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.requests.pop(message["id"], None)
+
+    def set_relais_mode(self, name, ui_mode):
+        """UI setter for relais mode"""
+        self.send({"cmd": "set_relais_mode", "name": name, "mode": ui_mode})
+
+    def get_relais_mode(self, name):
+        """UI getter for relais mode"""
+        return self.state.get("lamps", {}).get(name, {}).get("mode", 1)
+
+    def get_relais_state(self, name):
+        """UI getter for relais state"""
+        return self.state.get("lamps", {}).get(name, {}).get("state", "red")
+
+    def set_detector(self, name, ui_mode):
+        """UI setter for detector mode"""
+        self.send({"cmd": "set_detector", "name": name, "mode": ui_mode})
+
+    def get_detector(self, name):
+        """UI getter for detector mode"""
+        return self.state.get("detectors", {}).get(name, 1)
+
+    def set_duty(self, duty):
+        """UI setter for the dimmer duty cycle"""
+        self.send({"cmd": "set_duty", "duty": duty})
+
+    def get_duty(self):
+        """UI getter for the dimmer duty cycle"""
+        return self.state.get("dim", 100)
+
+    def set_energy(self, name, value):
+        """UI setter for meter energy (calibration)"""
+        self.send({"cmd": "set_energy", "name": name, "value": value})
+
+    def get_power(self, name):
+        """UI getter for meter power"""
+        return self.state["meters"][name]["power"]
+
+    def get_energy(self, name):
+        """UI getter for meter energy"""
+        return self.state["meters"][name]["energy"]
+
+    def get_cost(self, name):
+        """UI getter for the meter cost of today and this month"""
+        return self.state["meters"][name]["cost"]
+
+    def send_sun_event(self, event_type):
+        """Force a sun event"""
+        self.send({"cmd": "sun_event", "type": int(event_type)})
+
+    async def get_history(self, name, zoom, version=None):
+        """Return the power history of a meter, see LightControl"""
+        reply = await self.request({"cmd": "history", "name": name,
+                                    "zoom": zoom, "version": version})
+        if "error" in reply:
+            raise KeyError(reply["error"])
+        return reply["history"]
+
+    async def get_activity(self, name, version=None):
+        """Return the trigger activity of a detector, see LightControl"""
+        reply = await self.request({"cmd": "activity", "name": name, "version": version})
+        if "error" in reply:
+            raise KeyError(reply["error"])
+        return reply["activity"]
+
+    async def get_metrics(self):
+        """Return the daemon metrics in Prometheus text format"""
+        reply = await self.request({"cmd": "metrics"})
+        if "error" in reply:
+            raise KeyError(reply["error"])
+        return reply["metrics"]
+
+    async def get_trace(self):
+        """Return the daemon latency statistics, None if not tracing"""
+        reply = await self.request({"cmd": "trace"})
+        if "error" in reply:
+            raise KeyError(reply["error"])
+        return reply["trace"]
+
+    async def start_profile(self, seconds=30, mode="sample", memory=False):
+        """Start a profile capture in the daemon, see ProfileCapture.start"""
+        reply = await self.request({"cmd": "profile", "seconds": seconds,
+                                    "mode": mode, "memory": memory})
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return reply["profile"]
@@ -0,0 +1,205 @@
+"""Journal of relais, detector and mode changes
+
+Records are JSON lines with the wall clock time, the device name, the kind
+of event and event specific fields:
+
+    {"t": 1760842800.123, "dev": "Lampe Garage", "ev": "relais", "state": "ON"}
+
+record() only appends to a queue and never blocks the event loop. A writer
+thread writes the records in batches and rotates the files by size. The
+current file is journal.jsonl, rotated files are journal.jsonl.1 (newest)
+to journal.jsonl.<backups> (oldest).
+
+Run as script to query a journal:
+
+    python journal.py /var/lib/light-control/journal \\
+        --start 2026-10-19T02:50 --end 2026-10-19T03:10 --device "Lampe Garage"
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class Journal:
+    """Append only event journal written by a background thread
+
+    Arguments:
+        directory (str): Directory of the journal files, created if missing
+        max_bytes (int): Size of a file that triggers rotation
+        backups (int): Amount of rotated files kept
+        flush_interval (float): Maximum time a record waits to be written
+        max_pending (int): Records waiting to be written before new ones are
+            dropped, default unbounded
+        wall_func (callable): Wall clock in s since the epoch of the
+            records, default time.time
+    """
+    FILE = "journal.jsonl"
+
+    def __init__(self, directory, max_bytes=1 << 20, backups=5, flush_interval=1.0,
+                 max_pending=0, wall_func=None):
+        # pylint: disable=too-many-arguments
+        self.directory = directory
+        self.wall_func = wall_func if wall_func is not None else time.time
+        self.path = os.path.join(directory, self.FILE)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_pending) if max_pending else queue.SimpleQueue()
+        # Metrics: records written, write batches, write errors, dropped records
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.__write, name=self.__class__.__name__,
+                                       daemon=True)
+        self.thread.start()
+
+    def record(self, device, event, **fields):
+        """Record an event of a device, fields must be JSON serializable"""
+        try:
+            self.queue.put_nowait({"t": round(self.wall_func(), 3), "dev": device, "ev": event,
+                                   **fields})
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write pending records and stop the writer thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def __write(self):
+        """Writer thread, batches what arrived within the flush interval"""
+        os.makedirs(self.directory, exist_ok=True)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                self.__append("".join(json.dumps(r, separators=(",", ":")) + "\n"
+                                      for r in batch).encode(), len(batch))
+
+    def __append(self, data, count):
+        try:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self.__rotate()
+            with open(self.path, "ab") as file:
+                file.write(data)
+            self.written += count
+            self.batches += 1
+        except OSError as err:
+            self.errors += 1
+            print(f"Error writing journal {self.path}: {err}")
+
+    def __rotate(self):
+        for index in range(self.backups, 0, -1):
+            source = f"{self.path}.{index - 1}" if index > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+
+
+def query(directory, start=None, end=None, device=None, event=None):
+    """Iterate the records of a journal oldest first
+
+    Files completely outside of the time range are skipped, reading stops
+    at the first record after end.
+
+    Arguments:
+        directory (str): Directory of the journal files
+        start (float): Earliest time, epoch seconds
+        end (float): Latest time, epoch seconds
+        device (str): Only records of this device
+        event (str): Only records of this kind of event
+    """
+    path = os.path.join(directory, Journal.FILE)
+    files = [path]
+    while os.path.exists(f"{path}.{len(files)}"):
+        files.append(f"{path}.{len(files)}")
+    files.reverse()
+    for name in files:
+        try:
+            with open(name, "rb") as file:
+                if start is not None and _last_time(file) < start:
+                    continue
+                yield from _records(file, start, end, device, event)
+        except FileNotFoundError:
+            continue
+
+
+def _records(file, start, end, device, event):
+    """Iterate the matching records of a file up to the first after end
+
+    A later file starts after end too, its first record stops it at once.
+    """
+    for line in file:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Partially written last line
+            continue
+        if end is not None and record["t"] > end:
+            return
+        if start is not None and record["t"] < start:
+            continue
+        if device is not None and record["dev"] != device:
+            continue
+        if event is not None and record["ev"] != event:
+            continue
+        yield record
+
+
+def _last_time(file, tail=4096):
+    """Return the time of the last complete record of a file, rewind it"""
+    size = file.seek(0, os.SEEK_END)
+    file.seek(max(0, size - tail))
+    last = float("-inf")
+    for line in file.read().splitlines():
+        try:
+            last = json.loads(line)["t"]
+        except (ValueError, KeyError, TypeError):
+            continue
+    file.seek(0)
+    return last
+
+
+def main():
+    """Print the records of a journal selected on the command line"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory of the journal files")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="ISO time")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="ISO time")
+    parser.add_argument("--device", help="Device name")
+    parser.add_argument("--event", help="Kind of event, e.g. relais, trigger, mask")
+    args = parser.parse_args()
+    records = query(args.directory,
+                    args.start.timestamp() if args.start else None,
+                    args.end.timestamp() if args.end else None,
+                    args.device, args.event)
+    for record in records:
+        stamp = datetime.fromtimestamp(record.pop("t")).isoformat(timespec="milliseconds")
+        device, event = record.pop("dev"), record.pop("ev")
+        fields = " ".join(f"{key}={value}" for key, value in record.items())
+        print(f"{stamp} {device:28s} {event:10s} {fields}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Detection of failed lamps from the relais switching and the light meter
+
+The light meter measures the lamps switched by the relais. The time between
+two switches is a segment in which the set of lamps ON is constant, its
+mean power is the pulses counted in it divided by its duration. Switches
+of several relais within a few seconds, e.g. of one detector trigger, form
+one boundary between two segments.
+
+A boundary at which a single relais switched yields an observation of its
+power step, the difference of the mean power of the segments after and
+before. The steps of each relais are learned as running statistics. Once
+learned, a step far below the learned one flags the lamp as missing, one
+outside the usual spread as abnormal.
+
+Pulses are sparse at low power, a 20 W lamp adds one in 90 s. A step is
+checked once enough pulses of the lamp are expected. Observations of a
+lamp are pooled until then: the pulses of its ON segments above the power
+of the other segment and the time ON are summed, the pooled step is their
+ratio.
+
+The state is the current and the previous segment plus the running
+statistics and the pool per relais, no pulse history is kept or scanned
+again.
+"""
+import asyncio
+import time
+from app_state import State, Stateful
+from meter_stats import MeterAlert, RunningStats
+
+# As S0Meter, Ws per pulse
+PULSE_ENERGY = 3.6e6 / 2000
+
+
+class _Segment:
+    """Pulses counted while a set of relais is ON"""
+    __slots__ = ("start", "end", "pulses", "on")
+
+    def __init__(self, start, on):
+        self.start = start
+        self.end = None
+        self.pulses = 0
+        self.on = on
+
+    @property
+    def power(self):
+        """Mean power in W of the closed segment"""
+        return self.pulses * PULSE_ENERGY / ((self.end - self.start) * 1e-9)
+
+
+class LampMonitor(Stateful):
+    """Correlate the switching of relais with the power of their meter
+
+    A pulse sink of the meter's S0 input, the relais report switches by
+    switched(). MeterAlerts are put onto the registered queues.
+
+    Arguments:
+        name (str): Name of the app state and of the meter in alerts
+        lamps (iterable): Names of the relais switching the metered lamps
+        app_state (AppState): Persistence of the learned steps
+        now_func (callable): Monotonic clock in ns of the pulse timestamps
+    """
+    # Switches within are one boundary, s
+    SETTLE = 10
+    # Minimum duration of the segments of an observed step, s
+    MIN_DURATION = 120
+    # Steps learned before a lamp is checked
+    MIN_SAMPLES = 5
+    # Pulses of the lamp expected in its pooled ON segments to check a step
+    MIN_EXPECTED = 10
+    # Missing below this fraction of the learned step
+    MISSING = 0.3
+    # Abnormal beyond this many standard deviations and this fraction
+    SIGMAS = 4.
+    TOLERANCE = 0.5
+
+    def __init__(self, name, lamps, app_state=None, now_func=None):
+        self.name = name
+        self.lamps = list(lamps)
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.steps = {lamp: RunningStats() for lamp in self.lamps}
+        # Pulses of a lamp above the other segment and ns ON, not yet checked
+        self.pools = {lamp: [0., 0] for lamp in self.lamps}
+        self.on = frozenset()
+        self.previous = None
+        self.current = _Segment(self.now_func(), self.on)
+        # Relais switched at the boundary between previous and current
+        self.changed = frozenset()
+        self.queues = []
+        # Metrics: steps precise enough to observe, flagged steps per lamp
+        self.observed = dict.fromkeys(self.lamps, 0)
+        self.flagged = dict.fromkeys(self.lamps, 0)
+        self.dropped = 0
+        self.app_state = app_state
+        if app_state is not None:
+            self._register_state(app_state)
+
+    def _register_state(self, app_state):
+        state = app_state.get_state(self.name)
+        if state is not None:
+            for lamp, (count, mean, m2) in state.state["steps"].items():
+                if lamp in self.steps:
+                    stats = self.steps[lamp]
+                    stats.count, stats.mean, stats.m2 = count, mean, m2
+        app_state.register_client(self)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        return State(self.name, {"steps": {lamp: [s.count, s.mean, s.m2]
+                                           for lamp, s in self.steps.items()}})
+
+    def register_queue(self, queue):
+        """Register a queue receiving the MeterAlerts"""
+        self.queues.append(queue)
+
+    def step(self, lamp):
+        """Learned power step of a lamp in W, None while learning"""
+        stats = self.steps[lamp]
+        return stats.mean if stats.count >= self.MIN_SAMPLES else None
+
+    def pulses(self, timestamps):
+        """Count a batch of pulses into their segments, timestamps in ns
+
+        Pulse sink interface of S0EventDispatcher.
+        """
+        current, previous = self.current, self.previous
+        for timestamp in timestamps:
+            if timestamp >= current.start:
+                current.pulses += 1
+            elif previous is not None and previous.start <= timestamp < previous.end:
+                # Late pulse, those while switching are dropped
+                previous.pulses += 1
+
+    def switched(self, lamp, on):
+        """Report a switch of a relais
+
+        Arguments:
+            lamp (str): Name of the relais
+            on (bool): New state
+        """
+        if lamp not in self.steps:
+            return
+        now = self.now_func()
+        self.on = self.on | {lamp} if on else self.on - {lamp}
+        current = self.current
+        if now - current.start < self.SETTLE * 10**9:
+            # Still switching, the short segment belongs to the boundary
+            self.changed = self.changed ^ {lamp}
+            current.start, current.pulses, current.on = now, 0, self.on
+            return
+        current.end = now
+        if self.previous is not None and len(self.changed) == 1:
+            self.__observe(self.previous, current, next(iter(self.changed)))
+        self.previous = current
+        self.changed = frozenset((lamp,))
+        self.current = _Segment(now, self.on)
+
+    def __observe(self, before, after, lamp):
+        """Check and learn the step of a lamp between two segments"""
+        min_duration = self.MIN_DURATION * 10**9
+        if before.end - before.start < min_duration or after.end - after.start < min_duration:
+            return
+        on_segment, off_segment = (after, before) if lamp in after.on else (before, after)
+        on_time = (on_segment.end - on_segment.start) * 1e-9
+        pool = self.pools[lamp]
+        pool[0] += on_segment.pulses - off_segment.power * on_time / PULSE_ENERGY
+        pool[1] += on_segment.end - on_segment.start
+        step = pool[0] * PULSE_ENERGY / (pool[1] * 1e-9)
+        stats = self.steps[lamp]
+        learned = self.step(lamp)
+        # While learning the pooled step decides if it is precise enough
+        reference = learned if learned is not None else step
+        if reference * pool[1] * 1e-9 / PULSE_ENERGY < self.MIN_EXPECTED:
+            return
+        self.pools[lamp] = [0., 0]
+        self.observed[lamp] += 1
+        if learned is not None:
+            if step < learned * self.MISSING:
+                self.__alert(lamp, "lamp missing", step, after.start,
+                             f"{lamp} adds {step:.0f} W to {self.name}, usually "
+                             f"{learned:.0f} W. Bulb or driver failed?")
+                return
+            if abs(step - learned) > max(self.SIGMAS * stats.stddev, self.TOLERANCE * learned):
+                self.__alert(lamp, "lamp abnormal", step, after.start,
+                             f"{lamp} adds {step:.0f} W to {self.name}, usually "
+                             f"{learned:.0f} ± {stats.stddev:.0f} W")
+                return
+        stats.add(step)
+        if self.app_state is not None:
+            self.app_state.request_store()
+
+    def __alert(self, lamp, rule, step, timestamp, message):
+        self.flagged[lamp] += 1
+        alert = MeterAlert(self.name, rule, step, timestamp, message)
+        for queue in self.queues:
+            try:
+                queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                self.dropped += 1
@@ -0,0 +1,114 @@
+"""Latency tracing from the kernel S0 edge to switching a relais
+
+A traced S0Event carries the slot of its trace record. Each stage passed
+writes a CLOCK_MONOTONIC timestamp into the slot. Records live in a
+preallocated ring, tracing allocates no memory per event. The deltas of a
+record overwritten in the ring are added to running counts and sums, the
+percentiles are of the records kept.
+"""
+import time
+from array import array
+
+
+class LatencyTrace:
+    """Ring of stage timestamps of traced events
+
+    Stages:
+        EDGE:     Kernel timestamp of the gpiod EdgeEvent
+        DISPATCH: S0EventDispatcher picked up the event
+        DETECTOR: S0Detector took the event from its queue
+        UPDATE:   TimedRelais.update planned the on action
+        RELAIS:   timed_on_action switched the relais. The intended delay of
+                  the trigger is subtracted, only the lateness is traced.
+
+    Arguments:
+        size (int): Amount of trace records kept
+    """
+    EDGE, DISPATCH, DETECTOR, UPDATE, RELAIS = range(5)
+    STAGES = ("edge", "dispatch", "detector", "update", "relais")
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.width = len(self.STAGES)
+        self.stamps = array("q", bytes(8 * size * self.width))
+        self.next = 0
+        # Deltas of the overwritten records per stage, index 0 end to end
+        self.retired_counts = [0] * self.width
+        self.retired_ns = [0] * self.width
+
+    def begin(self, edge_ns):
+        """Start a trace record for an edge, return the slot"""
+        slot = self.next
+        self.next = (slot + 1) % self.size
+        row = slot * self.width
+        stamps = self.stamps
+        if stamps[row + 1]:
+            self.__retire(row)
+        stamps[row] = edge_ns
+        stamps[row + 1] = time.monotonic_ns()
+        for stage in range(row + 2, row + self.width):
+            stamps[stage] = 0
+        return slot
+
+    def __retire(self, row):
+        """Add the deltas of a record about to be overwritten to the totals"""
+        stamps = self.stamps
+        for stage in range(1, self.width):
+            if stamps[row + stage] and stamps[row + stage - 1]:
+                self.retired_counts[stage] += 1
+                self.retired_ns[stage] += stamps[row + stage] - stamps[row + stage - 1]
+        last = row + self.width - 1
+        if stamps[last] and stamps[row]:
+            self.retired_counts[0] += 1
+            self.retired_ns[0] += stamps[last] - stamps[row]
+
+    def mark(self, slot, stage, timestamp=None):
+        """Record the time a stage was passed"""
+        self.stamps[slot * self.width + stage] = \
+            time.monotonic_ns() if timestamp is None else timestamp
+
+    def stage_time(self, slot, stage):
+        """Return the recorded time of a stage, 0 if not passed"""
+        return self.stamps[slot * self.width + stage]
+
+    def stats(self):
+        """Return p50/p99/max in seconds of each stage and end to end
+
+        The time of a stage is measured from the previous stage. Records
+        not passing a stage, e.g. from masked detectors, are skipped. Count
+        and sum include the overwritten records, the percentiles are of the
+        records kept.
+        """
+        stamps = self.stamps
+        width = self.width
+        result = {}
+        for stage in range(1, width):
+            result[self.STAGES[stage]] = _percentiles([
+                stamps[row + stage] - stamps[row + stage - 1]
+                for row in range(0, len(stamps), width)
+                if stamps[row + stage] and stamps[row + stage - 1]],
+                self.retired_counts[stage], self.retired_ns[stage])
+        result["total"] = _percentiles([
+            stamps[row + width - 1] - stamps[row]
+            for row in range(0, len(stamps), width)
+            if stamps[row + width - 1] and stamps[row]],
+            self.retired_counts[0], self.retired_ns[0])
+        return result
+
+
+def _percentiles(deltas, retired_count=0, retired_ns=0):
+    """Return count, sum, p50, p99 and max of ns deltas in seconds
+
+    Count and sum include retired deltas.
+    """
+    total = {"count": len(deltas) + retired_count, "sum": (sum(deltas) + retired_ns) * 1e-9}
+    if not deltas:
+        return {**total, "p50": 0., "p99": 0., "max": 0.}
+    deltas.sort()
+    count = len(deltas)
+    return {
+        **total,
+        "p50": deltas[(count - 1) // 2] * 1e-9,
+        "p99": deltas[min(count - 1, int(count * 0.99))] * 1e-9,
+        "max": deltas[-1] * 1e-9,
+    }
@@ -1,11 +1,36 @@
-"""I/O instantiation reflecting the installation"""
+"""I/O instantiation reflecting the installation
 
+Run as script to start the headless I/O daemon. UIs connect through the
+Unix socket protocol defined in ipc.
+"""
+
+import argparse
 import asyncio
+import collections
+import os
+import signal
 from io_control import S0EventDispatcher, TimedRelais, S0Detector, RelaisMode, RelaisState, Dimmer
+from io_control import RelaisGuard, PulseFilter
 from s0_meter import S0Meter
+from supervisor import Supervisor
 from gpio_map import GpioMap
 from sun import SunSensor
 from app_state import AppState
+from ipc import IpcServer, SOCKET_PATH
+from latency_trace import LatencyTrace
+from profiling import ProfileCapture
+from meter_shm import MeterShmWriter, SHM_NAME
+from journal import Journal
+from pulse_log import PulseLog
+from meter_stats import MeterStats, PowerAbove, PowerWhile, Deviation
+from tariff import Tariff, MeterCost
+from schedule import Schedule
+from memory_budget import MemoryBudget
+from power_history import PowerHistory
+from mqtt_bridge import MqttBridge
+from lamp_monitor import LampMonitor
+from activity import DetectorActivity
+import metrics
 
 class LightControl:
     """Defines the behavior of the light installation.
@@ -13,14 +38,65 @@ class LightControl:
     Instantiates and stores all I/O classes as found in our house.
     Interconnects the instances as expected/wanted.
 
-    Provides an interface to nicegui UI.
+    Provides an interface to the UI, either in process or through an
+    ipc.IpcServer.
+
+    Arguments:
+        gpio_factory (callable): Creates the GpioMap from a consumer name
+        state_file (str): Path of the persistent app state
+        trace (bool): Trace latency from S0 edges to relais switching
+        meter_shm (str): Name of a shared memory segment to publish the
+            meters to, see meter_shm. None disables publishing.
+        journal (bool): Record relais, detector and mode changes in the
+            journal directory next to the state file
+        pulse_log (bool): Log the meter pulses in the pulses directory next
+            to the state file, meter totals are reconciled with it at start
+        memory_budget (MemoryBudget): Bound queues, histories and journal by
+            the budget, evict under pressure and trace the usage
     """
-    def __init__(self):
+    STATE_FILE = "/var/lib/light-control/state.json"
+    # Minimum on and off time of the lamp relais in seconds
+    RELAIS_DWELL = (5., 2.)
+    # Maximum power of the meters in W, faster pulses are rejected
+    METER_MAX_POWER = {"hvac-a": 4000, "hvac-b": 4000, "hvac-c": 4000, "light": 1500}
+
+    def __init__(self, gpio_factory=GpioMap, state_file=STATE_FILE, trace=False,
+                 meter_shm=None, journal=False, pulse_log=False, memory_budget=None):
+        # pylint: disable=too-many-arguments
+        self.gpio_factory = gpio_factory
+        self.pulse_dir = os.path.join(os.path.dirname(state_file), "pulses") \
+            if pulse_log else None
+        self.memory_budget = memory_budget
+        self.journal = Journal(
+            os.path.join(os.path.dirname(state_file), "journal"),
+            max_pending=memory_budget.slots("journal") if memory_budget is not None else 0
+        ) if journal else None
+        self.meter_shm = meter_shm
+        self.meter_export = None
+        self.state_file = state_file
+        self.tracer = LatencyTrace() if trace else None
+        self.profiler = ProfileCapture(os.path.dirname(state_file))
         self.lamps = {}
         self.detectors = {}
         self.meters = {}
+        self.costs = {}
+        self.meter_inputs = {}
+        self.detector_inputs = {}
         self.sun = None
         self.dim = None
+        self.schedule = None
+        self.lamp_monitor = None
+        self.dispatcher = None
+        self.app_state = None
+        self.lag_monitor = None
+        # Alerts of the meter statistics, latest last
+        self.alerts = asyncio.Queue(self.__queue_size())
+        self.recent_alerts = collections.deque(maxlen=20)
+        # Restarts the task of a meter, detector or dimmer if it fails
+        self.supervisor = Supervisor(self.journal)
+        self.alert_task = None
+        # Queues of other consumers of the detector and sun events
+        self.event_queues = []
 
     async def io_main(self):
         """I/O main routine to be used from nicegui
@@ -33,81 +109,21 @@ class LightControl:
         interaction with nicegui
         """
 
-        with GpioMap("light_control") as gpio:
-
-            s0ed = S0EventDispatcher(gpio)
-
-            lamp_yard_front = TimedRelais("Lampe Einfahrt vorne", gpio, 0)
-            lamp_yard_rear = TimedRelais("Lampe Einfahrt hinten", gpio, 1)
-            lamp_terrasse = TimedRelais("Lampe Terasse", gpio, 2)
-            lamp_garage = TimedRelais("Lampe Garage", gpio, 3)
-
-            app_state = AppState("/var/lib/light-control/state.json")
-            meters = (
-                (4, S0Meter("HVAC-A Arbeiten + Schlafen", app_state)),
-                (5, S0Meter("HVAC-B Wohnen + Essen", app_state)),
-                (6, S0Meter("HVAC-C Mareike + Ralph", app_state)),
-                (7, S0Meter("Außenbeleuchtung", app_state))
-            )
-
-            for s0_index, meter in meters:
-                s0ed.register_queue(s0_index, meter.queue)
-
-            detectors = (
-                (0, S0Detector("Melder Einfahrt", (
-                        (lamp_terrasse, 4, 600),
-                        (lamp_yard_rear, 2, 300),
-                        (lamp_yard_front, 0, 900),
-                        (lamp_garage, 6, 600),
-                    )
-                )),
-                (1, S0Detector("Melder Terasse", (
-                        (lamp_terrasse, 0, 600),
-                        #(lamp_yard_rear, 5, 300),
-                        #(lamp_yard_front, 3, 300),
-                        #(lamp_garage, 5, 300),
-                    )
-                )),
-                (2, S0Detector("Melder Garage", (
-                        (lamp_terrasse, 3, 600),
-                        #(lamp_yard_rear, 3, 10),
-                        #(lamp_yard_front, 5, 600),
-                        (lamp_garage, 0, 900),
-                    )
-                )),
-            )
-
-            sun = SunSensor()
-
-            for s0_index, detector in detectors:
-                s0ed.register_queue(s0_index, detector.queue)
-                sun.register_queue(detector.queue)
-
-            dim = Dimmer("Dimmer Terrasse", gpio)
-            sun.register_queue(dim.queue)
-
-            self.lamps = {
-                "yard_front": lamp_yard_front,
-                "yard_rear": lamp_yard_rear,
-                "terrasse": lamp_terrasse,
-                "garage": lamp_garage,
-            }
-
-            self.detectors = {
-                "yard": detectors[0][1],
-                "terrasse": detectors[1][1],
-                "garage": detectors[2][1],
-            }
-
-            self.meters = {
-                "hvac-a": meters[0][1],
-                "hvac-b": meters[1][1],
-                "hvac-c": meters[2][1],
-                "light":  meters[3][1],
-            }
-
-            self.sun = sun
-            self.dim = dim
+        with self.gpio_factory("light_control") as gpio:
+
+            s0ed = S0EventDispatcher(gpio, tracer=self.tracer, supervisor=self.supervisor)
+            self.lag_monitor = metrics.LoopLagMonitor()
+
+            app_state = AppState(self.state_file)
+            self.app_state = app_state
+            self.install(gpio, app_state)
+            # Pulses are counted as soon as the dispatcher runs
+            self.connect(s0ed)
+
+            if self.meter_shm is not None:
+                self.meter_export = MeterShmWriter(self.meters, self.meter_shm)
+                for key, slot in self.meter_export.slots.items():
+                    s0ed.register_pulse_sink(self.meter_inputs[key], slot)
 
             # Wait forever. This ensures a nice nice termination when
             # exectuting from nicegui
@@ -116,6 +132,7 @@ class LightControl:
                     # Save the state daily
                     await asyncio.sleep(84600)
                 except asyncio.exceptions.CancelledError as err:
+                    self.close()
                     raise err
                 finally:
                     # This is execued in any case before try block exits
@@ -123,6 +140,240 @@ class LightControl:
                     print("Storing light-control state")
                     app_state.store_state()
 
+    def close(self):
+        """Stop the tasks and release the exports, journal and pulse logs
+
+        The app state is stored by the caller afterwards.
+        """
+        if self.meter_export is not None:
+            self.meter_export.close()
+        self.supervisor.cancel()
+        if self.schedule is not None:
+            self.schedule.cancel()
+        if self.journal is not None:
+            self.journal.close()
+        for meter in self.meters.values():
+            if meter.pulse_log is not None:
+                meter.pulse_log.close()
+
+    def install(self, gpio, app_state, sun=None, clock=None, wall_clock=None):
+        """Instantiate and interconnect meters, lamps, detectors and dimmer
+
+        S0 inputs are not connected here, see connect(). The S0 index of
+        each meter and detector is given by meter_inputs and detector_inputs.
+
+        Arguments:
+            gpio (GpioMap): GPIO of the relais and PWM outputs
+            app_state (AppState): Persistence of meters, lamps, detectors and
+                dimmer. Their state is restored when created.
+            sun (SunSensor): Source of the sun events, default a SunSensor
+                created after the lamps resumed their on windows
+            clock (callable): Monotonic clock in ns of the meters
+            wall_clock (callable): Wall clock in s since the epoch of the
+                meter statistics, costs, pulse logs, persisted on windows and
+                journal records, default time.time
+        """
+        if self.journal is not None and wall_clock is not None:
+            self.journal.wall_func = wall_clock
+
+        def pulse_log(key):
+            if self.pulse_dir is None:
+                return None
+            return PulseLog(os.path.join(self.pulse_dir, key), now_func=clock,
+                            wall_func=wall_clock)
+
+        def hvac_stats(name):
+            return MeterStats(name, (
+                PowerAbove("night load", 500, 4 * 3600, (22, 6)),
+                Deviation("deviation", 5, 200, 1800),
+            ), clock, wall_clock)
+
+        def lamps_off():
+            return all(lamp.state == RelaisState.OFF for lamp in self.lamps.values())
+
+        light_stats = MeterStats("Außenbeleuchtung", (
+            PowerWhile("load while off", 10, lamps_off, "all relais are OFF", 600),
+        ), clock, wall_clock)
+
+        supervisor = self.supervisor
+        # Totals are reconciled with the pulse log before pulses arrive
+        meters = (
+            (4, S0Meter("HVAC-A Arbeiten + Schlafen", app_state, clock, pulse_log("hvac-a"),
+                        hvac_stats("HVAC-A Arbeiten + Schlafen"), supervisor,
+                        self.__history(clock, wall_clock))),
+            (5, S0Meter("HVAC-B Wohnen + Essen", app_state, clock, pulse_log("hvac-b"),
+                        hvac_stats("HVAC-B Wohnen + Essen"), supervisor,
+                        self.__history(clock, wall_clock))),
+            (6, S0Meter("HVAC-C Mareike + Ralph", app_state, clock, pulse_log("hvac-c"),
+                        hvac_stats("HVAC-C Mareike + Ralph"), supervisor,
+                        self.__history(clock, wall_clock))),
+            (7, S0Meter("Außenbeleuchtung", app_state, clock, pulse_log("light"), light_stats,
+                        supervisor, self.__history(clock, wall_clock)))
+        )
+        for _, meter in meters:
+            meter.stats.register_queue(self.alerts)
+
+        tracer = self.tracer
+        journal = self.journal
+        queue_size = self.__queue_size()
+        dwell = self.RELAIS_DWELL
+        # All lamps are metered by the light meter
+        monitor = LampMonitor("Lampen Außenbeleuchtung", (
+            "Lampe Einfahrt vorne", "Lampe Einfahrt hinten", "Lampe Terasse", "Lampe Garage",
+        ), app_state, clock)
+        monitor.register_queue(self.alerts)
+        lamp_yard_front = TimedRelais("Lampe Einfahrt vorne", gpio, 0, tracer, journal,
+                                      app_state, RelaisGuard(*dwell), monitor, wall_clock)
+        lamp_yard_rear = TimedRelais("Lampe Einfahrt hinten", gpio, 1, tracer, journal,
+                                     app_state, RelaisGuard(*dwell), monitor, wall_clock)
+        lamp_terrasse = TimedRelais("Lampe Terasse", gpio, 2, tracer, journal,
+                                    app_state, RelaisGuard(*dwell), monitor, wall_clock)
+        lamp_garage = TimedRelais("Lampe Garage", gpio, 3, tracer, journal,
+                                  app_state, RelaisGuard(*dwell), monitor, wall_clock)
+
+        sun = SunSensor() if sun is None else sun
+
+        def activity(name):
+            return DetectorActivity(f"Aktivität {name}", app_state, sun.now_func)
+
+        detectors = (
+            (0, S0Detector("Melder Einfahrt", (
+                    (lamp_terrasse, 4, 600),
+                    (lamp_yard_rear, 2, 300),
+                    (lamp_yard_front, 0, 900),
+                    (lamp_garage, 6, 600),
+                ), tracer, journal, app_state, supervisor, queue_size,
+                activity("Melder Einfahrt")
+            )),
+            (1, S0Detector("Melder Terasse", (
+                    (lamp_terrasse, 0, 600),
+                    #(lamp_yard_rear, 5, 300),
+                    #(lamp_yard_front, 3, 300),
+                    #(lamp_garage, 5, 300),
+                ), tracer, journal, app_state, supervisor, queue_size,
+                activity("Melder Terasse")
+            )),
+            (2, S0Detector("Melder Garage", (
+                    (lamp_terrasse, 3, 600),
+                    #(lamp_yard_rear, 3, 10),
+                    #(lamp_yard_front, 5, 600),
+                    (lamp_garage, 0, 900),
+                ), tracer, journal, app_state, supervisor, queue_size,
+                activity("Melder Garage")
+            )),
+        )
+
+        dim = Dimmer("Dimmer Terrasse", gpio, app_state=app_state, supervisor=supervisor,
+                     queue_size=queue_size)
+
+        for _, detector in detectors:
+            sun.register_queue(detector.queue)
+        sun.register_queue(dim.queue)
+
+        self.lamps = {
+            "yard_front": lamp_yard_front,
+            "yard_rear": lamp_yard_rear,
+            "terrasse": lamp_terrasse,
+            "garage": lamp_garage,
+        }
+
+        self.detectors = {
+            "yard": detectors[0][1],
+            "terrasse": detectors[1][1],
+            "garage": detectors[2][1],
+        }
+        self.detector_inputs = dict(zip(self.detectors, (i for i, _ in detectors)))
+
+        self.meters = {
+            "hvac-a": meters[0][1],
+            "hvac-b": meters[1][1],
+            "hvac-c": meters[2][1],
+            "light":  meters[3][1],
+        }
+        self.meter_inputs = dict(zip(self.meters, (i for i, _ in meters)))
+
+        state_dir = os.path.dirname(self.state_file)
+        tariff = Tariff.load(os.path.join(state_dir, "tariff.json"))
+        self.costs = {key: MeterCost(f"Kosten {meter.name}", tariff, app_state,
+                                     meter.pulse_log, clock, wall_clock,
+                                     history=os.path.join(state_dir, f"costs-{key}.json"))
+                      for key, meter in self.meters.items()}
+
+        self.sun = sun
+        self.dim = dim
+        self.lamp_monitor = monitor
+        self.schedule = Schedule.load(
+            os.path.join(state_dir, "schedule.json"),
+            self.lamps, sun, app_state)
+        self.alert_task = supervisor.supervise("meter alerts", self.__handle_alerts)
+
+        if self.memory_budget is not None:
+            self.__apply_memory_budget(tariff)
+
+    def __apply_memory_budget(self, tariff):
+        """Register the evictions and the watch of the memory budget"""
+        budget = self.memory_budget
+        for meter in self.meters.values():
+            budget.register_eviction(meter.history.evict)
+        budget.register_eviction(tariff.tables.clear)
+        budget.register_eviction(self.recent_alerts.clear)
+        # Usage is attributed from memory profile captures
+        self.profiler.register_snapshot_sink(budget.attribute)
+        self.supervisor.supervise("memory budget", budget.watch)
+
+    def register_event_queue(self, queue):
+        """Register a queue receiving the S0Events of the detectors and the SunEvents"""
+        self.event_queues.append(queue)
+        if self.dispatcher is not None and self.sun is not None:
+            self.__connect_event_queue(queue)
+
+    def connect(self, dispatcher):
+        """Connect the installed meters and detectors to their S0 inputs
+
+        Arguments:
+            dispatcher (S0EventDispatcher): Dispatcher of the S0 inputs
+        """
+        self.dispatcher = dispatcher
+        for key, meter in self.meters.items():
+            dispatcher.set_pulse_filter(self.meter_inputs[key], PulseFilter.for_meter(
+                meter.PULSE_PER_KWH, self.METER_MAX_POWER[key]))
+            dispatcher.register_pulse_sink(self.meter_inputs[key], meter)
+            dispatcher.register_pulse_sink(self.meter_inputs[key], self.costs[key])
+        dispatcher.register_pulse_sink(self.meter_inputs["light"], self.lamp_monitor)
+        for key, detector in self.detectors.items():
+            dispatcher.register_queue(self.detector_inputs[key], detector.queue)
+        for queue in self.event_queues:
+            self.__connect_event_queue(queue)
+
+    def __connect_event_queue(self, queue):
+        for s0_index in self.detector_inputs.values():
+            self.dispatcher.register_queue(s0_index, queue)
+        self.sun.register_queue(queue)
+
+    def __queue_size(self):
+        """Bound of each event queue, unbounded without memory budget"""
+        if self.memory_budget is None:
+            return 0
+        # Shared by the detectors, the dimmer and the alerts
+        return self.memory_budget.slots("queues", 5)
+
+    def __history(self, clock, wall_clock):
+        """Power history of a meter on the given clocks, within the memory budget if any"""
+        if self.memory_budget is None:
+            return PowerHistory(now_func=clock, wall_func=wall_clock)
+        buckets = self.memory_budget.slots("history", 4 * len(PowerHistory.ZOOMS))
+        return PowerHistory(min(buckets, 240), clock, wall_clock)
+
+    async def __handle_alerts(self):
+        """Report the alerts of the meter statistics"""
+        while True:
+            alert = await self.alerts.get()
+            print(f"Alert: {alert.message}")
+            self.recent_alerts.append(alert)
+            if self.journal is not None:
+                self.journal.record(alert.meter, "alert", rule=alert.rule,
+                                    power=round(alert.power), message=alert.message)
+
     def set_relais_mode(self, name, ui_mode):
         """UI setter for relais mode"""
         match ui_mode:
@@ -190,6 +441,148 @@ class LightControl:
             pass
         return 1
 
+    def set_duty(self, duty):
+        """UI setter for the dimmer duty cycle"""
+        if self.dim is not None:
+            self.dim.set_duty(duty)
+
+    def get_duty(self):
+        """UI getter for the dimmer duty cycle"""
+        return self.dim.duty if self.dim is not None else 100
+
+    def set_energy(self, name, value):
+        """UI setter for meter energy (calibration)"""
+        try:
+            self.meters[name].set_energy(value)
+            if self.meter_export is not None:
+                self.meter_export.slots[name].publish()
+        except KeyError:
+            pass
+
+    def get_power(self, name):
+        """UI getter for meter power"""
+        return round(self.meters[name].power)
+
+    def get_energy(self, name):
+        """UI getter for meter energy"""
+        return round(self.meters[name].energy, 2)
+
+    def send_sun_event(self, event_type):
+        """Force a sun event"""
+        if self.sun is not None:
+            self.sun.send_event_type(event_type)
+
+    def get_cost(self, name):
+        """UI getter for the meter cost of today and this month"""
+        day, month = self.costs[name].totals()
+        return {"day": round(day, 2), "month": round(month, 2)}
+
+    def get_history(self, name, zoom, version=None):
+        """Return the power history of a meter for a zoom level
+
+        Returns a dict with the version of the history and the chart data.
+        Data is None if the passed version is still current.
+        """
+        history = self.meters[name].history
+        current = history.version(zoom)
+        data = history.chart_data(zoom) if current != version else None
+        return {"version": current, "data": data}
+
+    def get_activity(self, name, version=None):
+        """Return the trigger activity of a detector
+
+        Returns a dict with the version of the activity and the chart data.
+        Data is None if the passed version is still current.
+        """
+        activity = self.detectors[name].activity
+        data = activity.chart_data()
+        return {"version": activity.version, "data": data if activity.version != version
+                else None}
+
+    def get_metrics(self):
+        """Return runtime metrics in Prometheus text format"""
+        return metrics.render(self, self.lag_monitor)
+
+    def get_trace(self):
+        """Return latency statistics per stage, None if not tracing"""
+        return self.tracer.stats() if self.tracer is not None else None
+
+    def start_profile(self, seconds=30, mode="sample", memory=False):
+        """Start a profile capture, see ProfileCapture.start"""
+        return self.profiler.start(seconds, mode, memory)
+
+    def snapshot(self):
+        """Return the UI relevant state of the installation as dict"""
+        return {
+            "lamps": {
+                name: {
+                    "mode": self.get_relais_mode(name),
+                    "state": self.get_relais_state(name),
+                } for name in self.lamps
+            },
+            "detectors": {
+                name: self.get_detector(name) for name in self.detectors
+            },
+            "meters": {
+                name: {
+                    "power": self.get_power(name),
+                    "energy": self.get_energy(name),
+                    "cost": self.get_cost(name),
+                } for name in self.meters
+            },
+            "dim": self.get_duty(),
+        }
+
+
+async def daemon_main(socket_path, trace=False, meter_shm=SHM_NAME, journal=True,
+                      pulse_log=True, memory_budget=None, mqtt=None, mqtt_prefix="light-control"):
+    """Run the installation headless, serving UIs on a Unix socket"""
+    # pylint: disable=too-many-arguments,too-many-locals
+    budget = MemoryBudget(memory_budget << 20) if memory_budget else None
+    light_control = LightControl(trace=trace, meter_shm=meter_shm or None,
+                                 journal=journal, pulse_log=pulse_log, memory_budget=budget)
+    server = IpcServer(light_control, socket_path)
+    services = [light_control.io_main(), server.serve()]
+    if mqtt:
+        host, _, port = mqtt.partition(":")
+        bridge = MqttBridge(light_control, host, int(port or 1883), mqtt_prefix)
+        services.append(bridge.run())
+
+    # SIGTERM: stop gracefully, the state is stored for a warm restart
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    # SIGUSR1: sample all threads, SIGUSR2: cProfile the loop + memory
+    loop.add_signal_handler(signal.SIGUSR1, light_control.start_profile)
+    loop.add_signal_handler(signal.SIGUSR2, light_control.start_profile,
+                            30, "cprofile", True)
+    try:
+        await asyncio.gather(*services)
+    except asyncio.CancelledError:
+        print("Stopped light-control")
+
+
 if __name__ == '__main__':
-    light_control = LightControl()
-    asyncio.run(light_control.io_main())
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--socket", default=SOCKET_PATH,
+                        help="Path of the Unix socket served to UIs")
+    parser.add_argument("--trace", action="store_true",
+                        help="Trace latency from S0 edges to relais switching")
+    parser.add_argument("--meter-shm", default=SHM_NAME,
+                        help="Shared memory segment publishing the meters, "
+                             "empty to disable")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="Do not record relais, detector and mode changes")
+    parser.add_argument("--no-pulse-log", action="store_true",
+                        help="Do not log meter pulses for reconciliation at start")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="Bound all buffers by a total memory budget, e.g. 96 "
+                             "on a Pi Zero")
+    parser.add_argument("--mqtt", metavar="HOST[:PORT]",
+                        help="Publish to and accept commands from an MQTT broker")
+    parser.add_argument("--mqtt-prefix", default="light-control",
+                        help="Prefix of the MQTT topics")
+    args = parser.parse_args()
+    asyncio.run(daemon_main(args.socket, args.trace, args.meter_shm, not args.no_journal,
+                            not args.no_pulse_log, args.memory_budget, args.mqtt,
+                            args.mqtt_prefix))
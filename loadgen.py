@@ -0,0 +1,111 @@
+"""Synthetic S0 pulse load on a simulated GPIO
+
+A LoadGenerator injects edges into a gpio_sim.SimGpioMap from a thread, each
+S0 input following its own rate profile. Edges are stamped with their
+planned time, late injection does not distort the pulse intervals.
+"""
+import heapq
+import random
+import threading
+import time
+
+
+class ConstantProfile:
+    """Pulses at a constant rate
+
+    Arguments:
+        rate (float): Pulses per second
+    """
+    def __init__(self, rate):
+        self.rate = rate
+
+    def next_interval(self, rng):  # pylint: disable=unused-argument
+        """Return the time to the next pulse in seconds"""
+        return 1 / self.rate
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.rate})"
+
+
+class PoissonProfile(ConstantProfile):
+    """Pulses as Poisson process, exponentially distributed intervals"""
+    def next_interval(self, rng):
+        return rng.expovariate(self.rate)
+
+
+class BurstyProfile:
+    """Poisson pulses switching between a base rate and bursts
+
+    Arguments:
+        rate (float): Pulses per second outside of bursts
+        burst_rate (float): Pulses per second within bursts
+        burst (float): Duration of a burst in seconds
+        period (float): Mean time between burst starts in seconds
+    """
+    def __init__(self, rate, burst_rate, burst=1.0, period=10.0):
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burst = burst
+        self.period = period
+        self.burst_left = 0.
+
+    def next_interval(self, rng):
+        """Return the time to the next pulse in seconds"""
+        if self.burst_left <= 0 and rng.random() < 1 / (self.period * self.rate):
+            self.burst_left = self.burst
+        if self.burst_left > 0:
+            interval = rng.expovariate(self.burst_rate)
+            self.burst_left -= interval
+            return interval
+        return rng.expovariate(self.rate)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.rate}, {self.burst_rate}, "\
+               f"{self.burst}, {self.period})"
+
+
+class LoadGenerator:
+    """Inject pulses into a SimGpioMap following per input rate profiles
+
+    Arguments:
+        gpio (SimGpioMap): The simulated GPIO to inject to
+        profiles (dict): Rate profile per S0 index
+        seed (int): Seed of the random generator, for reproducible runs
+    """
+    def __init__(self, gpio, profiles, seed=0):
+        self.gpio = gpio
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        self.injected = [0] * len(gpio.s0_pins)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start injecting in a thread"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.__run, name=self.__class__.__name__,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop injecting, wait for the thread"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __run(self):
+        now = time.monotonic_ns()
+        plan = [(now + int(profile.next_interval(self.rng) * 1e9), s0_index)
+                for s0_index, profile in self.profiles.items()]
+        heapq.heapify(plan)
+        while plan and not self.stop_event.is_set():
+            due, s0_index = plan[0]
+            delay = (due - time.monotonic_ns()) * 1e-9
+            if delay > 0:
+                # Sleep until due, pulses due by then are injected at once
+                self.stop_event.wait(delay)
+                continue
+            self.gpio.inject(s0_index, due)
+            self.injected[s0_index] += 1
+            interval = self.profiles[s0_index].next_interval(self.rng)
+            heapq.heapreplace(plan, (due + int(interval * 1e9), s0_index))
@@ -0,0 +1,221 @@
+"""Memory budget of the daemon for boards with little RAM, e.g. a Pi Zero
+
+A MemoryBudget splits a configured total into shares of the subsystems
+holding data: the event queues, the power histories and the journal. Each
+share is turned into a bound on the items of the buffers of the subsystem,
+using the measured size of an item. The rest of the total is left to the
+interpreter, the loaded modules and the rings of fixed size.
+
+Under pressure, when the resident set size exceeds the total, the
+registered evictions free what can be rebuilt or is least valuable: the
+oldest history buckets and the lookup caches. The interpreter rarely
+returns freed memory to the system, so the evictions run once and again
+only after the resident set size has grown by a margin or dropped below
+the total.
+
+Tracing is not kept on, it costs memory and time of its own. A snapshot of
+an on demand trace, e.g. a memory profile capture, is attributed to the
+subsystems by the module allocating it, see MODULES. report() returns the
+usage of the last snapshot, it never takes one.
+"""
+import asyncio
+import gc
+import tracemalloc
+from metrics import process_rss
+
+
+def put_latest(queue, item):
+    """Put an item into a queue, dropping the oldest if it is full
+
+    A LatestQueue drops only the oldest of its droppable items.
+
+    Returns True if an item was dropped.
+    """
+    if isinstance(queue, LatestQueue):
+        dropped = queue.dropped
+        queue.put_nowait(item)
+        return queue.dropped != dropped
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+    return dropped
+
+
+class LatestQueue(asyncio.Queue):
+    """Queue bounding only the items of a droppable type
+
+    Holds up to maxsize droppable items, putting one more drops the oldest
+    of them. Other items, e.g. SunEvents controlling the day and night
+    state, are never dropped and a put of them never fails.
+
+    Arguments:
+        maxsize (int): Bound of the droppable items, 0 is unbounded
+        droppable (type): Type of the items that may be dropped
+    """
+    def __init__(self, maxsize, droppable):
+        # The base class must never report the queue full
+        super().__init__()
+        self.limit = maxsize
+        self.droppable = droppable
+        self.held = 0
+        self.dropped = 0
+
+    def _put(self, item):
+        if isinstance(item, self.droppable):
+            if self.limit and self.held >= self.limit:
+                self.__drop_oldest()
+            else:
+                self.held += 1
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if isinstance(item, self.droppable):
+            self.held -= 1
+        return item
+
+    def __drop_oldest(self):
+        for index, item in enumerate(self._queue):
+            if isinstance(item, self.droppable):
+                del self._queue[index]
+                self.dropped += 1
+                return
+
+
+class MemoryBudget:
+    """Split of a memory total into bounded buffers
+
+    Arguments:
+        total (int): Total in bytes the process shall stay below
+        shares (dict): Fraction of the total per subsystem, default SHARES
+        interval (float): Seconds between checks of the pressure by watch()
+        margin (float): Growth of the resident set size since the last
+            eviction, as fraction of the total, evicting again
+    """
+    SHARES = {"queues": 0.02, "history": 0.04, "journal": 0.01}
+    # Bytes per item as measured with tracemalloc, the history bucket
+    # includes its rendered points
+    ITEM_SIZE = {"queues": 256, "history": 300, "journal": 256}
+    # Subsystem of allocations by the end of the file name allocating them
+    MODULES = {
+        "gpio_map.py": "queues",
+        "gpio_sim.py": "queues",
+        "io_control.py": "queues",
+        "asyncio/queues.py": "queues",
+        "power_history.py": "history",
+        "journal.py": "journal",
+    }
+    # Frames traced per allocation, the allocating module is enough
+    TRACE_FRAMES = 1
+
+    def __init__(self, total, shares=None, interval=10., margin=0.1):
+        self.total = total
+        self.shares = dict(self.SHARES if shares is None else shares)
+        self.interval = interval
+        self.margin = margin
+        # Resident set size of the last eviction, None when below the total
+        self.evicted_rss = None
+        self.evictions = []
+        # Traced bytes per subsystem of the last snapshot, None before
+        self.usage = None
+        self.started_tracing = False
+        # Metrics: times memory was freed under pressure
+        self.eviction_count = 0
+
+    def share(self, subsystem):
+        """Return the bytes of a subsystem"""
+        return int(self.total * self.shares[subsystem])
+
+    def slots(self, subsystem, consumers=1, minimum=16):
+        """Return the items each of the buffers of a subsystem may hold
+
+        Arguments:
+            subsystem (str): One of SHARES
+            consumers (int): Buffers sharing the budget of the subsystem
+            minimum (int): Lower bound, a buffer stays usable
+        """
+        size = self.share(subsystem) // (self.ITEM_SIZE[subsystem] * consumers)
+        return max(size, minimum)
+
+    def register_eviction(self, evict):
+        """Register a callable freeing memory under pressure"""
+        self.evictions.append(evict)
+
+    def check(self, rss=None):
+        """Evict if the resident set size exceeds the total
+
+        After an eviction, evict again only if the resident set size has
+        grown by the margin since, or has been below the total in between.
+
+        Arguments:
+            rss (int): Resident set size in bytes, default that of the process
+
+        Returns True if memory was evicted.
+        """
+        rss = process_rss() if rss is None else rss
+        if rss <= self.total:
+            self.evicted_rss = None
+            return False
+        if self.evicted_rss is not None \
+                and rss < self.evicted_rss + self.total * self.margin:
+            return False
+        self.evicted_rss = rss
+        for evict in self.evictions:
+            evict()
+        gc.collect()
+        self.eviction_count += 1
+        print(f"Memory {rss >> 20}MB above budget {self.total >> 20}MB, evicted")
+        return True
+
+    async def watch(self):
+        """Check the pressure periodically"""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def start_tracing(self):
+        """Trace allocations for sample(), unless already traced"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.TRACE_FRAMES)
+            self.started_tracing = True
+
+    def stop_tracing(self):
+        """Stop tracing started by start_tracing() and free the traces"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def sample(self):
+        """Attribute a snapshot of the current traces, if tracing
+
+        The snapshot blocks the calling thread, call it off the event loop.
+        """
+        if tracemalloc.is_tracing():
+            self.attribute(tracemalloc.take_snapshot())
+
+    def attribute(self, snapshot):
+        """Attribute the allocations of a tracemalloc snapshot to the subsystems
+
+        Allocations not attributed to a subsystem are counted as other. May
+        be called from any thread, e.g. as snapshot sink of a ProfileCapture.
+        """
+        used = dict.fromkeys(list(self.shares) + ["other"], 0)
+        for stat in snapshot.statistics("filename"):
+            filename = stat.traceback[0].filename
+            subsystem = next((s for suffix, s in self.MODULES.items()
+                              if filename.endswith(suffix)), "other")
+            used[subsystem] += stat.size
+        self.usage = used
+
+    def report(self):
+        """Return the budget and the traced usage in bytes per subsystem
+
+        Usage is that of the last attributed snapshot, None before.
+        """
+        used = self.usage
+        return {subsystem: {"budget": self.share(subsystem) if subsystem in self.shares
+                            else None,
+                            "used": used[subsystem] if used is not None else None}
+                for subsystem in list(self.shares) + ["other"]}
@@ -0,0 +1,218 @@
+"""Live meter state in shared memory for readers in other processes
+
+The I/O daemon publishes per meter the pulse total, the time and interval of
+the last pulse and a ring of the most recent pulse timestamps. Readers map
+the segment and read the values in place, without talking to the daemon.
+
+Layout, little endian, all fields 8 byte aligned:
+
+    header:  magic "LCM1", version (u16), meters (u16), ring (u32), reserved
+    record:  seq (u64), key (32 bytes, utf-8), total (i64),
+             last_event (i64), last_delta (i64), pulses (u64),
+             ring of timestamps (i64 * ring)
+
+Every record is guarded by a sequence lock. The writer makes seq odd before
+and even again after changing the record. A reader retries if seq was odd
+or changed while copying the fields. Timestamps are CLOCK_MONOTONIC ns, the
+same clock as time.monotonic_ns() in any process on the host.
+
+Readers map the segment read only from /dev/shm. This keeps them out of the
+multiprocessing resource tracking, which would remove the segment when a
+reader exits.
+"""
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+SHM_NAME = "light-control-meters"
+MAGIC = b"LCM1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI4x")
+RECORD = struct.Struct("<Q32sqqqQ")
+SEQ = struct.Struct("<Q")
+STAMP = struct.Struct("<q")
+# As S0Meter, kept here so readers need nothing but this module
+PULSE_PER_KWH = 2000
+
+
+def _record_size(ring):
+    return RECORD.size + STAMP.size * ring
+
+
+@dataclass(frozen=True)
+class MeterSample:
+    """Consistent copy of one meter record
+
+    Pulse timestamps are ordered oldest first, at most ring many.
+    """
+    name: str
+    total: int
+    last_event: int
+    last_delta: int
+    pulses: int
+    recent: tuple = ()
+
+    @property
+    def energy(self):
+        """Consumed energy in kWh"""
+        return self.total / PULSE_PER_KWH
+
+    def power(self, now=None):
+        """Power in W, like S0Meter.power at monotonic time now (ns)"""
+        now = time.monotonic_ns() if now is None else now
+        delta_t = max(self.last_delta, now - self.last_event) * 1e-9
+        return 3.6e6 / PULSE_PER_KWH / delta_t if delta_t > 0 else 0.
+
+
+class _MeterSlot:
+    """Writer side of one meter record, a pulse sink of S0EventDispatcher"""
+    def __init__(self, buf, offset, ring, name, meter):
+        self.buf = buf
+        self.name = name.encode()[:32]
+        self.offset = offset
+        self.ring = ring
+        self.meter = meter
+        self.seq = 0
+        self.count = 0
+
+    def pulses(self, timestamps):
+        """Store the timestamps in the ring and publish the meter"""
+        self.seq += 1
+        SEQ.pack_into(self.buf, self.offset, self.seq)
+        base = self.offset + RECORD.size
+        skip = max(0, len(timestamps) - self.ring)
+        count = self.count + skip
+        for timestamp in timestamps[skip:]:
+            STAMP.pack_into(self.buf, base + count % self.ring * STAMP.size, timestamp)
+            count += 1
+        self.count = count
+        self.__write()
+
+    def publish(self):
+        """Publish the meter values, e.g. after calibration"""
+        self.seq += 1
+        SEQ.pack_into(self.buf, self.offset, self.seq)
+        self.__write()
+
+    def __write(self):
+        """Write the fields while seq is odd, then make it even"""
+        meter = self.meter
+        RECORD.pack_into(self.buf, self.offset, self.seq,
+                         self.name, meter.total,
+                         meter.last_event, meter.last_delta, self.count)
+        self.seq += 1
+        SEQ.pack_into(self.buf, self.offset, self.seq)
+
+
+class MeterShmWriter:
+    """Publish S0Meters into a shared memory segment
+
+    Register the slots as pulse sinks after the meters. An existing segment
+    of the same name, left over from a former run, is replaced.
+
+    Arguments:
+        meters (dict): S0Meter per key, the key is published as meter name
+        name (str): Name of the shared memory segment
+        ring (int): Amount of recent pulse timestamps kept per meter
+    """
+    def __init__(self, meters, name=SHM_NAME, ring=64):
+        size = HEADER.size + len(meters) * _record_size(ring)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        buf = self.shm.buf
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, len(meters), ring)
+        self.slots = {}
+        for index, (key, meter) in enumerate(meters.items()):
+            slot = _MeterSlot(buf, HEADER.size + index * _record_size(ring), ring,
+                              key, meter)
+            slot.publish()
+            self.slots[key] = slot
+
+    def close(self):
+        """Release and remove the segment"""
+        for slot in self.slots.values():
+            slot.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class MeterShmReader:
+    """Read meters published by a MeterShmWriter
+
+    Reads touch the shared memory only, polling at any rate does not load
+    the daemon.
+
+    Arguments:
+        name (str): Name of the shared memory segment
+    """
+    RETRIES = 1000
+
+    SHM_DIR = "/dev/shm"
+
+    def __init__(self, name=SHM_NAME):
+        with open(os.path.join(self.SHM_DIR, name), "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.map)
+        magic, version, meters, ring = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Shared memory {name} is no meter segment version {VERSION}")
+        self.ring = ring
+        self.stamps = struct.Struct(f"<{ring}q")
+        self.offsets = [HEADER.size + i * _record_size(ring) for i in range(meters)]
+        self.names = [self.read(i, recent=False).name for i in range(meters)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exp_type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the segment"""
+        self.buf.release()
+        self.map.close()
+
+    def index(self, name):
+        """Return the index of a meter by its key, e.g. hvac-a"""
+        return self.names.index(name)
+
+    def read(self, index, recent=True):
+        """Return a consistent MeterSample of a meter
+
+        Arguments:
+            index (int): Index of the meter
+            recent (bool): Include the recent pulse timestamps
+        """
+        buf = self.buf
+        offset = self.offsets[index]
+        for _ in range(self.RETRIES):
+            seq, name, total, last_event, last_delta, pulses = RECORD.unpack_from(buf, offset)
+            if seq & 1:
+                # Writer is busy, let it finish
+                time.sleep(0)
+                continue
+            stamps = ()
+            if recent:
+                stamps = self.__recent(buf, offset, pulses)
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return MeterSample(name.rstrip(b"\0").decode(errors="replace"),
+                                   total, last_event, last_delta, pulses, stamps)
+            time.sleep(0)
+        raise TimeoutError(f"No consistent read of meter {index}")
+
+    def __recent(self, buf, offset, pulses):
+        """Return the ring oldest first"""
+        stamps = self.stamps.unpack_from(buf, offset + RECORD.size)
+        if pulses < self.ring:
+            return stamps[:pulses]
+        head = pulses % self.ring
+        return stamps[head:] + stamps[:head]
@@ -0,0 +1,243 @@
+"""Online statistics of the meter power and alert rules on them
+
+MeterStats is fed by S0Meter with the power of every pulse interval. It
+keeps running statistics for all pulses and per hour of the day in constant
+memory, nothing of the history is stored or scanned again. Rules are
+checked on every pulse and put a MeterAlert onto the registered queues when
+they start to apply, once per episode.
+"""
+import asyncio
+import time
+from abc import ABCMeta, abstractmethod
+from dataclasses import dataclass
+
+
+class RunningStats:
+    """Count, mean, variance (Welford), minimum and maximum of values"""
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def add(self, value):
+        """Add a value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        """Sample variance, 0 below two values"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.
+
+    @property
+    def stddev(self):
+        """Sample standard deviation"""
+        return self.variance ** 0.5
+
+
+@dataclass(frozen=True)
+class MeterAlert:
+    """Alert raised by a rule on a meter, timestamp in monotonic ns"""
+    meter: str
+    rule: str
+    power: float
+    timestamp: int
+    message: str
+
+
+class MeterStats:
+    """Running statistics of the power of one meter
+
+    Arguments:
+        name (str): Name of the meter used in alerts
+        rules (iterable): Rules checked on every pulse
+        now_func (callable): Monotonic clock in ns of the pulse timestamps,
+            default time.monotonic_ns
+        wall_func (callable): Wall clock in s since the epoch, default
+            time.time. With now_func maps the pulses to the local hour of day.
+    """
+    # Pulses an hour bucket needs to contribute to the baseload
+    BASELOAD_SAMPLES = 10
+
+    def __init__(self, name, rules=(), now_func=None, wall_func=None):
+        self.name = name
+        self.rules = list(rules)
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.wall_func = wall_func if wall_func is not None else time.time
+        self.total = RunningStats()
+        self.hours = [RunningStats() for _ in range(24)]
+        self.hour = 0
+        self.hour_end = None
+        self.queues = []
+        # Metrics: alerts raised, alerts dropped from full queues
+        self.alert_count = 0
+        self.dropped = 0
+
+    def register_queue(self, queue):
+        """Register a queue receiving the MeterAlerts"""
+        self.queues.append(queue)
+
+    def add(self, timestamp, power):
+        """Add the power in W of a pulse interval ending at timestamp (ns)"""
+        if self.hour_end is None or timestamp >= self.hour_end:
+            self.__next_hour(timestamp)
+        # Rules compare with the statistics before this pulse
+        for rule in self.rules:
+            message = rule.check(self, timestamp, power)
+            if message is not None:
+                self.alert_count += 1
+                alert = MeterAlert(self.name, rule.name, power, timestamp, message)
+                for queue in self.queues:
+                    try:
+                        queue.put_nowait(alert)
+                    except asyncio.QueueFull:
+                        self.dropped += 1
+        self.total.add(power)
+        self.hours[self.hour].add(power)
+
+    def __next_hour(self, timestamp):
+        """Determine the local hour of a timestamp and when it ends"""
+        wall = self.wall_func() + (timestamp - self.now_func()) * 1e-9
+        local = time.localtime(wall)
+        self.hour = local.tm_hour
+        into_hour = local.tm_min * 60 + local.tm_sec + wall % 1
+        self.hour_end = timestamp + int((3600 - into_hour) * 1e9)
+
+    @property
+    def bucket(self):
+        """RunningStats of the current hour of day"""
+        return self.hours[self.hour]
+
+    @property
+    def baseload(self):
+        """Lowest mean power of an hour of day, None while unknown"""
+        means = [h.mean for h in self.hours if h.count >= self.BASELOAD_SAMPLES]
+        return min(means) if means else None
+
+
+class Rule(metaclass=ABCMeta):
+    """Base of the alert rules, raises once while a condition holds
+
+    The condition must hold for duration before the rule raises. Derived
+    classes implement applies() and describe().
+
+    Arguments:
+        name (str): Name of the rule
+        duration (float): Seconds the condition must hold
+    """
+    def __init__(self, name, duration=0.):
+        self.name = name
+        self.duration = int(duration * 1e9)
+        self.since = None
+        self.raised = False
+
+    def check(self, stats, timestamp, power):
+        """Return the alert message if the rule starts to apply, else None"""
+        if not self.applies(stats, power):
+            self.since = None
+            self.raised = False
+            return None
+        if self.since is None:
+            self.since = timestamp
+        if self.raised or timestamp - self.since < self.duration:
+            return None
+        self.raised = True
+        return self.describe(stats, power)
+
+    @abstractmethod
+    def applies(self, stats, power):
+        """Return if the condition holds"""
+
+    @abstractmethod
+    def describe(self, stats, power):
+        """Return the alert message"""
+
+
+class PowerAbove(Rule):
+    """Power above a limit, optionally only within hours of the day
+
+    Arguments:
+        name (str): Name of the rule
+        limit (float): Power limit in W
+        duration (float): Seconds the power must stay above the limit
+        hours (tuple): First and last hour of day, may wrap midnight, e.g.
+            (22, 5). None for all day.
+    """
+    def __init__(self, name, limit, duration=0., hours=None):
+        super().__init__(name, duration)
+        self.limit = limit
+        self.hours = hours
+
+    def applies(self, stats, power):
+        if power <= self.limit:
+            return False
+        if self.hours is None:
+            return True
+        first, last = self.hours
+        if first <= last:
+            return first <= stats.hour <= last
+        return stats.hour >= first or stats.hour <= last
+
+    def describe(self, stats, power):
+        return f"{stats.name} has been drawing {power:.0f} W for " \
+               f"{self.duration / 6e10:.0f} min (limit {self.limit:.0f} W)"
+
+
+class PowerWhile(Rule):
+    """Power above a limit while a condition holds
+
+    Arguments:
+        name (str): Name of the rule
+        limit (float): Power limit in W
+        condition (callable): Returns if the condition holds
+        description (str): Describes the condition, e.g. "all relais OFF"
+        duration (float): Seconds both must hold
+    """
+    def __init__(self, name, limit, condition, description, duration=0.):
+        # pylint: disable=too-many-arguments
+        super().__init__(name, duration)
+        self.limit = limit
+        self.condition = condition
+        self.description = description
+
+    def applies(self, stats, power):
+        return power > self.limit and self.condition()
+
+    def describe(self, stats, power):
+        return f"{stats.name} shows {power:.0f} W while {self.description}"
+
+
+class Deviation(Rule):
+    """Power deviating from the usual power at this hour of day
+
+    Arguments:
+        name (str): Name of the rule
+        sigmas (float): Allowed deviation in standard deviations
+        min_samples (int): Pulses of the hour bucket before it is trusted
+        duration (float): Seconds the deviation must last
+    """
+    def __init__(self, name, sigmas=4., min_samples=100, duration=0.):
+        super().__init__(name, duration)
+        self.sigmas = sigmas
+        self.min_samples = min_samples
+
+    def applies(self, stats, power):
+        bucket = stats.bucket
+        if bucket.count < self.min_samples:
+            return False
+        return (power - bucket.mean) ** 2 > self.sigmas ** 2 * bucket.variance
+
+    def describe(self, stats, power):
+        bucket = stats.bucket
+        return f"{stats.name} draws {power:.0f} W, usual at {stats.hour}h is " \
+               f"{bucket.mean:.0f} ± {bucket.stddev:.0f} W"
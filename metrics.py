@@ -0,0 +1,286 @@
+"""Runtime metrics of the light control in Prometheus text format
+
+The instrumented classes only increment plain counters on their hot paths.
+Aggregation and formatting is done here, when the metrics are scraped.
+"""
+import asyncio
+import os
+
+
+class LoopLagMonitor:
+    """Measure the event loop lag
+
+    Sleeps for a fixed interval and measures how late the loop wakes up.
+
+    Arguments:
+        interval (float): Probe interval in seconds
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = 0.
+        self.max_lag = 0.
+        self.lag_sum = 0.
+        self.count = 0
+        self.task = asyncio.create_task(self.__probe(), name=self.__class__)
+
+    async def __probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0., loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            self.lag_sum += self.lag
+            self.count += 1
+
+
+def process_rss():
+    """Return the resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _escape(value):
+    """Escape a label value, backslash, double quote and line feed"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+class MetricsText:
+    """Builder for the Prometheus text exposition format
+
+    Arguments:
+        prefix (str): Prefix of all metric names
+    """
+    def __init__(self, prefix="light_control_"):
+        self.prefix = prefix
+        self.lines = []
+
+    def add(self, name, metric_type, help_text, samples):
+        """Add a metric
+
+        Arguments:
+            name (str): Metric name without prefix
+            metric_type (str): counter or gauge
+            help_text (str): Description of the metric
+            samples (iterable): Pairs of (labels dict, value)
+        """
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def add_summary(self, name, help_text, samples):
+        """Add a summary
+
+        Arguments:
+            name (str): Metric name without prefix
+            help_text (str): Description of the metric
+            samples (iterable): Tuples of (labels dict, dict of quantile to
+                value, sum, count)
+        """
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} summary")
+        for labels, quantiles, total, count in samples:
+            for quantile, value in quantiles.items():
+                self.lines.append(f"{name}{_labels({**labels, 'quantile': quantile})} {value}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {total}")
+            self.lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    def __str__(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render(light_control, lag_monitor=None):
+    """Return the metrics of a LightControl in Prometheus text format"""
+    text = MetricsText()
+    if lag_monitor is not None:
+        _render_loop(text, lag_monitor)
+    _render_dispatcher(text, light_control)
+    _render_relais(text, light_control)
+    _render_supervisor(text, light_control)
+    _render_persistence(text, light_control)
+    _render_meters(text, light_control)
+    _render_trace(text, light_control)
+    _render_memory(text, light_control)
+    return str(text)
+
+
+def _render_loop(text, lag_monitor):
+    """Event loop lag"""
+    text.add("loop_lag_seconds", "gauge", "Last measured event loop lag",
+             [({}, lag_monitor.lag)])
+    text.add("loop_lag_max_seconds", "gauge", "Maximum event loop lag",
+             [({}, lag_monitor.max_lag)])
+    text.add("loop_lag_seconds_total", "counter", "Sum of event loop lags",
+             [({}, lag_monitor.lag_sum)])
+    text.add("loop_lag_probes_total", "counter", "Event loop lag probes",
+             [({}, lag_monitor.count)])
+
+
+def _render_dispatcher(text, light_control):
+    """Event queues and S0 inputs"""
+    # Meters are pulse sinks of the dispatcher, their queues stay empty
+    queues = [("detector", name, d.queue) for name, d in light_control.detectors.items()]
+    if light_control.dim is not None:
+        queues.append(("dimmer", light_control.dim.name, light_control.dim.queue))
+    text.add("queue_depth", "gauge", "Events waiting in a queue",
+             [({"kind": kind, "name": name}, queue.qsize())
+              for kind, name, queue in queues])
+
+    dispatcher = light_control.dispatcher
+    if dispatcher is None:
+        return
+    text.add("dispatcher_queue_depth", "gauge",
+             "Events waiting in the queues fed by an S0 input",
+             [({"channel": channel}, sum(q.qsize() for q in channel_queues))
+              for channel, channel_queues in enumerate(dispatcher.queues)])
+    text.add("s0_pulses_total", "counter", "Edges received per S0 input",
+             [({"channel": channel}, count)
+              for channel, count in enumerate(dispatcher.event_counts)])
+    filters = [(channel, f) for channel, f in enumerate(dispatcher.filters)
+               if f is not None]
+    text.add("s0_rejected_total", "counter", "Edges rejected by the pulse filter",
+             [({"channel": channel, "reason": reason}, count)
+              for channel, f in filters
+              for reason, count in (("interval", f.rejected_interval),
+                                    ("switching", f.rejected_switching))])
+    text.add("executor_wait_seconds_total", "counter",
+             "Time from reading events in the executor until dispatch",
+             [({}, dispatcher.executor_wait_ns * 1e-9)])
+    text.add("executor_wait_max_seconds", "gauge",
+             "Maximum time from reading events until dispatch",
+             [({}, dispatcher.executor_wait_max_ns * 1e-9)])
+    text.add("executor_reads_total", "counter", "Executor reads of events",
+             [({}, dispatcher.executor_reads)])
+
+    text.add("queue_dropped_total", "counter",
+             "Events dropped from full queues, the oldest first",
+             [({}, dispatcher.dropped)])
+
+
+def _render_relais(text, light_control):
+    """Relais, detectors and the lamp monitor"""
+    text.add("relais_switches_total", "counter", "Relais state changes",
+             [({"lamp": name}, lamp.switch_count)
+              for name, lamp in light_control.lamps.items()])
+    text.add("relais_suppressed_total", "counter",
+             "Relais switches suppressed by the minimum dwell time",
+             [({"lamp": name}, lamp.guard.suppressed)
+              for name, lamp in light_control.lamps.items() if lamp.guard is not None])
+    text.add("relais_reschedules_total", "counter",
+             "Pending relais timers replaced by TimedRelais.update",
+             [({"lamp": name}, lamp.reschedule_count)
+              for name, lamp in light_control.lamps.items()])
+
+    text.add("detector_triggers_total", "counter", "Triggers counted by the detector activity",
+             [({"detector": name}, detector.activity.count)
+              for name, detector in light_control.detectors.items()
+              if detector.activity is not None])
+
+    monitor = light_control.lamp_monitor
+    if monitor is not None:
+        lamps = {lamp.name: key for key, lamp in light_control.lamps.items()}
+        text.add("lamp_step_watts", "gauge", "Learned power step of a lamp on the light meter",
+                 [({"lamp": lamps.get(name, name)}, stats.mean)
+                  for name, stats in monitor.steps.items() if monitor.step(name) is not None])
+        text.add("lamp_flags_total", "counter", "Steps of a lamp flagged missing or abnormal",
+                 [({"lamp": lamps.get(name, name)}, count)
+                  for name, count in monitor.flagged.items()])
+
+
+def _render_supervisor(text, light_control):
+    """Background tasks and the schedule"""
+    tasks = light_control.supervisor.tasks
+    text.add("task_restarts_total", "counter", "Restarts of a failed background task",
+             [({"task": name}, entry.restarts) for name, entry in tasks.items()])
+    text.add("task_uptime_seconds", "gauge", "Time since a background task was (re)started",
+             [({"task": name}, entry.uptime) for name, entry in tasks.items()])
+
+    schedule = light_control.schedule
+    if schedule is not None:
+        text.add("schedule_windows_total", "counter",
+                 "On windows of schedule rules passed to the relais",
+                 [({}, schedule.fire_count)])
+
+
+def _render_persistence(text, light_control):
+    """App state and journal"""
+    app_state = light_control.app_state
+    if app_state is not None:
+        text.add("state_store_seconds", "gauge", "Duration of last state store",
+                 [({}, app_state.store_duration)])
+        text.add("state_stores_total", "counter", "State stores",
+                 [({}, app_state.store_count)])
+
+    journal = light_control.journal
+    if journal is not None:
+        text.add("journal_records_total", "counter", "Journal records written",
+                 [({}, journal.written)])
+        text.add("journal_pending", "gauge", "Journal records waiting to be written",
+                 [({}, journal.queue.qsize())])
+        text.add("journal_errors_total", "counter", "Failed journal writes",
+                 [({}, journal.errors)])
+        text.add("journal_dropped_total", "counter", "Records dropped, journal queue full",
+                 [({}, journal.dropped)])
+
+
+def _render_meters(text, light_control):
+    """Meter statistics and pulse logs"""
+    stats = [(key, meter.stats) for key, meter in light_control.meters.items()
+             if meter.stats is not None]
+    if stats:
+        text.add("meter_alerts_total", "counter", "Alerts raised by the meter rules",
+                 [({"meter": key}, meter_stats.alert_count) for key, meter_stats in stats])
+        text.add("meter_baseload_watts", "gauge", "Lowest mean power of an hour of day",
+                 [({"meter": key}, meter_stats.baseload) for key, meter_stats in stats
+                  if meter_stats.baseload is not None])
+
+    logs = [(key, meter.pulse_log) for key, meter in light_control.meters.items()
+            if meter.pulse_log is not None]
+    if logs:
+        text.add("pulse_log_pulses_total", "counter", "Pulses written to the pulse log",
+                 [({"meter": key}, log.written) for key, log in logs])
+        text.add("pulse_log_errors_total", "counter", "Failed pulse log writes",
+                 [({"meter": key}, log.errors) for key, log in logs])
+
+
+def _render_memory(text, light_control):
+    """Memory budget and resident set size"""
+    budget = light_control.memory_budget
+    if budget is not None:
+        report = budget.report()
+        text.add("memory_budget_bytes", "gauge", "Memory budget per subsystem",
+                 [({"subsystem": name}, usage["budget"]) for name, usage in report.items()
+                  if usage["budget"] is not None])
+        text.add("memory_traced_bytes", "gauge", "Traced memory allocated per subsystem",
+                 [({"subsystem": name}, usage["used"]) for name, usage in report.items()
+                  if usage["used"] is not None])
+        text.add("memory_evictions_total", "counter", "Evictions under memory pressure",
+                 [({}, budget.eviction_count)])
+
+    text.add("process_resident_memory_bytes", "gauge", "Resident set size",
+             [({}, process_rss())])
+
+
+def _render_trace(text, light_control):
+    """Latency of traced S0 events"""
+    trace = light_control.get_trace()
+    if trace is not None:
+        text.add_summary("latency_seconds",
+                         "Latency of traced S0 events per stage, from previous stage",
+                         [({"stage": stage},
+                           {"0.5": values["p50"], "0.99": values["p99"], "1": values["max"]},
+                           values["sum"], values["count"])
+                          for stage, values in trace.items()])
@@ -0,0 +1,313 @@
+"""Publish the installation to an MQTT broker and accept relais mode commands
+
+The bridge speaks the subset of MQTT 3.1.1 it needs over an asyncio stream:
+CONNECT with a last will, PUBLISH and SUBSCRIBE at QoS 0, and keep alive.
+Topics below the prefix:
+
+    <prefix>/status                     online / offline (retained, last will)
+    <prefix>/lamp/<name>/state          ON / OFF (retained)
+    <prefix>/lamp/<name>/mode           AUTO / ON / OFF (retained)
+    <prefix>/lamp/<name>/mode/set       command, AUTO / ON / OFF
+    <prefix>/detector/<name>/mode       ACTIVE / MASKED (retained)
+    <prefix>/detector/<name>/trigger    ISO time of a trigger
+    <prefix>/meter/<name>/power         W (retained)
+    <prefix>/meter/<name>/energy        kWh (retained)
+    <prefix>/dim                        duty cycle in % (retained)
+    <prefix>/sun                        SUN_RISE / SUN_SET (retained)
+
+Nothing is sent from the I/O paths. They only update the pending message
+of a topic, a newer value replaces one not sent yet. A sender task drains
+the pending topics at a limited rate and only while the socket accepts
+data, a slow or missing broker leaves the messages pending. After a
+reconnect all retained topics are sent again.
+"""
+import asyncio
+import struct
+import time
+from datetime import datetime
+from gpio_map import S0Event
+from sun import SunEvent
+from memory_budget import LatestQueue
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+LAMP_STATES = {"yellow": "ON", "gray": "OFF"}
+LAMP_MODES = {1: "AUTO", 2: "ON", 3: "OFF"}
+DETECTOR_MODES = {1: "ACTIVE", 2: "MASKED"}
+
+
+def _string(value):
+    """Encode a UTF-8 string with its length"""
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(packet_type, body=b""):
+    """Return a packet of a type and flags with its remaining length"""
+    header = bytearray([packet_type])
+    length = len(body)
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+def connect_packet(client_id, keepalive, will_topic, will_message):
+    """Return a CONNECT with clean session and a retained last will"""
+    flags = 0x02 | 0x04 | 0x20
+    return packet(CONNECT, _string("MQTT") + bytes([4, flags]) +
+                  struct.pack("!H", keepalive) + _string(client_id) +
+                  _string(will_topic) + _string(will_message))
+
+
+def publish_packet(topic, payload, retain=False):
+    """Return a PUBLISH at QoS 0"""
+    return packet(PUBLISH | (0x01 if retain else 0), _string(topic) + payload.encode())
+
+
+def subscribe_packet(packet_id, topic):
+    """Return a SUBSCRIBE of a topic filter at QoS 0"""
+    return packet(SUBSCRIBE, struct.pack("!H", packet_id) + _string(topic) + b"\x00")
+
+
+async def read_packet(reader):
+    """Read a packet, return its type and flags and its body"""
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    for shift in range(0, 28, 7):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+
+def parse_publish(header, body):
+    """Return topic and payload of a PUBLISH body"""
+    length = struct.unpack_from("!H", body)[0]
+    topic = body[2:2 + length].decode()
+    start = 2 + length + (2 if header & 0x06 else 0)
+    return topic, body[start:].decode()
+
+
+def state_topics(snapshot):
+    """Return the retained topics below the prefix and payloads of a snapshot"""
+    topics = {}
+    for name, lamp in snapshot.get("lamps", {}).items():
+        topics[f"lamp/{name}/state"] = LAMP_STATES.get(lamp["state"], "UNKNOWN")
+        topics[f"lamp/{name}/mode"] = LAMP_MODES.get(lamp["mode"], "UNKNOWN")
+    for name, mode in snapshot.get("detectors", {}).items():
+        topics[f"detector/{name}/mode"] = DETECTOR_MODES.get(mode, "UNKNOWN")
+    for name, meter in snapshot.get("meters", {}).items():
+        topics[f"meter/{name}/power"] = f"{meter['power']:.1f}"
+        topics[f"meter/{name}/energy"] = f"{meter['energy']:.3f}"
+    if snapshot.get("dim") is not None:
+        topics["dim"] = str(snapshot["dim"])
+    return topics
+
+
+class MqttBridge:
+    """Bridge a LightControl to an MQTT broker
+
+    Arguments:
+        light_control (LightControl): The published installation
+        host (str): Host of the broker
+        port (int): Port of the broker
+        prefix (str): Prefix of all topics
+        interval (float): Period of sampling the state in seconds
+        rate (float): Messages per second sent at most
+        burst (int): Messages sent at once after a quiet time
+        keepalive (int): Keep alive of the connection in seconds
+        retry (tuple): First and maximum delay of a reconnect in seconds
+    """
+    # Bytes buffered by the socket before the sender waits for the broker
+    WRITE_LIMIT = 64 * 1024
+    EVENT_QUEUE_SIZE = 256
+
+    def __init__(self, light_control, host="localhost", port=1883, prefix="light-control",
+                 interval=1.0, rate=20., burst=50, keepalive=60, retry=(1., 60.)):
+        # pylint: disable=too-many-arguments
+        self.light_control = light_control
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.interval = interval
+        self.rate = rate
+        self.burst = burst
+        self.keepalive = keepalive
+        self.retry = retry
+        self.writer = None
+        # Topic below the prefix: (payload, retain), least recently changed first
+        self.pending = {}
+        # Retained payloads as last sampled, sent again after a reconnect
+        self.retained = {}
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.events = LatestQueue(self.EVENT_QUEUE_SIZE, S0Event)
+        # Metrics: messages sent, replaced while pending, commands, connects
+        self.published = 0
+        self.coalesced = 0
+        self.commands = 0
+        self.connects = 0
+
+    @property
+    def connected(self):
+        """Return true if connected to the broker"""
+        return self.writer is not None
+
+    def publish(self, topic, payload, retain=False):
+        """Queue a message of a topic below the prefix, replacing a pending one"""
+        if self.pending.pop(topic, None) is not None:
+            self.coalesced += 1
+        self.pending[topic] = (payload, retain)
+        self.wakeup.set()
+
+    def sample(self):
+        """Queue the retained topics changed since the last sample"""
+        for topic, payload in state_topics(self.light_control.snapshot()).items():
+            if self.retained.get(topic) != payload:
+                self.retained[topic] = payload
+                self.publish(topic, payload, True)
+
+    async def run(self):
+        """Publish and keep connected to the broker. Runs forever."""
+        self.light_control.register_event_queue(self.events)
+        tasks = [asyncio.create_task(self.__sample_loop(), name="mqtt sample"),
+                 asyncio.create_task(self.__handle_events(), name="mqtt events"),
+                 asyncio.create_task(self.__send_loop(), name="mqtt send")]
+        try:
+            await self.__connect_loop()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def __sample_loop(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    async def __handle_events(self):
+        """Publish detector triggers and sun events"""
+        detectors = {index: name for name, index in
+                     self.light_control.detector_inputs.items()}
+        while True:
+            event = await self.events.get()
+            match event:
+                case S0Event():
+                    name = detectors.get(event.s0_index)
+                    if name is not None:
+                        self.publish(f"detector/{name}/trigger",
+                                     datetime.now().astimezone().isoformat(timespec="seconds"))
+                case SunEvent():
+                    self.retained["sun"] = event.type.name
+                    self.publish("sun", event.type.name, True)
+
+    async def __connect_loop(self):
+        delay = self.retry[0]
+        while True:
+            try:
+                await self.__session()
+                delay = self.retry[0]
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                # Also a malformed packet, nothing may stop the daemon
+                print(f"{self.__class__.__name__}: {self.host}:{self.port}: {err!r}, "
+                      f"retry in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.retry[1])
+
+    async def __session(self):
+        """Connect, subscribe and handle incoming packets until disconnected"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.keepalive)
+        try:
+            writer.write(connect_packet(f"{self.prefix}-{id(self):x}", self.keepalive,
+                                        f"{self.prefix}/status", "offline"))
+            header, body = await asyncio.wait_for(read_packet(reader), self.keepalive)
+            if header & 0xF0 != CONNACK or len(body) < 2 or body[1] != 0:
+                raise ValueError(f"Connection refused {body.hex()}")
+            writer.write(subscribe_packet(1, f"{self.prefix}/lamp/+/mode/set"))
+            self.connects += 1
+            # The broker may have lost what was sent before
+            self.publish("status", "online", True)
+            for topic, payload in self.retained.items():
+                self.publish(topic, payload, True)
+            self.writer = writer
+            while True:
+                # A read timing out is not cancelled, it would lose data
+                read = asyncio.ensure_future(read_packet(reader))
+                done, _ = await asyncio.wait((read,), timeout=self.keepalive / 2)
+                if not done:
+                    writer.write(packet(PINGREQ))
+                    done, _ = await asyncio.wait((read,), timeout=self.keepalive / 2)
+                    if not done:
+                        read.cancel()
+                        raise asyncio.TimeoutError("No response to PINGREQ")
+                header, body = read.result()
+                if header & 0xF0 == PUBLISH:
+                    self.command(*parse_publish(header, body))
+        finally:
+            self.writer = None
+            writer.close()
+
+    def command(self, topic, payload):
+        """Execute a command received on a topic"""
+        parts = topic.removeprefix(f"{self.prefix}/").split("/")
+        if len(parts) == 4 and parts[0] == "lamp" and parts[2:] == ["mode", "set"]:
+            modes = {mode: ui_mode for ui_mode, mode in LAMP_MODES.items()}
+            ui_mode = modes.get(payload.strip().upper())
+            if ui_mode is not None:
+                self.commands += 1
+                self.light_control.set_relais_mode(parts[1], ui_mode)
+                # Confirm by the state even if unchanged
+                self.retained.pop(f"lamp/{parts[1]}/mode", None)
+                return
+        print(f"{self.__class__.__name__}: ignored command {topic} {payload!r}")
+
+    async def __send_loop(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            delay = self.flush()
+            if delay is not None:
+                await asyncio.sleep(delay)
+                self.wakeup.set()
+
+    def flush(self):
+        """Send pending messages within the rate and the socket buffer
+
+        Returns the seconds to wait before sending more, None if nothing
+        can be sent until the next change or connect.
+        """
+        if self.writer is None:
+            return None
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        transport = self.writer.transport
+        while self.pending and self.tokens >= 1:
+            if transport.get_write_buffer_size() > self.WRITE_LIMIT:
+                # The broker is slow, try again later
+                return self.interval
+            topic = next(iter(self.pending))
+            payload, retain = self.pending.pop(topic)
+            self.writer.write(publish_packet(f"{self.prefix}/{topic}", payload, retain))
+            self.tokens -= 1
+            self.published += 1
+        if self.pending:
+            return (1 - self.tokens) / self.rate
+        return None
+
+    def close(self):
+        """Disconnect from the broker"""
+        if self.writer is not None:
+            self.writer.write(packet(DISCONNECT))
+            self.writer.close()
@@ -1,17 +1,44 @@
+"""nicegui UI of the light control, a client of the I/O daemon
+
+The I/O runs in the separate light_control_new daemon. This UI talks to the
+daemon through the Unix socket protocol defined in ipc.
+"""
 import asyncio
+import os
+import secrets
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
 from nicegui import app, ui
 from nicegui.events import ValueChangeEventArguments
-from light_control_new import LightControl
+from ipc import LightControlClient
+from profiling import ProfileCapture
 from sun import SunEvent, SunEventType
+from activity import WEEKDAYS
 
-light_control = LightControl()
+light_control = LightControlClient()
+# Token admitting admin requests of other hosts than the loopback
+ADMIN_TOKEN = os.environ.get('LIGHT_CONTROL_ADMIN_TOKEN', '')
 
 def update_calib(event):
     if event.value:
-        ui_calib_hvac_a.value = light_control.meters['hvac-a'].energy
-        ui_calib_hvac_b.value = light_control.meters['hvac-b'].energy
-        ui_calib_hvac_c.value = light_control.meters['hvac-c'].energy
-        ui_calib_light.value = light_control.meters['light'].energy
+        try:
+            ui_calib_hvac_a.value = light_control.get_energy('hvac-a')
+            ui_calib_hvac_b.value = light_control.get_energy('hvac-b')
+            ui_calib_hvac_c.value = light_control.get_energy('hvac-c')
+            ui_calib_light.value = light_control.get_energy('light')
+        except KeyError:
+            pass
+
+# Meters shown in the power history chart, key and legend
+HISTORY_METERS = (
+    ('hvac-a', 'Arbeiten + Schlafen'),
+    ('hvac-b', 'Wohnen + Essen'),
+    ('hvac-c', 'Mareike + Ralph'),
+    ('light', 'Außenbeleuchtung'),
+)
+history_versions = {}
+# Detector and version of the activity shown
+activity_version = {}
 
 with ui.tabs() as tabs:
     light = ui.tab('Licht')
@@ -35,7 +62,7 @@ with ui.tab_panels(tabs, value=light):
             with ui.row():
                 ui_lamp_terrace_state = ui.icon('light_mode', color='gray', size='32px').classes('text-5xl')
                 ui_lamp_terrace_mode = ui.toggle({1: 'auto', 2: 'on', 3: 'off'}, value=1, on_change=lambda e: light_control.set_relais_mode('terrasse', e.value)).props('inline')
-            ui_dim_terrace = ui.slider(min=10, max=100, value=100, on_change=lambda e: light_control.dim.set_duty(e.value))
+            ui_dim_terrace = ui.slider(min=10, max=100, value=100, on_change=lambda e: light_control.set_duty(e.value))
         with ui.card():
             ui.label("Lampe Garage").props('inline')
             with ui.row():
@@ -54,8 +81,24 @@ with ui.tab_panels(tabs, value=light):
             ui_det_garage = ui.toggle({1: 'active', 2: 'masked'}, value=1, on_change=lambda e: light_control.set_detector('garage', e.value)).props('inline')
         with ui.card():
             ui.label("Lichtsensor Test").props('inline')
-            ui.button('Sonnenaufgang', on_click=lambda: light_control.sun.send_event_type(SunEventType.SUN_RISE))
-            ui.button('Sonnenuntergang', on_click=lambda: light_control.sun.send_event_type(SunEventType.SUN_SET))
+            ui.button('Sonnenaufgang', on_click=lambda: light_control.send_sun_event(SunEventType.SUN_RISE))
+            ui.button('Sonnenuntergang', on_click=lambda: light_control.send_sun_event(SunEventType.SUN_SET))
+        with ui.card().classes('p-1 m-1 gap-1 w-full'):
+            ui_activity_detector = ui.toggle({'yard': 'Einfahrt', 'terrasse': 'Hof/Garten', 'garage': 'Garage'}, value='yard', on_change=lambda e: update_activity(force=True)).props('inline')
+            ui_activity = ui.echart({
+                'tooltip': {'position': 'top'},
+                'grid': {'top': 10, 'bottom': 60},
+                'xAxis': {'type': 'category', 'data': [f'{hour}' for hour in range(24)]},
+                'yAxis': {'type': 'category', 'data': list(WEEKDAYS), 'inverse': True},
+                'visualMap': {'min': 0, 'max': 1, 'calculable': True, 'orient': 'horizontal', 'left': 'center', 'bottom': 0},
+                'series': [{'name': 'Auslösungen', 'type': 'heatmap', 'data': []}],
+            }).classes('w-full h-64')
+            ui_intervals = ui.echart({
+                'tooltip': {'trigger': 'axis'},
+                'xAxis': {'type': 'category', 'data': []},
+                'yAxis': {'type': 'value', 'name': 'Abstand'},
+                'series': [{'name': 'Auslösungen', 'type': 'bar', 'data': []}],
+            }).classes('w-full h-48')
 
     with ui.tab_panel(energy).classes('p-0 m-0 gap-0'):
         with ui.grid(columns=2).classes('p-1 m-0 gap-1'):
@@ -65,36 +108,50 @@ with ui.tab_panels(tabs, value=light):
                     ui.label("W")
                 ui_hvac_a_power.disable()
                 ui_hvac_a_energy = ui.label("0 kwh").style('color: #6E93D6; font-size: 200%; font-weight: 500')
+                ui_hvac_a_cost = ui.label("0.00 € heute, 0.00 € Monat")
             with ui.card().classes('p-2 m-0'):
                 ui.label("Klima Wohnen + Essen").props('inline')
                 with ui.knob(color='orange', track_color='grey-2', max = 3500, show_value=True).classes('w-full justify-center') as ui_hvac_b_power:
                     ui.label("W")
                 ui_hvac_b_power.disable()
                 ui_hvac_b_energy = ui.label("0 kwh").style('color: #6E93D6; font-size: 200%; font-weight: 500')
+                ui_hvac_b_cost = ui.label("0.00 € heute, 0.00 € Monat")
             with ui.card().classes('p-2 m-0'):
                 ui.label("Klima Mareike + Ralph").props('inline')
                 with ui.knob(color='orange', track_color='grey-2', max = 3500, show_value=True).classes('w-full justify-center') as ui_hvac_c_power:
                     ui.label("W")
                 ui_hvac_c_power.disable()
                 ui_hvac_c_energy = ui.label("0 kwh").style('color: #6E93D6; font-size: 200%; font-weight: 500')
+                ui_hvac_c_cost = ui.label("0.00 € heute, 0.00 € Monat")
             with ui.card().classes('p-2 m-0'):
                 ui.label("Außenbeleuchtung").props('inline')
                 with ui.knob(color='orange', track_color='grey-2', max = 3500, show_value=True).classes('w-full justify-center') as ui_light_power:
                     ui.label("W")
                 ui_light_power.disable()
                 ui_light_energy = ui.label("0 kwh").style('color: #6E93D6; font-size: 200%; font-weight: 500')
+                ui_light_cost = ui.label("0.00 € heute, 0.00 € Monat")
+
+        with ui.card().classes('p-1 m-1 gap-1 w-full'):
+            ui_history_zoom = ui.toggle({'hour': 'Stunde', 'day': 'Tag', 'week': 'Woche'}, value='hour', on_change=lambda e: update_history(force=True)).props('inline')
+            ui_history = ui.echart({
+                'tooltip': {'trigger': 'axis'},
+                'legend': {'data': [name for _, name in HISTORY_METERS]},
+                'xAxis': {'type': 'time'},
+                'yAxis': {'type': 'value', 'name': 'W'},
+                'series': [{'name': name, 'type': 'line', 'showSymbol': False, 'data': []} for _, name in HISTORY_METERS],
+            }).classes('w-full h-64')
 
         with ui.card().classes('p-1 m-1 gap-1'):
             ui_calib_cb = ui.checkbox("Kalibrierung", on_change = update_calib)
             with ui.grid(columns=2).bind_visibility_from(ui_calib_cb, 'value'):
                 ui.label("Zähler links")
-                ui_calib_hvac_c = ui.number(label="HVAC-C", format='%.2f', on_change=lambda e: light_control.meters['hvac-c'].set_energy(e.value))
+                ui_calib_hvac_c = ui.number(label="HVAC-C", format='%.2f', on_change=lambda e: light_control.set_energy('hvac-c', e.value))
                 ui.label("Zähler mitte")
-                ui_calib_hvac_b = ui.number(label="HVAC-B", format='%.2f', on_change=lambda e: light_control.meters['hvac-b'].set_energy(e.value))
+                ui_calib_hvac_b = ui.number(label="HVAC-B", format='%.2f', on_change=lambda e: light_control.set_energy('hvac-b', e.value))
                 ui.label("Zähler rechts")
-                ui_calib_hvac_a = ui.number(label="HVAC-A", format='%.2f', on_change=lambda e: light_control.meters['hvac-a'].set_energy(e.value))
+                ui_calib_hvac_a = ui.number(label="HVAC-A", format='%.2f', on_change=lambda e: light_control.set_energy('hvac-a', e.value))
                 ui.label("Zähler Licht")
-                ui_calib_light = ui.number(label="Licht", format='%.2f', on_change=lambda e: light_control.meters['light'].set_energy(e.value))
+                ui_calib_light = ui.number(label="Licht", format='%.2f', on_change=lambda e: light_control.set_energy('light', e.value))
 
         #with ui.card():
             #columns = [
@@ -112,7 +169,52 @@ with ui.tab_panels(tabs, value=light):
             #]
             #ui.table(columns=columns, rows=rows, row_key='name')
 
-def update_ui():
+async def update_history(force=False):
+    """Push the downsampled power history of the selected zoom to the chart
+
+    The series are only transferred if a meter history changed since the last
+    transfer.
+    """
+    zoom = ui_history_zoom.value
+    changed = False
+    for index, (key, _) in enumerate(HISTORY_METERS):
+        known = history_versions.get(key)
+        version = known[1] if known is not None and known[0] == zoom and not force else None
+        try:
+            history = await light_control.get_history(key, zoom, version)
+        except (KeyError, ConnectionError, asyncio.TimeoutError):
+            continue
+        if history['data'] is not None:
+            history_versions[key] = (zoom, history['version'])
+            ui_history.options['series'][index]['data'] = history['data']
+            changed = True
+    if changed:
+        ui_history.update()
+
+async def update_activity(force=False):
+    """Push the activity heatmap and trigger intervals of the selected detector
+
+    The daemon computes the chart data once per trigger, it is only
+    transferred if it changed since the last transfer.
+    """
+    name = ui_activity_detector.value
+    version = activity_version.get(name) if not force else None
+    try:
+        activity = await light_control.get_activity(name, version)
+    except (KeyError, ConnectionError, asyncio.TimeoutError):
+        return
+    if activity['data'] is not None:
+        activity_version.clear()
+        activity_version[name] = activity['version']
+        data = activity['data']
+        ui_activity.options['series'][0]['data'] = data['heatmap']
+        ui_activity.options['visualMap']['max'] = max(data['max'], 1)
+        ui_activity.update()
+        ui_intervals.options['xAxis']['data'] = data['interval_labels']
+        ui_intervals.options['series'][0]['data'] = data['intervals']
+        ui_intervals.update()
+
+async def update_ui():
     """Update UI states with I/O modes and states
 
     I/O is controlled by events and modes and states change automatically.
@@ -132,23 +234,75 @@ def update_ui():
     ui_lamp_terrace_mode.value = light_control.get_relais_mode('terrasse')
     ui_lamp_garage_mode.value = light_control.get_relais_mode('garage')
 
+    ui_dim_terrace.set_value(light_control.get_duty())
+
     try:
-        ui_hvac_a_power.set_value(round(light_control.meters["hvac-a"].power))
-        ui_hvac_a_energy.set_text(f"{round(light_control.meters['hvac-a'].energy, 2)}kwh")
-        ui_hvac_b_power.set_value(round(light_control.meters["hvac-b"].power))
-        ui_hvac_b_energy.set_text(f"{round(light_control.meters['hvac-b'].energy, 2)}kwh")
-        ui_hvac_c_power.set_value(round(light_control.meters["hvac-c"].power))
-        ui_hvac_c_energy.set_text(f"{round(light_control.meters['hvac-c'].energy, 2)}kwh")
-        ui_light_power.set_value(round(light_control.meters["light"].power))
-        ui_light_energy.set_text(f"{round(light_control.meters['light'].energy, 2)}kwh")
-        ui_dim_terrace.set_value(light_control.dim.duty)
+        ui_hvac_a_power.set_value(light_control.get_power('hvac-a'))
+        ui_hvac_a_energy.set_text(f"{light_control.get_energy('hvac-a')}kwh")
+        cost = light_control.get_cost('hvac-a')
+        ui_hvac_a_cost.set_text(f"{cost['day']:.2f} € heute, {cost['month']:.2f} € Monat")
+        ui_hvac_b_power.set_value(light_control.get_power('hvac-b'))
+        ui_hvac_b_energy.set_text(f"{light_control.get_energy('hvac-b')}kwh")
+        cost = light_control.get_cost('hvac-b')
+        ui_hvac_b_cost.set_text(f"{cost['day']:.2f} € heute, {cost['month']:.2f} € Monat")
+        ui_hvac_c_power.set_value(light_control.get_power('hvac-c'))
+        ui_hvac_c_energy.set_text(f"{light_control.get_energy('hvac-c')}kwh")
+        cost = light_control.get_cost('hvac-c')
+        ui_hvac_c_cost.set_text(f"{cost['day']:.2f} € heute, {cost['month']:.2f} € Monat")
+        ui_light_power.set_value(light_control.get_power('light'))
+        ui_light_energy.set_text(f"{light_control.get_energy('light')}kwh")
+        cost = light_control.get_cost('light')
+        ui_light_cost.set_text(f"{cost['day']:.2f} € heute, {cost['month']:.2f} € Monat")
     except KeyError:
         pass
 
+    await update_history()
+    await update_activity()
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics of the I/O daemon"""
+    try:
+        return await light_control.get_metrics()
+    except (ConnectionError, asyncio.TimeoutError):
+        return PlainTextResponse("light control daemon not connected\n", status_code=503)
+    except KeyError as err:
+        return PlainTextResponse(f"light control daemon failed: {err}\n", status_code=500)
+
+def is_admin(request, token):
+    """Return true for requests from the loopback or with the admin token"""
+    if request.client is not None and request.client.host in ('127.0.0.1', '::1'):
+        return True
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+@app.get('/admin/profile', response_class=PlainTextResponse, include_in_schema=False)
+async def start_profile(request: Request, seconds: int = 30, mode: str = 'sample',
+                        memory: bool = False, token: str = ''):
+    """Hidden admin endpoint starting a profile capture in the I/O daemon
+
+    Only served to the loopback or with the admin token, captures are
+    limited to ProfileCapture.MAX_SECONDS.
+    """
+    if not is_admin(request, token):
+        return PlainTextResponse("forbidden\n", status_code=403)
+    if seconds <= 0:
+        return PlainTextResponse("seconds must be positive\n", status_code=400)
+    seconds = min(seconds, ProfileCapture.MAX_SECONDS)
+    try:
+        base = await light_control.start_profile(seconds, mode, memory)
+    except ValueError as err:
+        return PlainTextResponse(f"{err}\n", status_code=400)
+    except (ConnectionError, asyncio.TimeoutError):
+        return PlainTextResponse("light control daemon not connected\n", status_code=503)
+    if base is None:
+        return PlainTextResponse("capture already running\n", status_code=409)
+    return f"capturing to {base}\n"
+
 async def light_control_main():
-    await light_control.io_main()
+    await light_control.run()
 
 app.on_startup(light_control_main)
 
 ui.timer(1.0, update_ui)
-ui.run(binding_refresh_interval=1, show=False, on_air=False, reload=False)
+if __name__ in {"__main__", "__mp_main__"}:
+    ui.run(binding_refresh_interval=1, show=False, on_air=False, reload=False)
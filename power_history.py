@@ -0,0 +1,180 @@
+"""In memory power history of a S0 meter with server side downsampling"""
+import time
+from collections import deque
+
+
+class PowerSeries:
+    """Min/max bucketed power samples for one zoom level
+
+    The span of the series is split into a fixed amount of buckets. A bucket
+    keeps the minimum and the maximum sample seen within its time range. This
+    limits the amount of points to twice the bucket count, independent of the
+    pulse rate. Buckets are aligned to absolute time, a closed bucket never
+    changes again. New samples only touch the newest bucket, only its points
+    are rendered again as long as no bucket was added or dropped.
+
+    Arguments:
+        span (float): Time covered by the series in seconds
+        budget (int): Amount of buckets
+    """
+    def __init__(self, span, budget):
+        self.span_ns = int(span * 1e9)
+        self.budget = budget
+        self.width_ns = self.span_ns // budget
+        # Bucket: [index, t_min, p_min, t_max, p_max]
+        self.buckets = deque()
+        # Changes with every sample, layout only if buckets are added or dropped
+        self.version = 0
+        self.layout = 0
+        self._points = []
+        self._points_version = -1
+        self._points_layout = -1
+        # Index of the first point of the newest bucket
+        self.newest = 0
+
+    def add(self, timestamp, power):
+        """Add a power sample taken at timestamp (monotonic ns)"""
+        index = timestamp // self.width_ns
+        buckets = self.buckets
+        if buckets and buckets[-1][0] == index:
+            bucket = buckets[-1]
+            if power < bucket[2]:
+                bucket[1], bucket[2] = timestamp, power
+            if power > bucket[4]:
+                bucket[3], bucket[4] = timestamp, power
+        else:
+            buckets.append([index, timestamp, power, timestamp, power])
+            self._expire(index)
+            self.layout += 1
+        self.version += 1
+
+    def _expire(self, index):
+        """Drop buckets that left the span"""
+        buckets = self.buckets
+        while buckets and buckets[0][0] <= index - self.budget:
+            buckets.popleft()
+            self.layout += 1
+            self.version += 1
+
+    def evict(self):
+        """Drop the older half of the buckets and the rendered points"""
+        for _ in range(len(self.buckets) // 2):
+            self.buckets.popleft()
+        self._points = []
+        self._points_version = -1
+        self._points_layout = -1
+        self.layout += 1
+        self.version += 1
+
+    @staticmethod
+    def _bucket_points(bucket):
+        """Return the one or two points of a bucket in time order"""
+        _, t_min, p_min, t_max, p_max = bucket
+        if t_min == t_max:
+            return [(t_min, p_min)]
+        if t_min < t_max:
+            return [(t_min, p_min), (t_max, p_max)]
+        return [(t_max, p_max), (t_min, p_min)]
+
+    def points(self, now=None):
+        """Return the downsampled series as list of (timestamp, power)
+
+        Timestamps are monotonic ns as passed to add. The list is kept and
+        updated in place: rebuilt if buckets were added or dropped, else only
+        the points of the newest bucket are replaced. Callers must not
+        modify it.
+
+        Arguments:
+            now (int): Current monotonic time in ns, for expiring old buckets
+        """
+        now = time.monotonic_ns() if now is None else now
+        self._expire(now // self.width_ns)
+        if self._points_version == self.version:
+            return self._points
+        points = self._points
+        if self._points_layout != self.layout:
+            points.clear()
+            for bucket in self.buckets:
+                self.newest = len(points)
+                points.extend(self._bucket_points(bucket))
+            self._points_layout = self.layout
+        else:
+            points[self.newest:] = self._bucket_points(self.buckets[-1])
+        self._points_version = self.version
+        return points
+
+
+class PowerHistory:
+    """Power history of a meter for a fixed set of zoom levels
+
+    Each zoom level keeps a PowerSeries that is extended incrementally by
+    every sample. Rendering a zoom level is shared by all clients and only
+    done if the series changed, mostly only for the newest bucket.
+
+    Arguments:
+        budget (int): Amount of buckets per zoom level
+        now_func (callable): Monotonic clock in ns of the samples, default
+            time.monotonic_ns
+        wall_func (callable): Wall clock in s since the epoch for charting,
+            default time.time
+    """
+    ZOOMS = {
+        "hour": 3600,
+        "day": 86400,
+        "week": 7 * 86400,
+    }
+
+    def __init__(self, budget=240, now_func=None, wall_func=None):
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.wall_func = wall_func if wall_func is not None else time.time
+        self.series = {zoom: PowerSeries(span, budget)
+                       for zoom, span in self.ZOOMS.items()}
+        # Per zoom: [layout, version, wall clock offset, data] of chart_data
+        self._charts = {zoom: [-1, -1, 0, []] for zoom in self.ZOOMS}
+
+    def add(self, timestamp, power):
+        """Add a power sample taken at timestamp (monotonic ns)"""
+        for series in self.series.values():
+            series.add(timestamp, power)
+
+    def points(self, zoom, now=None):
+        """Return the downsampled points of a zoom level
+
+        Arguments:
+            zoom (str): One of ZOOMS
+            now (int): Current monotonic time in ns, default by now_func
+        """
+        return self.series[zoom].points(now if now is not None else self.now_func())
+
+    def evict(self):
+        """Drop the older half of all zoom levels, e.g. under memory pressure"""
+        for series in self.series.values():
+            series.evict()
+        self._charts = {zoom: [-1, -1, 0, []] for zoom in self.ZOOMS}
+
+    def version(self, zoom):
+        """Return a counter changing whenever the zoom level changes"""
+        return self.series[zoom].version
+
+    def chart_data(self, zoom):
+        """Return the points of a zoom level as [epoch ms, watts] pairs
+
+        Monotonic timestamps are mapped to wall clock time for charting. Like
+        the points the list is kept per zoom level and updated in place,
+        callers must not modify it.
+        """
+        series = self.series[zoom]
+        now = self.now_func()
+        points = series.points(now)
+        chart = self._charts[zoom]
+        layout, version, offset, data = chart
+        if version == series.version:
+            return data
+        if layout == series.layout:
+            start = series.newest
+        else:
+            offset = int(self.wall_func() * 1e9) - now
+            start = 0
+        data[start:] = [[(t + offset) // 1000000, round(p, 1)] for t, p in points[start:]]
+        chart[:3] = series.layout, series.version, offset
+        return data
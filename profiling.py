@@ -0,0 +1,141 @@
+"""On demand profile capture of the running process
+
+Nothing is installed or running unless a capture is active. Modes:
+
+    sample:   A thread samples the stacks of all threads, the event loop and
+              the executor threads, and writes them as collapsed stacks
+              (<base>.folded), ready for flamegraph.pl or speedscope.
+    cprofile: cProfile of the event loop thread written as <base>.pstats.
+
+Optionally a tracemalloc snapshot is taken at the end of the capture
+(<base>.tracemalloc and a top list <base>.tracemalloc.txt) and passed to
+the registered snapshot sinks. Tracing already active is left running.
+Files and snapshots are written off the event loop, by the sampling thread
+or an executor thread.
+"""
+import asyncio
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class ProfileCapture:
+    """Capture profiles of the running process for a given time
+
+    Arguments:
+        directory (str): Directory the profiles are written to
+        interval (float): Sampling interval of sample mode in seconds
+    """
+    MODES = ("sample", "cprofile")
+    # Longest capture in seconds, longer ones are shortened
+    MAX_SECONDS = 300
+    MEMORY_FRAMES = 10
+    MEMORY_TOP = 50
+
+    def __init__(self, directory="/var/lib/light-control", interval=0.005):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+        self.started_tracing = False
+        self.snapshot_sinks = []
+
+    def register_snapshot_sink(self, sink):
+        """Register a callable receiving the tracemalloc snapshot of a capture
+
+        Called from the sampling thread or an executor thread, never from the
+        event loop.
+        """
+        self.snapshot_sinks.append(sink)
+
+    def start(self, seconds=30, mode="sample", memory=False):
+        """Start a capture, return the base path of the files written
+
+        Returns None if a capture is already running. cprofile mode must be
+        started from the event loop thread. Captures are limited to
+        MAX_SECONDS.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profile mode {mode}")
+        if not seconds > 0:  # pylint: disable=unnecessary-negation; rejects NaN too
+            raise ValueError(f"Profile duration must be positive, not {seconds}")
+        seconds = min(seconds, self.MAX_SECONDS)
+        if self.running:
+            return None
+        self.running = True
+        base = os.path.join(self.directory,
+                            f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        self.started_tracing = memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(self.MEMORY_FRAMES)
+        if mode == "sample":
+            threading.Thread(target=self.__sample, args=(seconds, base, memory),
+                             name=self.__class__.__name__, daemon=True).start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            asyncio.get_running_loop().call_later(
+                seconds, self.__stop_cprofile, profiler, base, memory)
+        print(f"{self.__class__.__name__}: {mode} capture for {seconds}s to {base}")
+        return base
+
+    def __sample(self, seconds, base, memory):
+        """Sample the stacks of all other threads, write collapsed stacks"""
+        own = threading.get_ident()
+        stacks = {}
+        stop = time.monotonic() + seconds
+        while time.monotonic() < stop:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == own:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                calls.append(names.get(ident, str(ident)))
+                stack = ";".join(reversed(calls))
+                stacks[stack] = stacks.get(stack, 0) + 1
+            time.sleep(self.interval)
+        try:
+            with open(f"{base}.folded", "w", encoding="utf-8") as folded:
+                for stack, count in stacks.items():
+                    folded.write(f"{stack} {count}\n")
+        except OSError as err:
+            print(f"Error storing profile at {base}: {err}")
+        self.__finish(base, memory)
+
+    def __stop_cprofile(self, profiler, base, memory):
+        """Stop profiling the loop, write the results in an executor thread"""
+        profiler.disable()
+        asyncio.get_running_loop().run_in_executor(
+            None, self.__write_cprofile, profiler, base, memory)
+
+    def __write_cprofile(self, profiler, base, memory):
+        try:
+            profiler.dump_stats(f"{base}.pstats")
+        except OSError as err:
+            print(f"Error storing profile at {base}: {err}")
+        self.__finish(base, memory)
+
+    def __finish(self, base, memory):
+        """Take the memory snapshot if requested, end the capture"""
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            if self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+            for sink in self.snapshot_sinks:
+                sink(snapshot)
+            try:
+                snapshot.dump(f"{base}.tracemalloc")
+                with open(f"{base}.tracemalloc.txt", "w", encoding="utf-8") as top:
+                    for stat in snapshot.statistics("lineno")[:self.MEMORY_TOP]:
+                        top.write(f"{stat}\n")
+            except OSError as err:
+                print(f"Error storing memory snapshot at {base}: {err}")
+        self.running = False
+        print(f"{self.__class__.__name__}: capture {base} finished")
@@ -0,0 +1,231 @@
+"""Binary log of meter pulses for reconciliation of the meter totals
+
+Every pulse of a meter is appended to a file per UTC day as little endian
+int64 wall clock time in ns:
+
+    <directory>/2026-10-19.pulses
+
+The persisted total of a meter is complete up to a point in time. Pulses
+logged after that point are counted at start, the total is correct even
+if the state file is stale after a crash or a restored backup.
+
+Times are kept non decreasing within the log, a clock stepped back by NTP
+does not reorder it. Counting pulses after a time is then a binary search
+in the first day file and the sizes of the later ones.
+
+pulses() only appends to a queue and never blocks the event loop. A writer
+thread appends what arrived meanwhile to the day files and removes the
+expired ones.
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+DAY_NS = 86400 * 10**9
+SUFFIX = ".pulses"
+STAMP_SIZE = 8
+
+
+def _day_file(day):
+    """Return the file name of a day since epoch"""
+    return datetime.fromtimestamp(day * 86400, timezone.utc).date().isoformat() + SUFFIX
+
+
+def _file_day(name):
+    """Return the day since epoch of a file name, None if no day file"""
+    if not name.endswith(SUFFIX):
+        return None
+    try:
+        date = datetime.fromisoformat(name.removesuffix(SUFFIX))
+    except ValueError:
+        return None
+    return int(date.replace(tzinfo=timezone.utc).timestamp()) // 86400
+
+
+def _load(path):
+    """Return the complete records of a day file as array"""
+    stamps = array("q")
+    with open(path, "rb") as file:
+        data = file.read()
+    stamps.frombytes(data[:len(data) - len(data) % STAMP_SIZE])
+    if sys.byteorder != "little":
+        stamps.byteswap()
+    return stamps
+
+
+class PulseLog:
+    """Pulse log of one meter
+
+    Passed to an S0Meter, which appends the pulses it counts.
+
+    Arguments:
+        directory (str): Directory of the day files, created if missing
+        keep_days (int): Days kept, older files are removed at day change
+        now_func (callable): Monotonic clock in ns of the pulse timestamps,
+            default time.monotonic_ns
+        wall_func (callable): Wall clock in s since the epoch, default
+            time.time
+    """
+    def __init__(self, directory, keep_days=400, now_func=None, wall_func=None):
+        self.directory = directory
+        self.keep_days = keep_days
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.wall_func = wall_func if wall_func is not None else time.time
+        # Writer thread, started by the first pulses after creation or close
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.fd = None
+        self.day = None
+        # Time of the last logged pulse, wall clock ns
+        self.last = None
+        # Metrics: pulses written, write errors
+        self.written = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+        days = self.days()
+        if days:
+            stamps = _load(self.path(days[-1]))
+            if stamps:
+                self.last = stamps[-1]
+
+    def path(self, day):
+        """Return the path of the file of a day since epoch"""
+        return os.path.join(self.directory, _day_file(day))
+
+    def days(self):
+        """Return the days since epoch with a file, oldest first"""
+        days = (_file_day(name) for name in os.listdir(self.directory))
+        return sorted(day for day in days if day is not None)
+
+    def pulses(self, timestamps):
+        """Append pulses, timestamps in monotonic ns
+
+        Returns the wall clock time of the last pulse in ns, None if there
+        were no timestamps. The pulses are written by the writer thread.
+        """
+        if len(timestamps) == 0:
+            return None
+        offset = int(self.wall_func() * 1e9) - self.now_func()
+        last = self.last if self.last is not None else -1 << 63
+        stamps = array("q")
+        for timestamp in timestamps:
+            last = max(last, timestamp + offset)
+            stamps.append(last)
+        self.last = last
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__write, name=self.__class__.__name__,
+                                           daemon=True)
+            self.thread.start()
+        self.queue.put(stamps)
+        return last
+
+    def flush(self):
+        """Wait until the pulses passed before are written"""
+        if self.thread is not None:
+            written = threading.Event()
+            self.queue.put(written)
+            written.wait()
+
+    def close(self):
+        """Write the pending pulses, stop the writer thread and close the file"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __write(self):
+        """Writer thread, appends what arrived meanwhile in one batch"""
+        running = True
+        while running:
+            items = [self.queue.get()]
+            try:
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stamps = array("q")
+            for item in items:
+                if isinstance(item, array):
+                    stamps.extend(item)
+                    continue
+                self.__append(stamps)
+                del stamps[:]
+                if item is None:
+                    running = False
+                else:
+                    item.set()
+            self.__append(stamps)
+        self.__close_file()
+
+    def __append(self, stamps):
+        """Append sorted stamps to their day files"""
+        try:
+            start = 0
+            while start < len(stamps):
+                day = stamps[start] // DAY_NS
+                end = bisect_left(stamps, (day + 1) * DAY_NS, start)
+                self.__append_day(day, stamps[start:end])
+                start = end
+        except OSError as err:
+            self.errors += 1
+            print(f"Error writing pulse log {self.directory}: {err}")
+
+    def __append_day(self, day, stamps):
+        if day != self.day:
+            self.__open(day)
+        if sys.byteorder != "little":
+            stamps.byteswap()
+        os.write(self.fd, stamps)
+        self.written += len(stamps)
+
+    def __open(self, day):
+        """Open the file of a day for appending, remove expired files"""
+        self.__close_file()
+        self.fd = os.open(self.path(day), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # Drop a record partially written before a crash
+        size = os.fstat(self.fd).st_size
+        if size % STAMP_SIZE:
+            os.ftruncate(self.fd, size - size % STAMP_SIZE)
+        self.day = day
+        for old in self.days():
+            if old <= day - self.keep_days:
+                os.remove(self.path(old))
+
+    def __close_file(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.day = None
+
+    def count_after(self, after):
+        """Return the amount of pulses logged after a wall clock time in ns"""
+        self.flush()
+        first = after // DAY_NS
+        count = 0
+        for day in self.days():
+            if day == first:
+                stamps = _load(self.path(day))
+                count += len(stamps) - bisect_right(stamps, after)
+            elif day > first:
+                count += os.path.getsize(self.path(day)) // STAMP_SIZE
+        return count
+
+    def read(self, start, end):
+        """Return the pulses from start to before end as array
+
+        Arguments:
+            start (int): Wall clock time in ns
+            end (int): Wall clock time in ns
+        """
+        self.flush()
+        result = array("q")
+        for day in self.days():
+            if start // DAY_NS <= day <= (end - 1) // DAY_NS:
+                stamps = _load(self.path(day))
+                result.extend(stamps[bisect_left(stamps, start):bisect_left(stamps, end)])
+        return result
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from activity import DetectorActivity
+from app_state import AppState
+from gpio_sim import SimGpioMap
+from light_control_new import LightControl
+
+
+class Clock:
+    """Wall clock and monotonic ns advanced together"""
+    def __init__(self):
+        # A Monday
+        self.wall = datetime.fromisoformat("2026-03-02T20:30:00+01:00")
+        self.ns = 0
+
+    def advance(self, seconds):
+        self.wall += timedelta(seconds=seconds)
+        self.ns += int(seconds * 1e9)
+
+
+class TestDetectorActivity:
+
+    def test_histograms(self):
+        clock = Clock()
+        activity = DetectorActivity("activity", now_func=lambda: clock.wall)
+        for seconds in (0, 3, 60, 2000):
+            clock.advance(seconds)
+            activity.trigger(clock.ns)
+        assert activity.count == 4
+        assert activity.hours[20] == 3
+        assert activity.hours[21] == 1
+        # 3s, 60s and 2000s since the previous trigger
+        assert activity.intervals[0] == 1
+        assert activity.intervals[activity.INTERVALS.index(60)] == 1
+        assert activity.intervals[activity.INTERVALS.index(3600)] == 1
+        clock.advance(6 * 86400)
+        activity.trigger(clock.ns)
+        assert activity.hours[6 * 24 + 21] == 1
+        assert activity.intervals[-1] == 1
+        days = activity.chart_data()["days"]
+        assert days[-1] == 1
+        assert days[-7] == 4
+        assert sum(days) == 5
+
+    def test_ring_of_days(self):
+        clock = Clock()
+        activity = DetectorActivity("activity", now_func=lambda: clock.wall)
+        activity.trigger(clock.ns)
+        clock.advance(activity.DAYS * 86400)
+        assert activity.chart_data()["days"] == [0] * activity.DAYS
+        # Hour of week counts are kept
+        assert sum(activity.hours) == 1
+
+    def test_chart_cache(self):
+        clock = Clock()
+        activity = DetectorActivity("activity", now_func=lambda: clock.wall)
+        activity.trigger(clock.ns)
+        chart = activity.chart_data()
+        assert chart["max"] == 1
+        assert [20, 0, 1] in chart["heatmap"]
+        assert len(chart["heatmap"]) == 7 * 24
+        assert activity.chart_data() is chart
+        clock.advance(10)
+        activity.trigger(clock.ns)
+        assert activity.chart_data() is not chart
+        assert activity.chart_data()["max"] == 2
+
+    @pytest.mark.asyncio
+    async def test_state(self, tmp_path):
+        clock = Clock()
+        state_file = str(tmp_path / "state.json")
+        activity = DetectorActivity("activity", AppState(state_file), lambda: clock.wall)
+        for _ in range(3):
+            clock.advance(20)
+            activity.trigger(clock.ns)
+        activity.app_state.store_state()
+        clock.advance(86400)
+        restored = DetectorActivity("activity", AppState(state_file), lambda: clock.wall)
+        assert restored.hours == activity.hours
+        assert restored.intervals == activity.intervals
+        assert restored.chart_data()["days"][-2:] == [3, 0]
+        # Intervals do not span a restart
+        restored.trigger(clock.ns)
+        assert sum(restored.intervals) == 2
+
+    @pytest.mark.asyncio
+    async def test_store_rate(self, tmp_path):
+        clock = Clock()
+        app_state = AppState(str(tmp_path / "state.json"))
+        activity = DetectorActivity("activity", app_state, lambda: clock.wall)
+        requested = []
+        app_state.request_store = lambda: requested.append(clock.ns)
+        # Continuous motion for two hours
+        for _ in range(2 * 360):
+            activity.trigger(clock.ns)
+            clock.advance(10)
+        assert requested == [0, 3600 * 10**9]
+
+    @pytest.mark.asyncio
+    async def test_light_control(self, tmp_path):
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, str(tmp_path / "state.json"))
+        task = asyncio.create_task(light_control.io_main())
+        while light_control.dispatcher is None or not light_control.detectors:
+            await asyncio.sleep(0.01)
+        first = light_control.get_activity("yard")
+        assert first["data"]["count"] == 0
+        assert light_control.get_activity("yard", first["version"])["data"] is None
+        gpio.inject(0)
+        async with asyncio.timeout(2.0):
+            while light_control.detectors["yard"].activity.count == 0:
+                await asyncio.sleep(0.01)
+        assert light_control.get_activity("yard", first["version"])["data"]["count"] == 1
+        assert 'detector_triggers_total{detector="yard"} 1' in light_control.get_metrics()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import stat
 import json
@@ -74,3 +75,17 @@ class TestAppState():
     def test_missing_state(self, tmp_path):
         s = AppState(str(tmp_path / "state.json"))
         assert s.get_state("missing") == None
+
+    @pytest.mark.asyncio
+    async def test_request_store(self, tmp_path):
+        p = tmp_path / "state.json"
+        s = AppState(str(p))
+        client = Mock(spec=Stateful)
+        client.state = State("TEST_OBJ", {"app_state": 42})
+        s.register_client(client)
+        s.request_store(0.01)
+        s.request_store(0.01)
+        assert json.loads(p.read_text()) == {}
+        await asyncio.sleep(0.05)
+        assert json.loads(p.read_text()) == {"TEST_OBJ": {"app_state": 42}}
+        assert s.store_count == 2
@@ -10,7 +10,7 @@ class TestGpioMap:
     """
     def test_gpio_single_on(self):
         with GpioMap("test_all_on") as gpio:
-            for seq in range(len(gpio.RELAIS_PINS)):
+            for seq in range(len(gpio.relais_pins)):
                 gpio.set_relais(seq, RelaisState.ON)
                 # S0 inpout filtes take up 100ms to react
                 time.sleep(0.2)
@@ -25,13 +25,13 @@ class TestGpioMap:
 
     def test_gpio_all_on(self):
         with GpioMap("test_all_on") as gpio:
-            for seq in range(len(gpio.RELAIS_PINS)):
+            for seq in range(len(gpio.relais_pins)):
                 gpio.set_relais(seq, RelaisState.ON)
             # S0 inpout filtes take up 100ms to react
             time.sleep(0.2)
             events = gpio.read_input_events(0)
             assert set([e.s0_index for e in events]) == set(range(8))
-            for seq in range(len(gpio.RELAIS_PINS)):
+            for seq in range(len(gpio.relais_pins)):
                 gpio.set_relais(seq, RelaisState.OFF)
             events = gpio.read_input_events(0)
             assert len(events) == 0
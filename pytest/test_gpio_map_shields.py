@@ -0,0 +1,87 @@
+import os
+import sys
+import types
+import mock
+import pytest
+from gpio_map import GpioMap, Shield, RelaisState
+
+class FakeRequest:
+    """gpiod LineRequest with a real event fd"""
+    def __init__(self, chip_path, config):
+        self.chip_path = chip_path
+        self.lines = list(config)
+        self.fd, self._write_fd = os.pipe()
+        self.values = {}
+        self.events = []
+
+    def set_value(self, line, value):
+        self.values[line] = value
+
+    def set_values(self, values):
+        self.values.update(values)
+
+    def push(self, line, timestamp_ns):
+        self.events.append(mock.Mock(line_offset=line, timestamp_ns=timestamp_ns))
+        os.write(self._write_fd, b"x")
+
+    def read_edge_events(self):
+        os.read(self.fd, 1024)
+        events, self.events = self.events, []
+        return events
+
+
+@pytest.fixture
+def fake_hw():
+    requests = []
+    gpiod = types.ModuleType("gpiod")
+    gpiod.__version__ = "2.1.0"
+    gpiod.LineSettings = mock.Mock
+    gpiod.request_lines = lambda chip_path, consumer, config: \
+        requests.append(FakeRequest(chip_path, config)) or requests[-1]
+    gpiod.line = types.SimpleNamespace(Direction=mock.Mock(), Edge=mock.Mock(),
+                                       Value=lambda value: value)
+    rpi = types.ModuleType("RPi")
+    rpi.version = types.SimpleNamespace(board_type="3B+")
+    pwm = types.SimpleNamespace(HardwarePWM=mock.Mock())
+    modules = {"gpiod": gpiod, "gpiod.line": gpiod.line, "RPi": rpi,
+               "RPi.version": rpi.version, "rpi_hardware_pwm": pwm}
+    with mock.patch.dict(sys.modules, modules):
+        yield requests
+
+
+class TestGpioMapShields:
+
+    SHIELDS = (
+        Shield("/dev/gpiochip0", (1, 2), (10, 11), ((1, 2000),)),
+        Shield("/dev/gpiochip1", (3,), (10, 12)),
+    )
+
+    def test_default_shield(self, fake_hw):
+        gpio = GpioMap("test")
+        assert gpio.relais_pins == GpioMap.RELAIS_PINS
+        assert gpio.s0_pins == GpioMap.S0_PINS
+        assert [r.chip_path for r in fake_hw] == [GpioMap.CHIP_PATH] * 2
+
+    def test_index_space(self, fake_hw):
+        gpio = GpioMap("test", self.SHIELDS)
+        assert gpio.relais_pins == (1, 2, 3)
+        assert gpio.s0_pins == (10, 11, 10, 12)
+        assert len(gpio.pwms) == 1
+
+    def test_relais(self, fake_hw):
+        with GpioMap("test", self.SHIELDS) as gpio:
+            gpio.set_relais(2, RelaisState.ON)
+            assert fake_hw[2].values[3] == RelaisState.ON
+            assert gpio.get_relais(2) == RelaisState.ON
+        assert fake_hw[2].values[3] == RelaisState.OFF
+
+    def test_multiplexed_read(self, fake_hw):
+        gpio = GpioMap("test", self.SHIELDS)
+        s0_chip0, s0_chip1 = fake_hw[1], fake_hw[3]
+        assert gpio.read_input_events(0) == []
+        s0_chip1.push(12, 100)
+        s0_chip1.push(10, 101)
+        s0_chip0.push(10, 102)
+        events = gpio.read_input_events(0.1)
+        assert sorted((e.s0_index, e.event.timestamp_ns) for e in events) == \
+            [(0, 102), (2, 101), (3, 100)]
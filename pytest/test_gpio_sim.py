@@ -0,0 +1,52 @@
+import threading
+from array import array
+from gpio_sim import SimGpioMap
+from gpio_map import RelaisState
+
+class TestSimGpioMap:
+
+    def test_inject(self):
+        gpio = SimGpioMap()
+        gpio.inject(3, 1234)
+        gpio.inject(5)
+        events = gpio.read_input_events(0)
+        assert [e.s0_index for e in events] == [3, 5]
+        assert events[0].event.timestamp_ns == 1234
+        assert events[0].event.line_offset == gpio.s0_pins[3]
+        assert gpio.read_input_events(0) == []
+
+    def test_read_input_timestamps(self):
+        gpio = SimGpioMap()
+        timestamps = [None] * 8
+        timestamps[2] = array("q", bytes(8))
+        counts = [0] * 8
+        wanted = [False] * 8
+        wanted[3] = True
+        for timestamp in (10, 20, 30):
+            gpio.inject(2, timestamp)
+        gpio.inject(3, 40)
+        gpio.inject(4, 50)
+        events = gpio.read_input_timestamps(timestamps, counts, wanted, 0)
+        assert [e.s0_index for e in events] == [3]
+        assert counts == [0, 0, 3, 1, 1, 0, 0, 0]
+        # Buffer grown on overflow
+        assert list(timestamps[2][:3]) == [10, 20, 30]
+
+    def test_wait(self):
+        gpio = SimGpioMap()
+        threading.Timer(0.05, gpio.inject, (1,)).start()
+        events = gpio.read_input_events(1)
+        assert [e.s0_index for e in events] == [1]
+
+    def test_relais_loopback(self):
+        with SimGpioMap(loopback=True) as gpio:
+            gpio.set_relais(2, RelaisState.ON)
+            assert gpio.get_relais(2) == RelaisState.ON
+            assert [e.s0_index for e in gpio.read_input_events(0)] == [2]
+            gpio.set_relais(2, RelaisState.OFF)
+            assert gpio.read_input_events(0) == []
+
+    def test_pwm(self):
+        gpio = SimGpioMap()
+        gpio.set_pwm(0, 150)
+        assert gpio.pwm_duty[0] == 100
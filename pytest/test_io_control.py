@@ -0,0 +1,282 @@
+import asyncio
+from array import array
+import mock
+import pytest
+from gpio_sim import SimGpioMap
+from gpio_map import RelaisState, Shield
+from app_state import AppState
+from io_control import TimedRelais, RelaisMode, S0EventDispatcher, S0Detector, Dimmer
+from io_control import RelaisGuard, PulseFilter
+from sun import SunEvent, SunEventType
+
+class TestTimedRelais:
+
+    @pytest.mark.asyncio
+    async def test_timed_on_off(self):
+        gpio = SimGpioMap()
+        relais = TimedRelais("Test", gpio, 1)
+        relais.update(0, 0.02)
+        await asyncio.sleep(0.01)
+        assert relais.state == RelaisState.ON
+        await asyncio.wait_for(relais.wait(), 1)
+        assert relais.state == RelaisState.OFF
+        assert relais.switch_count == 2
+
+    @pytest.mark.asyncio
+    async def test_reschedule(self):
+        relais = TimedRelais("Test", SimGpioMap(), 1)
+        relais.update(0, 0.01)
+        relais.update(0, 0.02)
+        assert relais.reschedule_count == 1
+        await asyncio.wait_for(relais.wait(), 1)
+
+    @pytest.mark.asyncio
+    async def test_mode(self):
+        relais = TimedRelais("Test", SimGpioMap(), 1)
+        relais.mode = RelaisMode.ON
+        assert relais.state == RelaisState.ON
+        relais.mode = RelaisMode.AUTO
+        assert relais.state == RelaisState.OFF
+        assert relais.switch_count == 2
+
+
+    @pytest.mark.asyncio
+    async def test_relais_test_shields(self):
+        gpio = SimGpioMap(shields=(Shield("/dev/gpiochip0", (1,), (10,)),
+                                   Shield("/dev/gpiochip1", (3, 4), (12,))))
+        with mock.patch.object(TimedRelais, "update") as update, \
+                mock.patch.object(TimedRelais, "wait", mock.AsyncMock()):
+            await TimedRelais.relais_test(gpio)
+        # All relais of the shields, not of the default shield
+        assert update.call_count == 3
+
+class TestRelaisGuard:
+
+    @pytest.mark.asyncio
+    async def test_coalesce(self):
+        relais = TimedRelais("Test", SimGpioMap(), 1, guard=RelaisGuard(0.05, 0.05))
+        relais.mode = RelaisMode.ON
+        # Mis-tap off and on again within the dwell time
+        relais.mode = RelaisMode.OFF
+        relais.mode = RelaisMode.ON
+        assert relais.state == RelaisState.ON
+        assert relais.guard.suppressed == 2
+        relais.mode = RelaisMode.OFF
+        assert relais.state == RelaisState.ON
+        await asyncio.sleep(0.07)
+        assert relais.state == RelaisState.OFF
+        assert relais.switch_count == 2
+        assert relais.guard.suppressed == 2
+
+    @pytest.mark.asyncio
+    async def test_trigger_on_not_delayed(self):
+        relais = TimedRelais("Test", SimGpioMap(), 1, guard=RelaisGuard(0.01, 10))
+        relais.mode = RelaisMode.ON
+        await asyncio.sleep(0.02)
+        relais.mode = RelaisMode.AUTO
+        assert relais.state == RelaisState.OFF
+        # Within the minimum off time
+        relais.update(0, 0.05)
+        await asyncio.sleep(0.001)
+        assert relais.state == RelaisState.ON
+        await asyncio.wait_for(relais.wait(), 1)
+        assert relais.state == RelaisState.OFF
+        assert relais.guard.suppressed == 0
+
+
+class TestWarmRestart:
+
+    @pytest.mark.asyncio
+    async def test_relais_window(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        relais = TimedRelais("Test", SimGpioMap(), 1, app_state=app_state)
+        relais.update(0, 0.2)
+        await asyncio.sleep(0.01)
+        app_state.store_state()
+        relais.timer.cancel()
+
+        gpio = SimGpioMap()
+        restored = TimedRelais("Test", gpio, 1,
+                               app_state=AppState(str(tmp_path / "state.json")))
+        await asyncio.sleep(0.01)
+        assert restored.state == RelaisState.ON
+        await asyncio.wait_for(restored.wait(), 1)
+        assert restored.state == RelaisState.OFF
+
+    @pytest.mark.asyncio
+    async def test_relais_window_wall_clock(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        wall = [1000.]
+        relais = TimedRelais("Test", SimGpioMap(), 1, app_state=AppState(state_file),
+                             wall_func=lambda: wall[0])
+        relais.update(5, 10)
+        assert relais.persistent_state()["window"] == [pytest.approx(1005, abs=0.1),
+                                                       pytest.approx(1015, abs=0.1)]
+        relais.app_state.store_state()
+        relais.timer.cancel()
+
+        wall[0] = 1020.
+        restored = TimedRelais("Test", SimGpioMap(), 1, app_state=AppState(state_file),
+                               wall_func=lambda: wall[0])
+        assert restored.timer is None
+        wall[0] = 1010.
+        restored = TimedRelais("Test", SimGpioMap(), 1, app_state=AppState(state_file),
+                               wall_func=lambda: wall[0])
+        assert restored.state == RelaisState.ON
+        assert restored.timer.when() - asyncio.get_running_loop().time() == \
+            pytest.approx(5, abs=0.1)
+        restored.timer.cancel()
+
+    @pytest.mark.asyncio
+    async def test_relais_window_stored(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        relais = TimedRelais("Test", SimGpioMap(), 1, app_state=app_state)
+        requested = []
+        app_state.request_store = lambda: requested.append(relais.persistent_state()["window"])
+        relais.update(5, 10)
+        assert len(requested) == 1
+        # Within the window, nothing to store
+        relais.update(6, 5)
+        assert len(requested) == 1
+        relais.update(5, 20)
+        assert len(requested) == 2
+        relais.timer.cancel()
+
+    @pytest.mark.asyncio
+    async def test_relais_window_elapsed(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        relais = TimedRelais("Test", SimGpioMap(), 1, app_state=app_state)
+        relais.mode = RelaisMode.OFF
+        relais.update(0, 0.01)
+        app_state.store_state()
+        await asyncio.sleep(0.02)
+
+        restored = TimedRelais("Test", SimGpioMap(), 1,
+                               app_state=AppState(str(tmp_path / "state.json")))
+        assert restored.mode == RelaisMode.OFF
+        assert restored.timer is None
+
+    @pytest.mark.asyncio
+    async def test_detector_dimmer(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        detector = S0Detector("Detector", (), app_state=app_state)
+        dimmer = Dimmer("Dimmer", SimGpioMap(), app_state=app_state)
+        for queue in (detector.queue, dimmer.queue):
+            queue.put_nowait(SunEvent(SunEventType.SUN_RISE, None, None))
+        await asyncio.sleep(0.01)
+        # Changed by the UI
+        detector.mask = False
+        dimmer.duty = 40
+        app_state.store_state()
+
+        app_state = AppState(str(tmp_path / "state.json"))
+        gpio = SimGpioMap()
+        detector = S0Detector("Detector", (), app_state=app_state)
+        dimmer = Dimmer("Dimmer", gpio, app_state=app_state)
+        assert not detector.mask
+        assert gpio.pwm_duty[0] == 40
+        # Sun state as before the restart keeps the restored values
+        for queue in (detector.queue, dimmer.queue):
+            queue.put_nowait(SunEvent(SunEventType.SUN_RISE, None, None))
+        await asyncio.sleep(0.01)
+        assert not detector.mask
+        assert dimmer.duty == 40
+        # Later events apply as usual
+        detector.queue.put_nowait(SunEvent(SunEventType.SUN_SET, None, None))
+        detector.queue.put_nowait(SunEvent(SunEventType.SUN_RISE, None, None))
+        await asyncio.sleep(0.01)
+        assert detector.mask
+
+
+class TestPulseFilter:
+
+    def test_interval(self):
+        pulse_filter = PulseFilter.for_meter(2000, 3600)  # 0.5 s
+        timestamps = array("q", [0, 10**8, 6 * 10**8, 7 * 10**8, 12 * 10**8])
+        assert pulse_filter.apply(timestamps, 5, ()) == 3
+        assert list(timestamps[:3]) == [0, 6 * 10**8, 12 * 10**8]
+        assert pulse_filter.rejected_interval == 2
+        # The interval spans batches
+        timestamps = array("q", [14 * 10**8, 18 * 10**8])
+        assert pulse_filter.apply(timestamps, 2, ()) == 1
+        assert timestamps[0] == 18 * 10**8
+
+    def test_switching(self):
+        pulse_filter = PulseFilter(blanking=(0.001, 0.02))
+        switch = 10**9
+        timestamps = array("q", [switch - 2 * 10**6, switch - 10**5, switch + 10**7,
+                                 switch + 3 * 10**7])
+        assert pulse_filter.apply(timestamps, 4, [0, switch]) == 2
+        assert list(timestamps[:2]) == [switch - 2 * 10**6, switch + 3 * 10**7]
+        assert pulse_filter.rejected_switching == 2
+        assert pulse_filter.rejected_interval == 0
+
+
+class TestS0EventDispatcher:
+
+    @pytest.mark.asyncio
+    async def test_dispatch(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        queue = asyncio.Queue()
+        dispatcher.register_queue(2, queue)
+        gpio.inject(2, 42)
+        gpio.inject(3, 43)
+        event = await asyncio.wait_for(queue.get(), 1)
+        assert event.event.timestamp_ns == 42
+        assert dispatcher.event_counts[2] == 1
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
+
+    @pytest.mark.asyncio
+    async def test_pulse_sink(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        received = []
+        sink = mock.Mock()
+        sink.pulses.side_effect = lambda timestamps: received.extend(timestamps)
+        dispatcher.register_pulse_sink(5, sink)
+        for timestamp in range(1000):
+            gpio.inject(5, timestamp)
+        while dispatcher.event_counts[5] < 1000:
+            await asyncio.sleep(0.01)
+        assert received == list(range(1000))
+        assert dispatcher.counts == [0] * 8
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
+
+    @pytest.mark.asyncio
+    async def test_pulse_filter(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        received = []
+        sink = mock.Mock()
+        sink.pulses.side_effect = lambda timestamps: received.extend(timestamps)
+        pulse_filter = PulseFilter(min_interval=1e-6, blanking=(0., 0.))
+        dispatcher.set_pulse_filter(5, pulse_filter)
+        dispatcher.register_pulse_sink(5, sink)
+        for timestamp in range(0, 10000, 500):
+            gpio.inject(5, timestamp)
+        while dispatcher.event_counts[5] < 20:
+            await asyncio.sleep(0.01)
+        assert received == list(range(0, 10000, 1000))
+        assert pulse_filter.rejected_interval == 10
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
+
+    @pytest.mark.asyncio
+    async def test_pulse_filter_without_sink(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        queue = asyncio.Queue()
+        dispatcher.set_pulse_filter(5, PulseFilter(min_interval=1e-6, blanking=(0., 0.)))
+        dispatcher.register_queue(5, queue)
+        for timestamp in range(0, 10000, 500):
+            gpio.inject(5, timestamp)
+        while dispatcher.event_counts[5] < 20:
+            await asyncio.sleep(0.01)
+        # Queued S0Events are not filtered
+        assert queue.qsize() == 20
+        assert not dispatcher.task.done()
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import mock
+import pytest
+from ipc import IpcServer, LightControlClient, _diff, _merge
+
+class FakeLightControl:
+    def __init__(self):
+        self.state = {
+            "lamps": {"garage": {"mode": 1, "state": "gray"}},
+            "detectors": {"yard": 1},
+            "meters": {"light": {"power": 0, "energy": 1.5}},
+            "dim": 100,
+        }
+        self.set_relais_mode = mock.Mock()
+        self.set_detector = mock.Mock()
+        self.set_duty = mock.Mock()
+        self.set_energy = mock.Mock()
+        self.send_sun_event = mock.Mock()
+
+    def snapshot(self):
+        return self.state
+
+    def get_metrics(self):
+        raise ValueError("metrics disabled")
+
+    def get_trace(self):
+        raise ValueError("tracing disabled")
+
+    def get_history(self, name, zoom, version=None):
+        if name != "light":
+            raise KeyError(name)
+        return {"version": 3, "data": None if version == 3 else [[1, 2.0]]}
+
+
+async def wait_for(predicate, timeout=2.0):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+class TestDiff:
+
+    def test_diff_merge(self):
+        old = {"a": {"b": 1, "c": 2}, "d": 3}
+        new = {"a": {"b": 1, "c": 4}, "d": 3, "e": 5}
+        changes = _diff(old, new)
+        assert changes == {"a": {"c": 4}, "e": 5}
+        _merge(old, changes)
+        assert old == new
+
+    def test_no_diff(self):
+        assert _diff({"a": {"b": 1}}, {"a": {"b": 1}}) == {}
+
+
+@contextlib.asynccontextmanager
+async def connect(tmp_path):
+    light_control = FakeLightControl()
+    path = str(tmp_path / "io.sock")
+    server = IpcServer(light_control, path, interval=0.01)
+    server_task = asyncio.create_task(server.serve())
+    client = LightControlClient(path, retry=0.01)
+    client_task = asyncio.create_task(client.run())
+    await wait_for(lambda: client.state)
+    yield light_control, server, client
+    client_task.cancel()
+    server_task.cancel()
+    await asyncio.gather(client_task, server_task, return_exceptions=True)
+
+
+class TestIpc:
+
+    @pytest.mark.asyncio
+    async def test_snapshot(self, tmp_path):
+        async with connect(tmp_path) as (_, _, client):
+            assert client.get_relais_mode("garage") == 1
+            assert client.get_relais_state("garage") == "gray"
+            assert client.get_detector("yard") == 1
+            assert client.get_energy("light") == 1.5
+            assert client.get_duty() == 100
+
+    @pytest.mark.asyncio
+    async def test_change_stream(self, tmp_path):
+        async with connect(tmp_path) as (light_control, _, client):
+            light_control.state = {**light_control.state, "dim": 42}
+            await wait_for(lambda: client.get_duty() == 42)
+
+    @pytest.mark.asyncio
+    async def test_commands(self, tmp_path):
+        async with connect(tmp_path) as (light_control, _, client):
+            client.set_relais_mode("garage", 2)
+            client.set_detector("yard", 2)
+            client.set_duty(50)
+            client.set_energy("light", 3.0)
+            client.send_sun_event(1)
+            await wait_for(lambda: light_control.send_sun_event.called)
+            light_control.set_relais_mode.assert_called_with("garage", 2)
+            light_control.set_detector.assert_called_with("yard", 2)
+            light_control.set_duty.assert_called_with(50)
+            light_control.set_energy.assert_called_with("light", 3.0)
+            light_control.send_sun_event.assert_called_with(1)
+
+    @pytest.mark.asyncio
+    async def test_history(self, tmp_path):
+        async with connect(tmp_path) as (_, _, client):
+            assert await client.get_history("light", "day") == {"version": 3, "data": [[1, 2.0]]}
+            assert await client.get_history("light", "day", 3) == {"version": 3, "data": None}
+            with pytest.raises(KeyError):
+                await client.get_history("missing", "day")
+
+    @pytest.mark.asyncio
+    async def test_error_reply(self, tmp_path):
+        async with connect(tmp_path) as (_, _, client):
+            with pytest.raises(KeyError, match="metrics disabled"):
+                await client.get_metrics()
+            with pytest.raises(KeyError, match="tracing disabled"):
+                await client.get_trace()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("line", [b"{not json\n", b"[" + b" " * 2**20 + b"]\n"],
+                             ids=["malformed", "overlong"])
+    async def test_reconnect_after_bad_line(self, tmp_path, line):
+        connections = []
+
+        async def serve(reader, writer):
+            connections.append(writer)
+            await reader.readline()
+            if len(connections) == 1:
+                writer.write(line)
+            writer.write(b'{"snapshot": {"dim": 42}}\n')
+            await writer.drain()
+            await reader.read()
+            writer.close()
+
+        path = str(tmp_path / "io.sock")
+        server = await asyncio.start_unix_server(serve, path)
+        client = LightControlClient(path, retry=0.01)
+        client_task = asyncio.create_task(client.run())
+        try:
+            await wait_for(lambda: client.get_duty() == 42)
+            assert len(connections) == 2
+            assert client.connected
+        finally:
+            client_task.cancel()
+            server.close()
+            await asyncio.gather(client_task, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_server_drops_overlong_line(self, tmp_path):
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context))
+        async with connect(tmp_path) as (_, server, client):
+            reader, writer = await asyncio.open_unix_connection(server.path)
+            writer.write(b"[" + b" " * 2**17 + b"]\n")
+            await writer.drain()
+            # Closed by the server
+            async with asyncio.timeout(2.0):
+                assert await reader.read() == b""
+            writer.close()
+            # Other clients are served
+            with pytest.raises(KeyError, match="metrics disabled"):
+                await client.get_metrics()
+        assert not errors
+
+    @pytest.mark.asyncio
+    async def test_reconnect_delay(self, tmp_path):
+        connections = []
+
+        async def serve(reader, writer):
+            connections.append(writer)
+            writer.close()
+
+        path = str(tmp_path / "io.sock")
+        server = await asyncio.start_unix_server(serve, path)
+        client = LightControlClient(path, retry=0.05)
+        client_task = asyncio.create_task(client.run())
+        try:
+            await asyncio.sleep(0.5)
+            # Not reconnecting in a tight loop
+            assert 2 <= len(connections) <= 11
+        finally:
+            client_task.cancel()
+            server.close()
+            await asyncio.gather(client_task, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_not_connected(self):
+        client = LightControlClient("/nonexistent/io.sock")
+        client.set_duty(10)  # Dropped silently
+        assert client.get_relais_state("garage") == "red"
+        with pytest.raises(ConnectionError):
+            await client.get_history("light", "day")
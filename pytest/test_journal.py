@@ -0,0 +1,70 @@
+import asyncio
+import json
+import pytest
+from gpio_sim import SimGpioMap
+from io_control import TimedRelais, S0Detector, RelaisMode
+from journal import Journal, query
+from sun import SunEvent, SunEventType
+
+
+class TestJournal:
+
+    def test_record_query(self, tmp_path):
+        times = iter([100, 200, 300])
+        journal = Journal(str(tmp_path), flush_interval=0.01, wall_func=lambda: next(times))
+        journal.record("Lamp", "relais", state="ON")
+        journal.record("Detector", "trigger", masked=False)
+        journal.record("Lamp", "relais", state="OFF")
+        journal.close()
+        assert journal.written == 3
+        assert [r["state"] for r in query(str(tmp_path), device="Lamp")] == ["ON", "OFF"]
+        assert [r["t"] for r in query(str(tmp_path), start=150, end=250)] == [200]
+        assert [r["dev"] for r in query(str(tmp_path), event="trigger")] == ["Detector"]
+
+    def test_rotation(self, tmp_path):
+        journal = Journal(str(tmp_path), max_bytes=200, backups=2, flush_interval=0)
+        for index in range(30):
+            journal.record("Lamp", "relais", index=index)
+        journal.close()
+        files = sorted(p.name for p in tmp_path.iterdir())
+        assert files == ["journal.jsonl", "journal.jsonl.1", "journal.jsonl.2"]
+        indexes = [r["index"] for r in query(str(tmp_path))]
+        # Oldest records were rotated out, the rest in order
+        assert indexes == list(range(30 - len(indexes), 30))
+
+    def test_partial_line(self, tmp_path):
+        with open(tmp_path / Journal.FILE, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"t": 1, "dev": "Lamp", "ev": "relais"}) + '\n{"t": 2, "de')
+        assert [r["t"] for r in query(str(tmp_path), start=0)] == [1]
+
+    def test_no_journal(self, tmp_path):
+        assert not list(query(str(tmp_path)))
+
+
+class TestJournalHooks:
+
+    @pytest.mark.asyncio
+    async def test_relais_detector(self, tmp_path):
+        gpio = SimGpioMap()
+        journal = Journal(str(tmp_path), flush_interval=0.01)
+        lamp = TimedRelais("Lamp", gpio, 0, journal=journal)
+        detector = S0Detector("Detector", ((lamp, 0, 0.02),), journal=journal)
+        gpio.inject(0, 42)
+        await detector.queue.put(gpio.read_input_events(0)[0])
+        await asyncio.sleep(0.05)
+        await detector.queue.put(SunEvent(SunEventType.SUN_RISE, None, None))
+        await asyncio.sleep(0.01)
+        lamp.mode = RelaisMode.ON
+        detector.task.cancel()
+        journal.close()
+        records = [(r["dev"], r["ev"], r.get("state", r.get("mask")))
+                   for r in query(str(tmp_path))]
+        assert records == [
+            ("Detector", "trigger", None),
+            ("Lamp", "relais", "ON"),
+            ("Lamp", "relais", "OFF"),
+            ("Detector", "sun", None),
+            ("Detector", "mask", True),
+            ("Lamp", "mode", None),
+            ("Lamp", "relais", "ON"),
+        ]
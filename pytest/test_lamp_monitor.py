@@ -0,0 +1,136 @@
+import asyncio
+import mock
+import pytest
+from app_state import AppState
+from gpio_map import RelaisState
+from gpio_sim import SimGpioMap
+from lamp_monitor import LampMonitor, PULSE_ENERGY
+from light_control_new import LightControl
+
+
+class Installation:
+    """Lamps of known power on a meter, pulses evenly spaced in virtual time"""
+    def __init__(self, power, base=0.):
+        self.power = power
+        self.base = base
+        self.now = 0
+        self.energy = 0.
+        self.on = set()
+        self.monitor = LampMonitor("lamps", power, now_func=lambda: self.now)
+        self.queue = asyncio.Queue()
+        self.monitor.register_queue(self.queue)
+
+    def run(self, seconds):
+        """Advance time, passing the pulses of the lamps ON"""
+        power = self.base + sum(self.power[lamp] for lamp in self.on)
+        end = self.now + int(seconds * 1e9)
+        timestamps = []
+        while self.now < end:
+            self.now += int(1e8)
+            self.energy += power * 0.1
+            if self.energy >= PULSE_ENERGY:
+                self.energy -= PULSE_ENERGY
+                timestamps.append(self.now)
+        self.monitor.pulses(timestamps)
+
+    def switch(self, lamp, on):
+        if on:
+            self.on.add(lamp)
+        else:
+            self.on.discard(lamp)
+        self.monitor.switched(lamp, on)
+
+    def cycle(self, lamp, seconds=600):
+        self.switch(lamp, True)
+        self.run(seconds)
+        self.switch(lamp, False)
+        self.run(seconds)
+
+
+class TestLampMonitor:
+
+    def test_learn_step(self):
+        installation = Installation({"yard": 100, "garage": 60}, base=5)
+        installation.run(600)
+        for _ in range(6):
+            installation.cycle("yard")
+        assert installation.monitor.step("yard") == pytest.approx(100, abs=10)
+        assert installation.monitor.step("garage") is None
+        assert installation.queue.empty()
+
+    def test_missing_lamp(self):
+        installation = Installation({"yard": 100, "garage": 60})
+        installation.run(600)
+        for _ in range(6):
+            installation.cycle("yard")
+        installation.power["yard"] = 0
+        installation.cycle("yard")
+        alert = installation.queue.get_nowait()
+        assert alert.rule == "lamp missing"
+        assert alert.meter == "lamps"
+        assert alert.power < 30
+        assert installation.monitor.flagged["yard"] == 1
+        # Flagged steps are not learned
+        assert installation.monitor.step("yard") == pytest.approx(100, abs=3)
+
+    def test_abnormal_lamp(self):
+        installation = Installation({"yard": 100})
+        installation.run(600)
+        for _ in range(6):
+            installation.cycle("yard")
+        installation.power["yard"] = 250
+        installation.cycle("yard")
+        assert installation.queue.get_nowait().rule == "lamp abnormal"
+
+    def test_ignore_simultaneous_switches(self):
+        installation = Installation({"yard": 100, "garage": 60})
+        installation.run(600)
+        for _ in range(6):
+            # A detector switches both within the settle time
+            installation.switch("yard", True)
+            installation.run(3)
+            installation.switch("garage", True)
+            installation.run(600)
+            installation.switch("garage", False)
+            installation.switch("yard", False)
+            installation.run(600)
+        assert installation.monitor.steps["yard"].count == 0
+        assert installation.monitor.steps["garage"].count == 0
+
+    def test_short_and_sparse_segments(self):
+        installation = Installation({"yard": 100, "garage": 2})
+        installation.run(600)
+        for _ in range(6):
+            installation.cycle("yard", 60)
+            installation.cycle("garage")
+        assert installation.monitor.steps["yard"].count == 0
+        # 2 W give less than 10 pulses in 10 minutes
+        assert installation.monitor.steps["garage"].count == 0
+
+    @pytest.mark.asyncio
+    async def test_state(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        installation = Installation({"yard": 100})
+        installation.monitor = LampMonitor("lamps", ["yard"], AppState(state_file),
+                                           lambda: installation.now)
+        installation.run(600)
+        for _ in range(6):
+            installation.cycle("yard")
+        installation.monitor.app_state.store_state()
+        monitor = LampMonitor("lamps", ["yard"], AppState(state_file))
+        assert monitor.step("yard") == installation.monitor.step("yard")
+
+    @pytest.mark.asyncio
+    async def test_light_control(self, tmp_path):
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, str(tmp_path / "state.json"))
+        task = asyncio.create_task(light_control.io_main())
+        while light_control.lamp_monitor is None:
+            await asyncio.sleep(0.01)
+        monitor = light_control.lamp_monitor
+        with mock.patch.object(monitor, "switched") as switched:
+            light_control.lamps["garage"].set_state(RelaisState.ON, urgent=True)
+            switched.assert_called_once_with("Lampe Garage", True)
+        assert monitor in light_control.dispatcher.sinks[light_control.meter_inputs["light"]]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from latency_trace import LatencyTrace
+from gpio_sim import SimGpioMap
+from gpio_map import RelaisState
+from io_control import S0EventDispatcher, S0Detector, TimedRelais
+
+class TestLatencyTrace:
+
+    def test_stages(self):
+        trace = LatencyTrace(4)
+        slot = trace.begin(1000)
+        dispatch = trace.stage_time(slot, LatencyTrace.DISPATCH)
+        trace.mark(slot, LatencyTrace.DETECTOR, dispatch + 10)
+        trace.mark(slot, LatencyTrace.UPDATE, dispatch + 30)
+        trace.mark(slot, LatencyTrace.RELAIS, dispatch + 60)
+        stats = trace.stats()
+        assert stats["dispatch"]["count"] == 1
+        assert stats["detector"]["max"] == pytest.approx(10e-9)
+        assert stats["update"]["p50"] == pytest.approx(20e-9)
+        assert stats["relais"]["p99"] == pytest.approx(30e-9)
+        assert stats["total"]["max"] == pytest.approx((dispatch + 60 - 1000) * 1e-9)
+
+    def test_incomplete_skipped(self):
+        trace = LatencyTrace(4)
+        trace.begin(1000)
+        stats = trace.stats()
+        assert stats["dispatch"]["count"] == 1
+        assert stats["detector"]["count"] == 0
+        assert stats["total"] == {"count": 0, "sum": 0., "p50": 0., "p99": 0., "max": 0.}
+
+    def test_ring(self):
+        trace = LatencyTrace(2)
+        assert [trace.begin(1) for _ in range(3)] == [0, 1, 0]
+
+    def test_retired(self):
+        trace = LatencyTrace(2)
+        for edge_ns in range(3):
+            slot = trace.begin(edge_ns)
+            dispatch = trace.stage_time(slot, LatencyTrace.DISPATCH)
+            trace.mark(slot, LatencyTrace.DETECTOR, dispatch + 10 * (edge_ns + 1))
+        stats = trace.stats()
+        assert stats["detector"]["count"] == 3
+        assert stats["detector"]["sum"] == pytest.approx(60e-9)
+        # Percentiles of the records kept
+        assert stats["detector"]["max"] == pytest.approx(30e-9)
+        assert stats["detector"]["p50"] == pytest.approx(20e-9)
+
+
+class TestTracedPath:
+
+    @pytest.mark.asyncio
+    async def test_edge_to_relais(self):
+        tracer = LatencyTrace(16)
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, 0.01, tracer)
+        lamp = TimedRelais("Lamp", gpio, 0, tracer)
+        detector = S0Detector("Detector", ((lamp, 0, 0.05),), tracer)
+        dispatcher.register_queue(1, detector.queue)
+        gpio.inject(1)
+        async with asyncio.timeout(1):
+            while lamp.state != RelaisState.ON:
+                await asyncio.sleep(0.001)
+        stats = tracer.stats()
+        for stage in ("dispatch", "detector", "update", "relais", "total"):
+            assert stats[stage]["count"] == 1
+        assert stats["total"]["max"] < 0.5
+        dispatcher.cancel = True
+        await asyncio.wait_for(lamp.wait(), 1)
+
+    @pytest.mark.asyncio
+    async def test_untraced_update(self):
+        tracer = LatencyTrace(16)
+        lamp = TimedRelais("Lamp", SimGpioMap(), 0, tracer)
+        slot = tracer.begin(0)
+        tracer.mark(slot, LatencyTrace.DETECTOR)
+        lamp.update(0.5, 0.1, slot)
+        # Rescheduled by an untraced source before switching on
+        lamp.update(0, 0.01)
+        await asyncio.wait_for(lamp.wait(), 1)
+        assert tracer.stats()["update"]["count"] == 1
+        assert tracer.stats()["relais"]["count"] == 0
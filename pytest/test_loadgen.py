@@ -0,0 +1,51 @@
+import asyncio
+import random
+import time
+import pytest
+from gpio_sim import SimGpioMap
+from io_control import S0EventDispatcher
+from loadgen import LoadGenerator, ConstantProfile, PoissonProfile, BurstyProfile
+
+class TestProfiles:
+
+    def test_constant(self):
+        assert ConstantProfile(4).next_interval(random.Random(0)) == 0.25
+
+    @pytest.mark.parametrize("profile", [
+        PoissonProfile(10),
+        BurstyProfile(5, 50, burst=1, period=4),
+    ])
+    def test_mean_rate(self, profile):
+        rng = random.Random(1)
+        intervals = [profile.next_interval(rng) for _ in range(20000)]
+        rate = len(intervals) / sum(intervals)
+        assert 5 <= rate <= 25
+
+
+class TestLoadGenerator:
+
+    def test_inject(self):
+        gpio = SimGpioMap()
+        generator = LoadGenerator(gpio, {1: ConstantProfile(200), 3: PoissonProfile(200)})
+        generator.start()
+        time.sleep(0.2)
+        generator.stop()
+        events = gpio.read_input_events(0)
+        assert len(events) == sum(generator.injected)
+        assert generator.injected[1] > 0 and generator.injected[3] > 0
+        stamps = [e.event.timestamp_ns for e in events if e.s0_index == 1]
+        assert stamps == sorted(stamps)
+
+    @pytest.mark.asyncio
+    async def test_no_pulse_missed(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, 0.01)
+        generator = LoadGenerator(gpio, {s0: PoissonProfile(500) for s0 in range(8)})
+        generator.start()
+        await asyncio.sleep(0.3)
+        generator.stop()
+        async with asyncio.timeout(2):
+            while dispatcher.event_counts != generator.injected:
+                await asyncio.sleep(0.01)
+        dispatcher.cancel = True
+        await dispatcher.task
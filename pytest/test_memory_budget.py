@@ -0,0 +1,138 @@
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime
+import pytest
+from gpio_map import S0Event
+from gpio_sim import SimGpioMap
+from io_control import S0EventDispatcher
+from memory_budget import MemoryBudget, LatestQueue, put_latest
+from power_history import PowerHistory
+from profiling import ProfileCapture
+from simulation import Simulation
+from sun import SunEvent, SunEventType
+
+
+class TestMemoryBudget:
+
+    def test_slots(self):
+        budget = MemoryBudget(10 << 20)
+        assert budget.slots("queues") == int((10 << 20) * 0.02) // 256
+        assert budget.slots("queues", 4) == budget.slots("queues") // 4
+        assert MemoryBudget(1 << 10).slots("history") == 16
+
+    def test_put_latest(self):
+        queue = asyncio.Queue(2)
+        assert not put_latest(queue, 1)
+        assert not put_latest(queue, 2)
+        assert put_latest(queue, 3)
+        assert [queue.get_nowait(), queue.get_nowait()] == [2, 3]
+
+    def test_evict_under_pressure(self):
+        budget = MemoryBudget(1 << 20)
+        history = PowerHistory(100)
+        for second in range(100):
+            history.add(second * 36 * 10**9, 100.)
+        budget.register_eviction(history.evict)
+        assert not budget.check(rss=1 << 20)
+        assert len(history.series["hour"].buckets) == 100
+        assert budget.check(rss=2 << 20)
+        assert len(history.series["hour"].buckets) == 50
+        assert budget.eviction_count == 1
+
+    def test_evict_once_per_pressure(self):
+        budget = MemoryBudget(10 << 20)
+        evictions = []
+        budget.register_eviction(lambda: evictions.append(1))
+        # The freed memory is not returned, the resident set size stays
+        for _ in range(10):
+            budget.check(rss=11 << 20)
+        assert len(evictions) == 1
+        # Grown by the margin since the eviction
+        assert budget.check(rss=12 << 20)
+        assert not budget.check(rss=12 << 20)
+        # Re-armed below the total
+        assert not budget.check(rss=9 << 20)
+        assert budget.check(rss=11 << 20)
+        assert budget.eviction_count == 3
+
+    def test_report(self):
+        budget = MemoryBudget(1 << 20)
+        assert budget.report()["history"] == {"budget": int((1 << 20) * 0.04), "used": None}
+        budget.start_tracing()
+        try:
+            history = PowerHistory(1000)
+            for second in range(1000):
+                history.add(second * 10**9, float(second))
+            # Attributed on demand, report() does not take a snapshot
+            assert budget.report()["history"]["used"] is None
+            budget.sample()
+            report = budget.report()
+        finally:
+            budget.stop_tracing()
+        assert not tracemalloc.is_tracing()
+        assert report["history"]["used"] > 290 * 50
+        assert report["other"]["budget"] is None
+        assert budget.report() == report
+
+    def test_profile_keeps_tracing(self, tmp_path):
+        budget = MemoryBudget(1 << 20)
+        budget.start_tracing()
+        try:
+            capture = ProfileCapture(str(tmp_path))
+            capture.register_snapshot_sink(budget.attribute)
+            capture.start(0.01, memory=True)
+            stop = time.monotonic() + 5
+            while capture.running and time.monotonic() < stop:
+                time.sleep(0.01)
+            # The capture did not start tracing, it must not stop it
+            assert tracemalloc.is_tracing()
+            assert budget.report()["other"]["used"] > 0
+        finally:
+            budget.stop_tracing()
+
+    @pytest.mark.asyncio
+    async def test_dispatcher_keeps_latest(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        queue = asyncio.Queue(10)
+        dispatcher.register_queue(2, queue)
+        for timestamp in range(100):
+            gpio.inject(2, timestamp)
+        while dispatcher.event_counts[2] < 100:
+            await asyncio.sleep(0.01)
+        assert dispatcher.dropped == 90
+        assert queue.get_nowait().event.timestamp_ns == 90
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
+
+    @pytest.mark.asyncio
+    async def test_sun_event_never_dropped(self):
+        gpio = SimGpioMap()
+        dispatcher = S0EventDispatcher(gpio, wait_timeout=0.01)
+        queue = LatestQueue(10, S0Event)
+        dispatcher.register_queue(2, queue)
+        # Queued first, the oldest item of the queue when it overflows
+        queue.put_nowait(SunEvent(SunEventType.SUN_SET, None, None))
+        for timestamp in range(100):
+            gpio.inject(2, timestamp)
+        while dispatcher.event_counts[2] < 100:
+            await asyncio.sleep(0.01)
+        # Put by the SunSensor into the queue full of S0Events
+        queue.put_nowait(SunEvent(SunEventType.SUN_RISE, None, None))
+        dispatcher.cancel = True
+        await asyncio.wait_for(dispatcher.task, 1)
+        assert dispatcher.dropped == 90
+        events = [queue.get_nowait() for _ in range(queue.qsize())]
+        assert events[0].type == SunEventType.SUN_SET
+        assert [event.event.timestamp_ns for event in events[1:-1]] == list(range(90, 100))
+        assert events[-1].type == SunEventType.SUN_RISE
+
+    def test_soak_rss_flat(self):
+        # The week zoom level of the histories is full after 7 days
+        simulation = Simulation(datetime.fromisoformat("2026-01-01T00:00:00+01:00"), 12,
+                                memory_budget=MemoryBudget(64 << 20, interval=3600))
+        report = simulation.run()
+        # The sample at the end of the last day races the end of the run
+        assert len(report["rss_mb"]) >= 11
+        assert report["rss_mb"][-1] - report["rss_mb"][8] < 1.
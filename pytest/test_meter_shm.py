@@ -0,0 +1,122 @@
+import os
+import subprocess
+import sys
+import struct
+import threading
+import mock
+import pytest
+import meter_shm
+from meter_shm import MeterShmWriter, MeterShmReader
+
+
+class Meter:
+    """Minimal stand-in of S0Meter"""
+    def __init__(self, name):
+        self.name = name
+        self.total = 0
+        self.last_event = 0
+        self.last_delta = 1
+
+    def pulses(self, timestamps):
+        for timestamp in timestamps:
+            self.last_delta = timestamp - self.last_event
+            self.last_event = timestamp
+        self.total += len(timestamps)
+
+
+def shm_name():
+    return f"light-control-test-{os.getpid()}"
+
+
+class TestMeterShm:
+
+    def test_read(self):
+        meters = {"hvac-a": Meter("A"), "light": Meter("L")}
+        writer = MeterShmWriter(meters, shm_name(), ring=4)
+        try:
+            with MeterShmReader(shm_name()) as reader:
+                assert reader.names == ["hvac-a", "light"]
+                stamps = [10**9, 2 * 10**9, 3 * 10**9, 4 * 10**9, 5 * 10**9]
+                meters["light"].pulses(stamps)
+                writer.slots["light"].pulses(stamps)
+                sample = reader.read(reader.index("light"))
+                assert sample.total == 5
+                assert sample.last_event == 5 * 10**9
+                assert sample.recent == tuple(stamps[1:])
+                assert sample.power(6 * 10**9) == 1800
+                assert sample.power(7 * 10**9) == 900
+                assert reader.read(0).total == 0
+                meters["hvac-a"].total = 4000
+                writer.slots["hvac-a"].publish()
+                assert reader.read(0).energy == 2
+        finally:
+            writer.close()
+
+    def test_fields_written_while_seq_odd(self):
+        class Record(struct.Struct):
+            """RECORD checking the writer holds the sequence lock"""
+            def pack_into(self, buf, offset, seq, *fields):
+                # pylint: disable=arguments-differ
+                assert seq & 1
+                assert struct.unpack_from("<Q", buf, offset)[0] == seq
+                super().pack_into(buf, offset, seq, *fields)
+
+        meter = Meter("A")
+        with mock.patch.object(meter_shm, "RECORD", Record(meter_shm.RECORD.format)):
+            writer = MeterShmWriter({"a": meter}, shm_name(), ring=4)
+            try:
+                meter.pulses([10**9])
+                writer.slots["a"].pulses([10**9])
+                assert writer.slots["a"].seq % 2 == 0
+                with MeterShmReader(shm_name()) as reader:
+                    assert reader.read(0).total == 1
+            finally:
+                writer.close()
+
+    def test_consistent_under_writes(self):
+        meter = Meter("A")
+        writer = MeterShmWriter({"a": meter}, shm_name(), ring=8)
+        stop = threading.Event()
+
+        def write():
+            timestamp = 0
+            while not stop.is_set():
+                timestamp += 1
+                meter.pulses([timestamp])
+                writer.slots["a"].pulses([timestamp])
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            with MeterShmReader(shm_name()) as reader:
+                for _ in range(2000):
+                    sample = reader.read(0)
+                    assert sample.last_event == sample.total
+                    if sample.recent:
+                        assert sample.recent[-1] == sample.last_event
+        finally:
+            stop.set()
+            thread.join()
+            writer.close()
+
+    def test_other_process(self):
+        meter = Meter("A")
+        meter.pulses([42])
+        writer = MeterShmWriter({"a": meter}, shm_name())
+        writer.slots["a"].pulses([42])
+        try:
+            code = "from meter_shm import MeterShmReader; "\
+                   f"print(MeterShmReader('{shm_name()}').read(0).last_event)"
+            result = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                                    text=True, check=True, cwd=os.getcwd(),
+                                    env={**os.environ, "PYTHONPATH": os.getcwd()})
+            assert result.stdout.strip() == "42"
+            # Reader exit must not remove the segment
+            with MeterShmReader(shm_name()) as reader:
+                assert reader.read(0).total == 1
+        finally:
+            writer.close()
+
+    def test_no_segment(self):
+        with pytest.raises(FileNotFoundError):
+            MeterShmReader(shm_name())
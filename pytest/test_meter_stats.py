@@ -0,0 +1,107 @@
+import asyncio
+import statistics
+import time
+import mock
+import pytest
+from meter_stats import RunningStats, MeterStats, PowerAbove, PowerWhile, Deviation
+
+HOUR = 3600 * 10**9
+
+
+def stats_at(hour, name="Meter", rules=()):
+    """MeterStats whose timestamp 0 is the full hour given"""
+    local = mock.Mock(tm_hour=hour, tm_min=0, tm_sec=0)
+    with mock.patch("meter_stats.time.localtime", return_value=local):
+        stats = MeterStats(name, rules, now_func=lambda: 0, wall_func=lambda: 0.)
+        stats.add(0, 0.)
+    return stats
+
+
+class TestRunningStats:
+
+    def test_welford(self):
+        values = [3., 7., 7., 19., 24., 1.5]
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+        assert stats.count == 6
+        assert stats.mean == pytest.approx(statistics.mean(values))
+        assert stats.variance == pytest.approx(statistics.variance(values))
+        assert stats.min == 1.5
+        assert stats.max == 24.
+
+
+class TestMeterStats:
+
+    def test_hour_buckets(self):
+        stats = stats_at(23)
+        stats.add(HOUR // 2, 100.)
+        assert stats.hour == 23
+        with mock.patch("meter_stats.time.localtime",
+                        return_value=mock.Mock(tm_hour=0, tm_min=0, tm_sec=0)):
+            stats.add(HOUR, 300.)
+        assert stats.hour == 0
+        assert stats.hours[23].count == 2
+        assert stats.hours[0].mean == 300.
+        assert stats.total.count == 3
+        assert stats.baseload is None
+        stats.BASELOAD_SAMPLES = 1
+        assert stats.baseload == 50.
+
+    def test_wall_clock(self):
+        # 2026-01-01 00:00 UTC, one and a half hours ahead of the monotonic clock
+        wall = 1767225600.
+        stats = MeterStats("Meter", now_func=lambda: 0, wall_func=lambda: wall)
+        stats.add(HOUR * 3 // 2, 100.)
+        assert stats.hour == time.localtime(wall + 5400).tm_hour
+        assert stats.hours[stats.hour].count == 1
+        later = MeterStats("Meter", now_func=lambda: 0, wall_func=lambda: wall + 6 * 3600)
+        later.add(HOUR * 3 // 2, 100.)
+        assert later.hour == (stats.hour + 6) % 24
+
+    def test_power_above_at_night(self):
+        stats = stats_at(2, "HVAC-C", (PowerAbove("night", 500, 3600, (22, 5)),))
+        queue = asyncio.Queue()
+        stats.register_queue(queue)
+        night = mock.Mock(tm_hour=3, tm_min=0, tm_sec=0)
+        with mock.patch("meter_stats.time.localtime", return_value=night):
+            for minute in range(1, 120):
+                stats.add(minute * 60 * 10**9, 900.)
+            assert stats.hour == 3
+            assert queue.qsize() == 1
+            alert = queue.get_nowait()
+            assert alert.meter == "HVAC-C"
+            assert alert.rule == "night"
+            assert alert.timestamp == 61 * 60 * 10**9
+            assert alert.message == "HVAC-C has been drawing 900 W for 60 min (limit 500 W)"
+            # Raised again in a new episode only
+            stats.rules[0].duration = 0
+            stats.add(121 * 60 * 10**9, 900.)
+            assert queue.qsize() == 0
+            stats.add(122 * 60 * 10**9, 100.)
+            stats.add(123 * 60 * 10**9, 900.)
+            assert queue.qsize() == 1
+
+    def test_power_above_by_day(self):
+        stats = stats_at(12, rules=(PowerAbove("night", 500, 0, (22, 5)),))
+        stats.add(10**9, 900.)
+        assert stats.alert_count == 0
+
+    def test_power_while(self):
+        lamps_off = mock.Mock(return_value=False)
+        stats = stats_at(12, "Light", (PowerWhile("off", 10, lamps_off, "all relais are OFF"),))
+        stats.add(10**9, 40.)
+        assert stats.alert_count == 0
+        lamps_off.return_value = True
+        queue = asyncio.Queue()
+        stats.register_queue(queue)
+        stats.add(2 * 10**9, 40.)
+        assert queue.get_nowait().message == "Light shows 40 W while all relais are OFF"
+
+    def test_deviation(self):
+        stats = stats_at(12, "HVAC-A", (Deviation("deviation", 4, 50),))
+        for index in range(1, 100):
+            stats.add(index * 10**9, 100. + index % 5)
+        assert stats.alert_count == 0
+        stats.add(100 * 10**9, 900.)
+        assert stats.alert_count == 1
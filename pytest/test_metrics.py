@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from gpio_sim import SimGpioMap
+from light_control_new import LightControl
+from metrics import MetricsText, process_rss
+
+class TestMetricsText:
+
+    def test_format(self):
+        text = MetricsText("test_")
+        text.add("pulses_total", "counter", "Pulses", [({"channel": 1}, 42), ({}, 1)])
+        assert str(text) == (
+            "# HELP test_pulses_total Pulses\n"
+            "# TYPE test_pulses_total counter\n"
+            'test_pulses_total{channel="1"} 42\n'
+            "test_pulses_total 1\n")
+
+    def test_summary(self):
+        text = MetricsText("test_")
+        text.add_summary("latency_seconds", "Latency",
+                         [({"stage": "relais"}, {"0.5": 0.1, "0.99": 0.3}, 1.5, 10)])
+        assert str(text) == (
+            "# HELP test_latency_seconds Latency\n"
+            "# TYPE test_latency_seconds summary\n"
+            'test_latency_seconds{stage="relais",quantile="0.5"} 0.1\n'
+            'test_latency_seconds{stage="relais",quantile="0.99"} 0.3\n'
+            'test_latency_seconds_sum{stage="relais"} 1.5\n'
+            'test_latency_seconds_count{stage="relais"} 10\n')
+
+    def test_label_escape(self):
+        text = MetricsText("test_")
+        text.add("up", "gauge", "Up", [({"name": 'a\\b "c"\nd'}, 1)])
+        assert str(text).endswith('test_up{name="a\\\\b \\"c\\"\\nd"} 1\n')
+
+    def test_rss(self):
+        assert process_rss() > 0
+
+
+class TestRender:
+
+    @pytest.mark.asyncio
+    async def test_light_control(self, tmp_path):
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, str(tmp_path / "state.json"))
+        task = asyncio.create_task(light_control.io_main())
+        await asyncio.sleep(0.01)
+        gpio.inject(4)
+        gpio.inject(4)
+        gpio.inject(0)
+        async with asyncio.timeout(2):
+            while light_control.dispatcher.event_counts[0] == 0:
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        text = light_control.get_metrics()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert 'light_control_s0_pulses_total{channel="4"} 2\n' in text
+        assert 'light_control_s0_pulses_total{channel="0"} 1\n' in text
+        assert 'light_control_queue_depth{kind="detector",name="yard"} 0\n' in text
+        assert 'light_control_queue_depth{kind="meter"' not in text
+        assert 'light_control_relais_reschedules_total{lamp="garage"} 0\n' in text
+        assert "light_control_executor_reads_total" in text
+        assert "light_control_executor_wait_seconds_total" in text
+        assert "light_control_loop_lag_seconds_total" in text
+        assert "_seconds_sum" not in text
+        assert "light_control_loop_lag_seconds" in text
+        assert "light_control_process_resident_memory_bytes" in text
@@ -0,0 +1,273 @@
+import asyncio
+import struct
+import time
+import mock
+import pytest
+from gpio_map import S0Event
+from gpio_sim import SimGpioMap, SimEdgeEvent
+from light_control_new import LightControl
+from mqtt_bridge import MqttBridge, packet, read_packet, parse_publish, publish_packet
+from mqtt_bridge import CONNECT, CONNACK, PUBLISH, SUBSCRIBE, SUBACK, PINGREQ, PINGRESP
+from sun import SunEvent, SunEventType
+
+
+class Broker:
+    """Stand-in MQTT broker: records publishes, keeps retained messages and
+    forwards to subscribers of exact topics and single level wildcards"""
+    def __init__(self):
+        self.server = None
+        self.port = None
+        self.clients = {}
+        self.messages = []
+        self.retained = {}
+        self.connects = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def __handle(self, reader, writer):
+        will = None
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                match header & 0xF0:
+                    case 0x10 if header == CONNECT:
+                        self.connects += 1
+                        offset = 10
+                        offset += 2 + struct.unpack_from("!H", body, offset)[0]
+                        length = struct.unpack_from("!H", body, offset)[0]
+                        topic = body[offset + 2:offset + 2 + length].decode()
+                        offset += 2 + length
+                        length = struct.unpack_from("!H", body, offset)[0]
+                        will = (topic, body[offset + 2:offset + 2 + length].decode())
+                        self.clients[writer] = []
+                        writer.write(packet(CONNACK, b"\x00\x00"))
+                    case 0x80 if header == SUBSCRIBE:
+                        length = struct.unpack_from("!H", body, 2)[0]
+                        self.clients[writer].append(body[4:4 + length].decode())
+                        writer.write(packet(SUBACK, body[:2] + b"\x00"))
+                    case 0x30:
+                        topic, payload = parse_publish(header, body)
+                        self.messages.append((topic, payload, bool(header & 1)))
+                        if header & 1:
+                            self.retained[topic] = payload
+                    case 0xC0 if header == PINGREQ:
+                        writer.write(packet(PINGRESP))
+                    case 0xE0:
+                        will = None
+                        break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if will is not None:
+                self.retained[will[0]] = will[1]
+            self.clients.pop(writer, None)
+            writer.close()
+
+    def send(self, topic, payload):
+        """Publish to the matching subscribers"""
+        for writer, filters in self.clients.items():
+            for topic_filter in filters:
+                parts, others = topic.split("/"), topic_filter.split("/")
+                if len(parts) == len(others) and \
+                        all(o in ("+", p) for p, o in zip(parts, others)):
+                    writer.write(publish_packet(topic, payload))
+
+    def drop(self):
+        """Abort all client connections"""
+        for writer in list(self.clients):
+            writer.transport.abort()
+
+    def topics(self):
+        return [topic for topic, _, _ in self.messages]
+
+    async def close(self):
+        self.drop()
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class FakeLightControl:
+    def __init__(self):
+        self.state = {
+            "lamps": {"garage": {"mode": 1, "state": "gray"}},
+            "detectors": {"yard": 1},
+            "meters": {"light": {"power": 0., "energy": 1.5}},
+            "dim": 100,
+        }
+        self.detector_inputs = {"yard": 0}
+        self.event_queues = []
+        self.set_relais_mode = mock.Mock()
+
+    def snapshot(self):
+        return self.state
+
+    def register_event_queue(self, queue):
+        self.event_queues.append(queue)
+
+
+async def wait_for(predicate, timeout=2.0):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+async def start(broker, **kwargs):
+    light_control = FakeLightControl()
+    bridge = MqttBridge(light_control, "127.0.0.1", broker.port, "lc",
+                        **{"interval": 0.01, "retry": (0.01, 0.05), **kwargs})
+    task = asyncio.create_task(bridge.run())
+    await wait_for(lambda: bridge.connected)
+    return light_control, bridge, task
+
+
+async def stop(task, broker):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await broker.close()
+
+
+class TestMqttBridge:
+
+    @pytest.mark.asyncio
+    async def test_publish_state(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker)
+        await wait_for(lambda: "lc/dim" in broker.retained)
+        assert broker.retained == {
+            "lc/status": "online",
+            "lc/lamp/garage/state": "OFF",
+            "lc/lamp/garage/mode": "AUTO",
+            "lc/detector/yard/mode": "ACTIVE",
+            "lc/meter/light/power": "0.0",
+            "lc/meter/light/energy": "1.500",
+            "lc/dim": "100",
+        }
+        light_control.state["lamps"]["garage"]["state"] = "yellow"
+        await wait_for(lambda: broker.retained["lc/lamp/garage/state"] == "ON")
+        assert broker.topics().count("lc/dim") == 1
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_events(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker)
+        queue = light_control.event_queues[0]
+        queue.put_nowait(S0Event(0, SimEdgeEvent(17, 0, 0, 0)))
+        queue.put_nowait(SunEvent(SunEventType.SUN_SET, None, None))
+        await wait_for(lambda: "lc/sun" in broker.retained)
+        assert broker.retained["lc/sun"] == "SUN_SET"
+        assert ("lc/detector/yard/trigger", False) in \
+            [(topic, retain) for topic, _, retain in broker.messages]
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_coalesce_and_rate(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker, rate=20., burst=1)
+        await wait_for(lambda: not bridge.pending)
+        sent = len(broker.messages)
+        start_time = time.monotonic()
+        for power in range(100):
+            bridge.publish("meter/light/power", str(power))
+            bridge.publish("dim", str(power))
+            await asyncio.sleep(0.001)
+        # Each topic ends with its latest value, most values were replaced
+        expected = {"lc/meter/light/power": "99", "lc/dim": "99"}
+        await wait_for(lambda: expected == {topic: payload for topic, payload, _
+                                            in broker.messages[sent:]})
+        count = len(broker.messages) - sent
+        assert count <= 20 * (time.monotonic() - start_time) + 1
+        assert bridge.coalesced >= 200 - count
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_command(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker)
+        await wait_for(lambda: broker.clients and all(broker.clients.values()))
+        broker.send("lc/lamp/garage/mode/set", "on")
+        await wait_for(lambda: light_control.set_relais_mode.called)
+        light_control.set_relais_mode.assert_called_once_with("garage", 2)
+        with mock.patch("builtins.print") as print_mock:
+            broker.send("lc/lamp/garage/mode/set", "dark")
+            await wait_for(lambda: print_mock.called)
+        assert bridge.commands == 1
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_reconnect(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker)
+        await wait_for(lambda: "lc/dim" in broker.retained)
+        with mock.patch("builtins.print"):
+            broker.drop()
+            await wait_for(lambda: not bridge.connected)
+            assert broker.retained["lc/status"] == "offline"
+            # Changes while disconnected are kept pending
+            light_control.state["dim"] = 50
+            broker.retained.clear()
+            await wait_for(lambda: bridge.connected)
+        await wait_for(lambda: broker.retained.get("lc/dim") == "50")
+        assert broker.retained["lc/status"] == "online"
+        assert "lc/lamp/garage/mode" in broker.retained
+        assert bridge.connects == 2
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_malformed_packet(self):
+        broker = Broker()
+        await broker.start()
+        light_control, bridge, task = await start(broker)
+        await wait_for(lambda: broker.clients and all(broker.clients.values()))
+        with mock.patch("builtins.print") as print_mock:
+            # PUBLISH too short for its topic length
+            for writer in broker.clients:
+                writer.write(packet(PUBLISH, b"\xff"))
+            await wait_for(lambda: print_mock.called)
+            await wait_for(lambda: bridge.connects == 2)
+        assert not task.done()
+        await stop(task, broker)
+
+    @pytest.mark.asyncio
+    async def test_broker_down_does_not_block(self):
+        broker = Broker()
+        await broker.start()
+        port = broker.port
+        await broker.close()
+        bridge = MqttBridge(FakeLightControl(), "127.0.0.1", port, "lc",
+                            interval=0.01, retry=(0.01, 0.05))
+        with mock.patch("builtins.print"):
+            task = asyncio.create_task(bridge.run())
+            start_time = time.perf_counter()
+            for power in range(1000):
+                bridge.publish("meter/heat/power", str(power))
+            await asyncio.sleep(0.1)
+            assert not bridge.connected
+        assert time.perf_counter() - start_time < 0.5
+        assert bridge.pending["meter/heat/power"] == ("999", False)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_light_control(self, tmp_path):
+        broker = Broker()
+        await broker.start()
+        gpio = SimGpioMap()
+        light_control = LightControl(lambda consumer: gpio, str(tmp_path / "state.json"))
+        bridge = MqttBridge(light_control, "127.0.0.1", broker.port, "lc", interval=0.01)
+        tasks = [asyncio.create_task(light_control.io_main()),
+                 asyncio.create_task(bridge.run())]
+        await wait_for(lambda: "lc/lamp/garage/mode" in broker.retained)
+        gpio.inject(0)
+        await wait_for(lambda: "lc/detector/yard/trigger" in broker.topics())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await broker.close()
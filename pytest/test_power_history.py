@@ -0,0 +1,96 @@
+import time
+import pytest
+from power_history import PowerSeries, PowerHistory
+
+SEC = 1000000000
+
+class TestPowerSeries:
+
+    def test_min_max_bucket(self):
+        series = PowerSeries(10, 10)  # 1s buckets
+        series.add(0 * SEC + 1, 100)
+        series.add(0 * SEC + 2, 300)
+        series.add(0 * SEC + 3, 50)
+        series.add(0 * SEC + 4, 200)
+        assert series.points(SEC) == [(2, 300), (3, 50)]
+
+    def test_single_sample_bucket(self):
+        series = PowerSeries(10, 10)
+        series.add(5, 100)
+        assert series.points(SEC) == [(5, 100)]
+
+    def test_budget(self):
+        series = PowerSeries(100, 10)
+        for t in range(0, 100 * SEC, SEC // 10):
+            series.add(t, t % 7)
+        assert len(series.buckets) == 10
+        assert len(series.points(100 * SEC)) <= 20
+
+    def test_expire(self):
+        series = PowerSeries(10, 10)
+        series.add(0, 100)
+        series.add(5 * SEC, 200)
+        assert series.points(9 * SEC) == [(0, 100), (5 * SEC, 200)]
+        assert series.points(12 * SEC) == [(5 * SEC, 200)]
+        assert series.points(20 * SEC) == []
+
+    def test_points_cached(self):
+        series = PowerSeries(10, 10)
+        series.add(0, 100)
+        points = series.points(SEC)
+        assert series.points(SEC) is points
+        series.add(1, 200)
+        # Only the newest bucket is rendered again
+        assert series.points(SEC) is points
+        assert points == [(0, 100), (1, 200)]
+
+    def test_points_incremental(self):
+        series = PowerSeries(10, 10)
+        rebuilt = PowerSeries(10, 10)
+        for t, power in ((0, 100), (SEC, 50), (SEC + 1, 80), (SEC + 2, 20), (3 * SEC, 10)):
+            series.add(t, power)
+            rebuilt.add(t, power)
+            series.points(4 * SEC)
+        assert series.points(4 * SEC) == rebuilt.points(4 * SEC)
+        assert series.points(10 * SEC) == [(SEC + 1, 80), (SEC + 2, 20), (3 * SEC, 10)]
+
+
+class TestPowerHistory:
+
+    def test_zooms(self):
+        history = PowerHistory(budget=100)
+        history.add(SEC, 42)
+        for zoom in PowerHistory.ZOOMS:
+            assert history.points(zoom, 2 * SEC) == [(SEC, 42)]
+
+    def test_version(self):
+        history = PowerHistory()
+        version = history.version("day")
+        history.add(SEC, 42)
+        assert history.version("day") != version
+
+    def test_chart_data(self):
+        history = PowerHistory()
+        history.add(time.monotonic_ns(), 42.04)
+        data = history.chart_data("hour")
+        assert len(data) == 1
+        assert data[0][1] == 42.0
+
+    def test_chart_data_clocks(self):
+        history = PowerHistory(now_func=lambda: 100 * SEC, wall_func=lambda: 1000.)
+        history.add(40 * SEC, 42)
+        assert history.chart_data("hour") == [[940000, 42]]
+        assert history.points("hour") == [(40 * SEC, 42)]
+
+    def test_chart_data_incremental(self):
+        history = PowerHistory()
+        now = time.monotonic_ns()
+        history.add(now - 60 * SEC, 10)
+        history.add(now, 42.04)
+        data = history.chart_data("hour")
+        history.add(now + 1, 50)
+        assert history.chart_data("hour") is data
+        assert [p for _, p in data] == [10, 42.0, 50]
+        assert data[2][0] - data[0][0] == 60000
+        history.evict()
+        assert history.chart_data("hour") == [[data[1][0], 42.0], [data[2][0], 50]]
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import pstats
+import threading
+import time
+import mock
+import pytest
+from profiling import ProfileCapture
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+class TestProfileCapture:
+
+    def wait_finished(self, capture):
+        stop = time.monotonic() + 5
+        while capture.running and time.monotonic() < stop:
+            time.sleep(0.01)
+        assert not capture.running
+
+    def test_sample(self, tmp_path):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_worker, args=(stop,), name="worker")
+        worker.start()
+        capture = ProfileCapture(str(tmp_path), interval=0.001)
+        base = capture.start(0.1)
+        assert capture.start(0.1) is None  # already running
+        self.wait_finished(capture)
+        stop.set()
+        worker.join()
+        folded = open(f"{base}.folded", encoding="utf-8").read()
+        assert "worker;" in folded
+        assert "busy_worker" in folded
+
+    def test_memory(self, tmp_path):
+        capture = ProfileCapture(str(tmp_path))
+        base = capture.start(0.05, memory=True)
+        self.wait_finished(capture)
+        assert (tmp_path / f"{base}.tracemalloc").exists()
+        assert (tmp_path / f"{base}.tracemalloc.txt").exists()
+
+    def test_unknown_mode(self, tmp_path):
+        with pytest.raises(ValueError):
+            ProfileCapture(str(tmp_path)).start(1, "perf")
+
+    @pytest.mark.asyncio
+    async def test_cprofile(self, tmp_path):
+        capture = ProfileCapture(str(tmp_path))
+        base = capture.start(0.05, "cprofile")
+        sum(range(10000))
+        while capture.running:
+            await asyncio.sleep(0.01)
+        stats = pstats.Stats(f"{base}.pstats")
+        assert stats.total_calls > 0
+
+    @pytest.mark.asyncio
+    async def test_cprofile_memory_off_loop(self, tmp_path):
+        capture = ProfileCapture(str(tmp_path))
+        threads = []
+        capture.register_snapshot_sink(lambda snapshot: threads.append(threading.get_ident()))
+        base = capture.start(0.05, "cprofile", True)
+        while capture.running:
+            await asyncio.sleep(0.01)
+        assert threads and threads[0] != threading.get_ident()
+        assert os.path.exists(f"{base}.pstats")
+        assert os.path.exists(f"{base}.tracemalloc.txt")
+
+    def test_duration_bounds(self, tmp_path):
+        capture = ProfileCapture(str(tmp_path))
+        for seconds in (0, -1):
+            with pytest.raises(ValueError):
+                capture.start(seconds)
+        assert not capture.running
+        with mock.patch("profiling.threading.Thread") as thread:
+            capture.start(10**6)
+        assert thread.call_args.kwargs["args"][0] == ProfileCapture.MAX_SECONDS
@@ -0,0 +1,108 @@
+import os
+import threading
+import mock
+import pytest
+from app_state import AppState
+from pulse_log import PulseLog, DAY_NS
+from s0_meter import S0Meter
+
+# Wall clock offset of the monotonic clock in the tests
+OFFSET = 20000 * DAY_NS
+
+
+def pulse_log(path, keep_days=400, wall=OFFSET / 1e9):
+    """Pulse log whose monotonic 0 is OFFSET on the wall clock"""
+    return PulseLog(str(path), keep_days, lambda: 0, lambda: wall)
+
+
+class TestPulseLog:
+
+    def test_append_count(self, tmp_path):
+        log = pulse_log(tmp_path)
+        assert log.pulses([10, 20, 30]) == OFFSET + 30
+        # Across midnight, split into two day files
+        assert log.pulses([DAY_NS - 1, DAY_NS + 1]) == OFFSET + DAY_NS + 1
+        log.close()
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "2024-10-04.pulses", "2024-10-05.pulses"]
+        assert log.written == 5
+        assert log.count_after(OFFSET + 20) == 3
+        assert log.count_after(OFFSET + DAY_NS) == 1
+        assert log.count_after(0) == 5
+        assert list(log.read(OFFSET + 20, OFFSET + DAY_NS + 1)) == [
+            OFFSET + 20, OFFSET + 30, OFFSET + DAY_NS - 1]
+        assert PulseLog(str(tmp_path)).last == OFFSET + DAY_NS + 1
+
+    def test_clock_stepped_back(self, tmp_path):
+        log = pulse_log(tmp_path)
+        log.pulses([100])
+        # Pulse 1µs later, but the wall clock stepped back by 1ms
+        log.wall_func = lambda: (OFFSET - 10**6) / 1e9
+        assert log.pulses([1100]) == OFFSET + 100
+        assert list(log.read(0, OFFSET + DAY_NS)) == [OFFSET + 100, OFFSET + 100]
+
+    def test_partial_record(self, tmp_path):
+        log = pulse_log(tmp_path)
+        log.pulses([10])
+        log.close()
+        path = log.path(OFFSET // DAY_NS)
+        with open(path, "ab") as file:
+            file.write(b"\1\2\3")
+        assert log.count_after(0) == 1
+        log.pulses([20])
+        assert list(log.read(0, OFFSET + DAY_NS)) == [OFFSET + 10, OFFSET + 20]
+
+    def test_expire(self, tmp_path):
+        log = pulse_log(tmp_path, keep_days=2)
+        for day in range(4):
+            log.pulses([day * DAY_NS])
+        log.flush()
+        assert log.days() == [OFFSET // DAY_NS + 2, OFFSET // DAY_NS + 3]
+
+    def test_writer_thread(self, tmp_path):
+        log = pulse_log(tmp_path)
+        threads = []
+        os_write = os.write
+
+        def write(fd, data):
+            threads.append(threading.current_thread())
+            return os_write(fd, data)
+        with mock.patch("os.write", side_effect=write):
+            log.pulses([10])
+            log.pulses([20])
+            log.close()
+        assert threading.current_thread() not in threads
+        assert log.written == 2
+        assert list(log.read(0, OFFSET + DAY_NS)) == [OFFSET + 10, OFFSET + 20]
+
+
+class TestReconcile:
+
+    @pytest.mark.asyncio
+    async def test_stale_state(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        app_state = AppState(state_file)
+        meter = S0Meter("Test", app_state, pulse_log=pulse_log(tmp_path / "pulses"))
+        meter.pulses([10, 20])
+        app_state.store_state()
+        # Counted but not stored before a crash
+        meter.pulses([30, 40, 50])
+        meter.pulse(60)
+        meter.pulse_log.close()
+
+        app_state = AppState(state_file)
+        meter = S0Meter("Test", app_state, pulse_log=PulseLog(str(tmp_path / "pulses")))
+        assert meter.total == 6
+        assert meter.logged == OFFSET + 60
+        # Reconciled once only
+        app_state.store_state()
+        meter = S0Meter("Test", AppState(state_file),
+                        pulse_log=PulseLog(str(tmp_path / "pulses")))
+        assert meter.total == 6
+
+    @pytest.mark.asyncio
+    async def test_without_log(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        meter = S0Meter("Test", app_state)
+        meter.pulses([10])
+        assert meter.state.state == {"total": 1}
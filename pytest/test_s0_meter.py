@@ -20,7 +20,7 @@ class TestS0Meter:
     async def test_increment(self):
         with mock.patch.object(s0_meter.time, 'monotonic_ns') as mock_monotonic_ns:
             mock_monotonic_ns.return_value = 1000000000 # 1s
-            meter = S0Meter("Test", self.app_state_mock())
+            meter = S0Meter("Test", self.app_state_mock(), queue=True)
             assert meter.total == 0
             assert meter.last_event == 1000000000
             meter.pulse(2000000000) # 2s
@@ -36,15 +36,32 @@ class TestS0Meter:
                 meter.task.cancel()
                 await asyncio.wait_for(meter.task, timeout=1.0)
 
+    @pytest.mark.asyncio
+    async def test_pulses(self):
+        with mock.patch.object(s0_meter.time, 'monotonic_ns') as mock_monotonic_ns:
+            mock_monotonic_ns.return_value = 1000000000 # 1s
+            meter = S0Meter("Test", self.app_state_mock())
+            meter.pulses([1500000000, 2000000000, 3000000000])
+            assert meter.total == 3
+            assert meter.last_event == 3000000000
+            assert meter.last_delta == 1000000000
+            mock_monotonic_ns.return_value = 3500000000
+            assert meter.power == 1800
+            assert meter.history.points("hour", 3000000000) == [
+                (1500000000, 3600), (3000000000, 1800)]
+            # A pulse sink only, no queue and task
+            assert meter.queue is None
+            assert meter.task is None
+
     @pytest.mark.asyncio
     async def test_backgroud_task_running(self):
-        meter = S0Meter("Test", self.app_state_mock())
+        meter = S0Meter("Test", self.app_state_mock(), queue=True)
         with pytest.raises(asyncio.exceptions.TimeoutError):
             await asyncio.wait_for(meter.task, timeout=1.0)
 
     @pytest.mark.asyncio
     async def test_event_handler_exec(self):
-        meter = S0Meter("Test", self.app_state_mock())
+        meter = S0Meter("Test", self.app_state_mock(), queue=True)
         with pytest.raises(asyncio.exceptions.TimeoutError):
             await meter.queue.put(mock.Mock(event=mock.Mock(timestamp_ns=1e9)))
             await asyncio.wait_for(meter.task, timeout=1.0)
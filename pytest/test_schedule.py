@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from app_state import AppState, State
+from gpio_map import RelaisState
+from gpio_sim import SimGpioMap
+from io_control import TimedRelais
+from schedule import ScheduleRule, Schedule, _parse_set, MONTHS
+from simulation import VirtualTimeLoop
+from sun import SunEventType
+
+TZ = timezone(timedelta(hours=2))
+# Monday noon
+START = datetime(2026, 10, 19, 12, tzinfo=TZ)
+
+
+class FakeSun:
+    """Sunrise at 07:00, sunset at 18:00, time of a virtual loop"""
+    def __init__(self, loop):
+        self.loop = loop
+
+    def now_func(self):
+        return START + timedelta(seconds=self.loop.time())
+
+    def sun_time(self, event_type, day):
+        hour = 7 if event_type == SunEventType.SUN_RISE else 18
+        return datetime(day.year, day.month, day.day, hour, tzinfo=TZ)
+
+
+async def sleep_until(loop, when):
+    await asyncio.sleep(when - loop.time())
+
+
+def run(coro):
+    loop = VirtualTimeLoop(0.)
+    try:
+        return loop.run_until_complete(coro(loop))
+    finally:
+        loop.close()
+
+
+class TestScheduleRule:
+
+    def test_parse_set(self):
+        assert _parse_set("nov-feb", MONTHS) == {10, 11, 0, 1}
+        assert _parse_set("jan,mar", MONTHS) == {0, 2}
+        assert len(_parse_set("*", MONTHS)) == 12
+        with pytest.raises(ValueError):
+            ScheduleRule("bad", None, "sunset", "25")
+
+    def test_window(self):
+        sun = FakeSun(None)
+        rule = ScheduleRule("evening", None, "sunset+30", "22:30", "mon-fri")
+        assert rule.window(date(2026, 10, 19), sun, TZ) == (
+            datetime(2026, 10, 19, 18, 30, tzinfo=TZ), datetime(2026, 10, 19, 22, 30, tzinfo=TZ))
+        assert rule.window(date(2026, 10, 24), sun, TZ) is None
+        night = ScheduleRule("night", None, "23:00", "sunrise-15", months="nov-feb")
+        assert night.window(date(2026, 10, 31), sun, TZ) is None
+        assert night.window(date(2026, 11, 1), sun, TZ)[1] == datetime(
+            2026, 11, 2, 6, 45, tzinfo=TZ)
+        # The window of Friday is the next after Monday evening
+        assert rule.next_window(datetime(2026, 10, 23, 20, tzinfo=TZ), sun)[0].day == 23
+        assert rule.next_window(datetime(2026, 10, 23, 23, tzinfo=TZ), sun)[0].day == 26
+
+
+class TestSchedule:
+
+    def test_drives_relais(self):
+        async def main(loop):
+            sun = FakeSun(loop)
+            relais = TimedRelais("Lamp", SimGpioMap(), 1)
+            schedule = Schedule([ScheduleRule("evening", relais, "sunset", "22:30", "mon-fri")],
+                                sun)
+            states = []
+            for hour in (17.9, 18.1, 22.4, 22.6, 24 + 18.1, 4 * 24 + 18.1, 5 * 24 + 18.1):
+                await sleep_until(loop, (hour - 12) * 3600)
+                states.append(relais.state)
+            schedule.cancel()
+            return states, schedule.fire_count
+        states, fired = run(main)
+        ON, OFF = RelaisState.ON, RelaisState.OFF
+        # Mon 18:00-22:30, Tue evening, Fri evening, not Saturday
+        assert states == [OFF, ON, ON, OFF, ON, ON, OFF]
+        assert fired == 5
+
+    def test_restore_pending(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        rule_spec = {"on": "sunset", "off": "22:30", "days": "*", "months": "*"}
+
+        async def main(loop):
+            app_state = AppState(state_file)
+            # Stored before a restart, started 2 hours ago
+            app_state.set_state(State("Schedule", {"pending": {"evening": {
+                "rule": rule_spec,
+                "window": [(START - timedelta(hours=2)).isoformat(),
+                           (START + timedelta(hours=1)).isoformat()]}}}))
+            relais = TimedRelais("Lamp", SimGpioMap(), 1)
+            schedule = Schedule([ScheduleRule("evening", relais, "sunset", "22:30")],
+                                FakeSun(loop), app_state=app_state)
+            await sleep_until(loop, 60)
+            on = relais.state
+            await sleep_until(loop, 3601)
+            off = relais.state
+            pending = schedule.state.state["pending"]["evening"]["window"]
+            schedule.cancel()
+            return on, off, pending
+        on, off, pending = run(main)
+        assert (on, off) == (RelaisState.ON, RelaisState.OFF)
+        assert pending[0] == datetime(2026, 10, 19, 18, tzinfo=TZ).isoformat()
+
+    def test_daylight_saving_change(self):
+        berlin = ZoneInfo("Europe/Berlin")
+        # Saturday before the change to CEST at 02:00
+        start = datetime(2026, 3, 28, 22, tzinfo=berlin)
+
+        class Sun(FakeSun):
+            def now_func(self):
+                return (start.astimezone(timezone.utc) +
+                        timedelta(seconds=self.loop.time())).astimezone(berlin)
+
+        async def main(loop):
+            relais = TimedRelais("Lamp", SimGpioMap(), 1)
+            schedule = Schedule([ScheduleRule("night", relais, "22:30", "06:00")], Sun(loop))
+            states = []
+            # 22:31 CET, 05:55 and 06:05 CEST are 0.5, 6.9 and 7.1 hours later
+            for hours in (0.52, 6.92, 7.08):
+                await sleep_until(loop, hours * 3600)
+                states.append(relais.state)
+            schedule.cancel()
+            return states
+        assert run(main) == [RelaisState.ON, RelaisState.ON, RelaisState.OFF]
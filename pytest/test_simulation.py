@@ -0,0 +1,70 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from simulation import Simulation, VirtualTimeLoop
+
+
+class TestVirtualTimeLoop:
+
+    def test_sleep(self):
+        loop = VirtualTimeLoop(1000.)
+        start = time.monotonic()
+        try:
+            loop.run_until_complete(asyncio.sleep(365 * 86400))
+            assert loop.time() >= 1000. + 365 * 86400
+        finally:
+            loop.close()
+        assert time.monotonic() - start < 1
+
+    def test_timer_order(self):
+        loop = VirtualTimeLoop(2. ** 25)
+        fired = []
+        try:
+            for delay in (3, 1, 2):
+                loop.call_later(delay, fired.append, delay)
+            loop.run_until_complete(asyncio.sleep(5))
+        finally:
+            loop.close()
+        assert fired == [1, 2, 3]
+
+
+class TestSimulation:
+
+    def test_deterministic(self):
+        start = datetime(2026, 6, 1, tzinfo=timezone.utc)
+        report = Simulation(start, days=3, seed=7).run()
+        again = Simulation(start, days=3, seed=7).run()
+        del report["wall_s"], again["wall_s"]
+        assert report == again
+
+    def test_report(self):
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        report = Simulation(start, days=2, seed=1).run()
+        # Sunrise and sunset each day, the first event tells the current state
+        assert report["sun_events"] == 5
+        assert report["mask_transition_count"] == {"yard": 4, "terrasse": 4, "garage": 4}
+        assert all(0 < hours < 48 for hours in report["lamp_on_hours"].values())
+        assert 1.4 < report["meter_kwh"]["hvac-a"] < 2.0
+        # Priced at the day and night rates of the default tariff
+        kwh = report["meter_kwh"]["hvac-a"]
+        assert kwh * 0.25 - 0.01 <= report["meter_cost"]["hvac-a"] <= kwh * 0.32 + 0.01
+
+    def test_failed_lamp(self):
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        report = Simulation(start, days=6, seed=1, lamp_power=60,
+                            failed_lamps={"garage": 3}).run()
+        assert all(abs(step - 60) < 5 for step in report["lamp_steps"].values())
+        assert report["lamp_alerts"]
+        for time, rule, message in report["lamp_alerts"]:
+            assert rule == "lamp missing"
+            assert message.startswith("Lampe Garage")
+            assert time >= "2026-01-04"
+        assert report["lamp_flagged"]["Lampe Garage"] == len(report["lamp_alerts"])
+
+    def test_failed_lamp_default_power(self):
+        # 20 W lamps add a pulse in 90 s, their steps are pooled
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        report = Simulation(start, days=30, seed=1, failed_lamps={"garage": 10}).run()
+        assert all(abs(step - 20) < 3 for step in report["lamp_steps"].values())
+        assert report["lamp_flagged"]["Lampe Garage"] > 0
+        assert sum(report["lamp_flagged"].values()) == report["lamp_flagged"]["Lampe Garage"]
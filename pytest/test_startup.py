@@ -0,0 +1,16 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BENCH = Path(__file__).resolve().parent.parent / "bench" / "startup.py"
+
+class TestStartup:
+    """Startup time regression, see bench/startup.py"""
+
+    def test_startup_budget(self):
+        proc = subprocess.run([sys.executable, str(BENCH), "--json"],
+                              capture_output=True, text=True, check=True, timeout=300)
+        result = json.loads(proc.stdout)
+        assert result["eager_modules"] == []
+        assert result["within_budget"], result
@@ -0,0 +1,78 @@
+import asyncio
+import mock
+import pytest
+from app_state import AppState
+from s0_meter import S0Meter
+from simulation import VirtualTimeLoop
+from supervisor import Supervisor
+
+
+def run(coro):
+    loop = VirtualTimeLoop(0.)
+    try:
+        return loop.run_until_complete(coro(loop))
+    finally:
+        loop.close()
+
+
+class TestSupervisor:
+
+    def test_backoff(self):
+        async def scenario(loop):
+            supervisor = Supervisor(backoff=(1., 8.))
+            started = []
+
+            async def fail():
+                started.append(loop.time())
+                raise RuntimeError("fault")
+            with mock.patch("builtins.print"):
+                supervisor.supervise("fail", fail)
+                await asyncio.sleep(30)
+            entry = supervisor.tasks["fail"]
+            supervisor.cancel()
+            return started, entry
+        started, entry = run(scenario)
+        # Delays 1, 2, 4, 8, 8, 8
+        assert started == [0., 1., 3., 7., 15., 23.]
+        assert entry.restarts == 6
+        assert entry.last_error == "RuntimeError('fault')"
+
+    def test_stable_resets_backoff(self):
+        async def scenario(loop):
+            supervisor = Supervisor(backoff=(1., 8.), stable=60.)
+            started = []
+
+            async def fail_late():
+                started.append(loop.time())
+                await asyncio.sleep(100)
+                raise RuntimeError("fault")
+            with mock.patch("builtins.print"):
+                supervisor.supervise("late", fail_late)
+                await asyncio.sleep(250)
+                uptime = supervisor.tasks["late"].uptime
+            supervisor.cancel()
+            return started, uptime
+        started, uptime = run(scenario)
+        assert started == [0., 101., 202.]
+        assert uptime == pytest.approx(48.)
+
+    @pytest.mark.asyncio
+    async def test_meter_keeps_queued_events(self, tmp_path):
+        supervisor = Supervisor(backoff=(0.01, 0.01))
+        meter = S0Meter("Test", AppState(str(tmp_path / "state.json")),
+                        supervisor=supervisor, queue=True)
+        event = mock.Mock()
+        event.event.timestamp_ns = 0
+        # Counting the first event fails, those queued behind it are counted
+        broken = object()
+        with mock.patch("builtins.print"):
+            meter.queue.put_nowait(broken)
+            for _ in range(3):
+                meter.queue.put_nowait(event)
+            while meter.queue.qsize() or supervisor.tasks["Test"].started is None:
+                await asyncio.sleep(0.01)
+        assert meter.total == 3
+        assert supervisor.tasks["Test"].restarts == 1
+        meter.task.cancel()
+        await asyncio.gather(meter.task, return_exceptions=True)
+        assert meter.task.cancelled()
@@ -0,0 +1,122 @@
+from array import array
+from datetime import date, datetime
+import pytest
+from app_state import AppState
+from pulse_log import PulseLog
+from tariff import Tariff, MeterCost
+
+RATES = [["06:00", "day", 0.30], ["22:00", "night", 0.20]]
+WEEKEND = [["00:00", "night", 0.20]]
+
+
+def local_ns(*args):
+    return int(datetime(*args).astimezone().timestamp()) * 10**9
+
+
+class TestTariff:
+
+    def test_table(self):
+        tariff = Tariff(RATES, WEEKEND)
+        # Monday after a weekend starts with night
+        starts, buckets, end = tariff.table(date(2026, 10, 19))
+        assert starts == [local_ns(2026, 10, 19), local_ns(2026, 10, 19, 6),
+                          local_ns(2026, 10, 19, 22)]
+        assert buckets == ["night", "day", "night"]
+        assert end == local_ns(2026, 10, 20)
+        # Saturday
+        assert tariff.table(date(2026, 10, 17))[1] == ["night"]
+        assert tariff.table(date(2026, 10, 19)) is tariff.table(date(2026, 10, 19))
+
+    def test_count(self):
+        tariff = Tariff(RATES, WEEKEND)
+        stamps = array("q", [local_ns(2026, 10, 19, 5, 59), local_ns(2026, 10, 19, 6),
+                             local_ns(2026, 10, 19, 12), local_ns(2026, 10, 19, 23),
+                             local_ns(2026, 10, 20, 7)])
+        assert tariff.count(stamps) == {"2026-10-19": {"night": 2, "day": 2},
+                                        "2026-10-20": {"day": 1}}
+        assert tariff.cost({"night": 2000, "day": 1000}) == pytest.approx(0.35)
+
+    def test_load(self, tmp_path):
+        path = tmp_path / "tariff.json"
+        assert Tariff.load(str(path)).config == Tariff(Tariff.DEFAULT["rates"]).config
+        path.write_text('{"rates": [["00:00", "flat", 0.3]]}')
+        assert Tariff.load(str(path)).prices == {"flat": 0.3}
+        for config in ('{"weekend": [["00:00", "night", 0.2]]}', '{"rates": [["06:00", "day"]]}',
+                       '[]'):
+            path.write_text(config)
+            assert Tariff.load(str(path)).config == Tariff(Tariff.DEFAULT["rates"]).config
+
+
+class TestMeterCost:
+
+    def test_pulses(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        cost = MeterCost("Cost", Tariff(RATES, WEEKEND), app_state, now_func=lambda: 0,
+                         wall_func=lambda: local_ns(2026, 10, 19, 5) / 1e9)
+        cost.pulses([0, 3600 * 10**9, 3601 * 10**9])
+        cost.pulses([18 * 3600 * 10**9])
+        assert cost.days["2026-10-19"]["pulses"] == {"night": 2, "day": 2}
+        assert cost.cost("2026-10-19") == pytest.approx((2 * 0.2 + 2 * 0.3) / 2000)
+        assert cost.cost("2026-10") == cost.cost("2026-10-19")
+        assert cost.cost() == cost.cost("2026-10-19")
+        assert cost.until == local_ns(2026, 10, 19, 23)
+
+    def test_restart(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        wall = local_ns(2026, 10, 19, 12) / 1e9
+        log = PulseLog(str(tmp_path / "pulses"), now_func=lambda: 0, wall_func=lambda: wall)
+        app_state = AppState(state_file)
+        cost = MeterCost("Cost", Tariff(RATES, WEEKEND), app_state, log, lambda: 0,
+                         lambda: wall)
+        log.pulses([0])
+        cost.pulses([0])
+        app_state.store_state()
+        # Logged, but not stored before a crash
+        log.pulses([10**9, 11 * 3600 * 10**9])
+        cost = MeterCost("Cost", Tariff(RATES, WEEKEND), AppState(state_file), log, lambda: 0,
+                         lambda: wall)
+        assert cost.days["2026-10-19"] == {"pulses": {"day": 2, "night": 1},
+                                           "cost": pytest.approx(0.8 / 2000)}
+        # Rates changed, the log is priced anew
+        cost.reprice(Tariff([["00:00", "flat", 0.40]]))
+        assert cost.days["2026-10-19"] == {"pulses": {"flat": 3},
+                                           "cost": pytest.approx(1.2 / 2000)}
+        cost.pulses([2 * 10**9])
+        assert cost.days["2026-10-19"]["pulses"] == {"flat": 4}
+
+    def test_totals(self, tmp_path):
+        app_state = AppState(str(tmp_path / "state.json"))
+        wall = [local_ns(2026, 10, 31, 12) / 1e9]
+        cost = MeterCost("Cost", Tariff([["00:00", "flat", 0.40]]), app_state,
+                         now_func=lambda: 0, wall_func=lambda: wall[0])
+        cost.days["2026-10-01"] = {"pulses": {"flat": 2000}, "cost": 0.4}
+        cost.pulses([0, 10**9])
+        assert cost.totals() == (pytest.approx(0.8 / 2000), pytest.approx(0.4 + 0.8 / 2000))
+        # Days stored later are not summed into the running total
+        cost.days["2026-10-02"] = {"pulses": {"flat": 2000}, "cost": 0.4}
+        cost.pulses([2 * 10**9])
+        assert cost.totals()[1] == pytest.approx(0.4 + 1.2 / 2000)
+        # A new month starts with its first day
+        wall[0] = local_ns(2026, 11, 1, 12) / 1e9
+        assert cost.totals() == (0., 0.)
+        cost.pulses([0])
+        assert cost.totals() == (pytest.approx(0.4 / 2000), pytest.approx(0.4 / 2000))
+        assert cost.cost("2026-10") == pytest.approx(0.8 + 1.2 / 2000)
+
+    def test_history(self, tmp_path):
+        state_file = str(tmp_path / "state.json")
+        history = str(tmp_path / "costs.json")
+        wall = local_ns(2026, 10, 19, 12) / 1e9
+        app_state = AppState(state_file)
+        cost = MeterCost("Cost", Tariff([["00:00", "flat", 0.40]]), app_state,
+                         now_func=lambda: 0, wall_func=lambda: wall, history=history)
+        cost.days["2025-10-19"] = {"pulses": {"flat": 2000}, "cost": 0.4}
+        # The first pulse of a day writes the history
+        cost.pulses([0])
+        app_state.store_state()
+        # Only the recent days are rewritten by every store
+        assert list(app_state.get_state("Cost").state["days"]) == ["2026-10-19"]
+        restored = MeterCost("Cost", Tariff([["00:00", "flat", 0.40]]), AppState(state_file),
+                             now_func=lambda: 0, wall_func=lambda: wall, history=history)
+        assert restored.days == cost.days
+        assert restored.cost("2025") == pytest.approx(0.4)
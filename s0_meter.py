@@ -2,26 +2,47 @@
 import time
 import asyncio
 from app_state import State, Stateful
+from power_history import PowerHistory
+from supervisor import create_task
+
 
 class S0Meter(Stateful):
     """An energy meter based on a S0 interface
 
-    Energy is determined by counting S0 edge events.
+    Energy is determined by counting S0 edge events. The meter is a pulse
+    sink of S0EventDispatcher. A queue of S0Events, counted by a task of its
+    own, is only created if requested.
 
     Arguments:
         name (str): Gives the meter a name
-        total (int): Initial count
+        app_state (AppState): Persistence of the total count
+        now_func (callable): Monotonic clock in ns, default time.monotonic_ns
+        pulse_log (PulseLog): Log of the counted pulses. The restored total
+            is reconciled with the pulses logged after it was stored.
+        stats (MeterStats): Statistics fed with the power of every pulse
+        supervisor (Supervisor): Restart the event handling if it fails
+        history (PowerHistory): History of the power, default 240 buckets per
+            zoom level on the clock of the meter
+        queue (bool): Count the S0Events pushed into a queue by a task
     """
     # As given by specification of Eltaco
     PULSE_PER_KWH = 2000
 
-    def __init__(self, name, app_state):
+    def __init__(self, name, app_state, now_func=None, pulse_log=None, stats=None,
+                 supervisor=None, history=None, queue=False):
+        # pylint: disable=too-many-arguments
         self.name = name
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.pulse_log = pulse_log
+        self.stats = stats
         self.total = 0
-        self.last_event = time.monotonic_ns()
+        # Wall clock time in ns of the last logged pulse counted in total
+        self.logged = None
+        self.last_event = self.now_func()
         self.last_delta = 1
-        self.event_queue = asyncio.Queue()
-        self.task = asyncio.create_task(self.__handle_s0_events(), name=name)
+        self.history = history if history is not None else PowerHistory(now_func=self.now_func)
+        self.event_queue = asyncio.Queue() if queue else None
+        self.task = create_task(name, self.__handle_s0_events, supervisor) if queue else None
         self._register_state(app_state)
 
     def _register_state(self, app_state):
@@ -29,12 +50,22 @@ class S0Meter(Stateful):
         if state is not None:
             self.total = state.state["total"]
             assert isinstance(self.total, int)
+            logged = state.state.get("logged")
+            if self.pulse_log is not None and logged is not None:
+                missed = self.pulse_log.count_after(logged)
+                if missed:
+                    print(f"{self.name}: {missed} pulses recovered from pulse log")
+                    self.total += missed
+        if self.pulse_log is not None:
+            self.logged = self.pulse_log.last
         app_state.register_client(self)
 
     @property
     def state(self):
         """Return the app_state State of the instance"""
-        return State(self.name, {"total": self.total})
+        if self.logged is None:
+            return State(self.name, {"total": self.total})
+        return State(self.name, {"total": self.total, "logged": self.logged})
 
     def pulse(self, timestamp):
         """Register last detected pulse with at time"""
@@ -44,10 +75,40 @@ class S0Meter(Stateful):
         self.last_delta = timestamp - self.last_event
         self.last_event = timestamp
 
+        # Power of the elapsed pulse interval
+        delta_e = 3.6e6 / self.PULSE_PER_KWH  # Watt seconds
+        power = delta_e / max(self.last_delta, 1) * 1e9
+        self.history.add(timestamp, power)
+        if self.stats is not None:
+            self.stats.add(timestamp, power)
+        if self.pulse_log is not None:
+            self.logged = self.pulse_log.pulses((timestamp,))
+
+    def pulses(self, timestamps):
+        """Register a batch of pulses, timestamps in ns in order of arrival
+
+        Pulse sink interface of S0EventDispatcher.
+        """
+        last_event = self.last_event
+        add = self.history.add
+        stats = self.stats
+        delta_e = 3.6e6 / self.PULSE_PER_KWH * 1e9  # Watt nanoseconds
+        for timestamp in timestamps:
+            power = delta_e / max(timestamp - last_event, 1)
+            add(timestamp, power)
+            if stats is not None:
+                stats.add(timestamp, power)
+            self.last_delta = timestamp - last_event
+            last_event = timestamp
+        self.last_event = last_event
+        self.total += len(timestamps)
+        if self.pulse_log is not None and len(timestamps):
+            self.logged = self.pulse_log.pulses(timestamps)
+
     @property
     def power(self):
         """Get the current power"""
-        delta_t = time.monotonic_ns() - self.last_event  # nanos
+        delta_t = self.now_func() - self.last_event  # nanos
         delta_t = max((self.last_delta, delta_t)) * 1e-9  # secs
         delta_e = 3.6e6 / self.PULSE_PER_KWH  # Watt seconds
         return delta_e / delta_t
@@ -68,7 +129,7 @@ class S0Meter(Stateful):
 
     @property
     def queue(self):
-        """The queue for pushing events to be counted
+        """The queue for pushing events to be counted, None if not requested
 
         The objects expected to be pushed shall have type S0Event
         """
@@ -82,7 +143,6 @@ class S0Meter(Stateful):
         while True:
             event = await self.event_queue.get()
             self.pulse(event.event.timestamp_ns)
-            print(self)
 
     def __str__(self):
         """Pretty print the meter"""
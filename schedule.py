@@ -0,0 +1,242 @@
+"""Fixed on windows of relais by clock and sun times
+
+A ScheduleRule switches a TimedRelais on for a window each day it applies.
+Start and end are a local time or relative to sunrise or sunset:
+
+    06:00          at 6 o'clock
+    sunset         at sunset
+    sunrise-30     30 minutes before sunrise
+
+Rules may be restricted to days of the week and months, as ranges or lists
+of names, e.g. "mon-fri", "sat,sun" or "nov-feb". An end before the start
+is on the next day.
+
+The Schedule keeps the next window of every rule in a heap ordered by its
+start and sleeps until the first one. At its start the window is passed to
+TimedRelais.update, as a detector does. Rules are configured in
+schedule.json next to the state file:
+
+    [
+        {"name": "Terrasse abends", "lamp": "terrasse", "on": "sunset",
+         "off": "22:30", "days": "mon-fri"},
+        {"name": "Garage morgens", "lamp": "garage", "on": "06:00",
+         "off": "sunrise+15", "months": "nov-feb"}
+    ]
+"""
+import asyncio
+import heapq
+import json
+import re
+from datetime import datetime, timedelta
+from app_state import State, Stateful
+from sun import SunEventType
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+MONTHS = ("jan", "feb", "mar", "apr", "may", "jun",
+          "jul", "aug", "sep", "oct", "nov", "dec")
+SUN_TIME = re.compile(r"(sunrise|sunset)([+-]\d+)?")
+CLOCK_TIME = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+def _seconds(later, earlier):
+    """Elapsed seconds between aware datetimes, across UTC offset changes
+
+    Subtracting datetimes of the same tzinfo ignores a DST change between.
+    """
+    return later.timestamp() - earlier.timestamp()
+
+
+def _parse_set(spec, names):
+    """Return the indexes of names given as '*', lists and wrapping ranges"""
+    if spec in (None, "*"):
+        return frozenset(range(len(names)))
+    result = set()
+    for part in spec.lower().split(","):
+        first, _, last = part.strip().partition("-")
+        start = names.index(first)
+        stop = names.index(last) if last else start
+        while True:
+            result.add(start)
+            if start == stop:
+                break
+            start = (start + 1) % len(names)
+    return frozenset(result)
+
+
+def _parse_time(spec):
+    """Return (sun event type or None, hour, minute) of a time spec"""
+    match = SUN_TIME.fullmatch(spec)
+    if match:
+        event_type = SunEventType.SUN_RISE if match[1] == "sunrise" else SunEventType.SUN_SET
+        return (event_type, 0, int(match[2] or 0))
+    match = CLOCK_TIME.fullmatch(spec)
+    if match is None:
+        raise ValueError(f"Invalid schedule time {spec}")
+    return (None, int(match[1]), int(match[2]))
+
+
+class ScheduleRule:
+    """On window of a relais on the days a rule applies
+
+    Arguments:
+        name (str): Unique name of the rule
+        relais (TimedRelais): Relais to switch on
+        on (str): Start of the window, e.g. sunset+10
+        off (str): End of the window, e.g. 22:30
+        days (str): Days of the week, e.g. mon-fri, default every day
+        months (str): Months, e.g. nov-feb, default all year
+    """
+    def __init__(self, name, relais, on, off, days="*", months="*"):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.relais = relais
+        self.spec = {"on": on, "off": off, "days": days, "months": months}
+        self.on = _parse_time(on)
+        self.off = _parse_time(off)
+        self.days = _parse_set(days, DAYS)
+        self.months = _parse_set(months, MONTHS)
+
+    @staticmethod
+    def __resolve(spec, day, sun, tzinfo):
+        """Return the aware time of a parsed time spec on a date"""
+        event_type, hour, minute = spec
+        if event_type is None:
+            return datetime(day.year, day.month, day.day, hour, minute, tzinfo=tzinfo)
+        return sun.sun_time(event_type, day) + timedelta(minutes=minute)
+
+    def window(self, day, sun, tzinfo):
+        """Return start and end of the window starting on a date, None if
+        the rule does not apply that day"""
+        if day.weekday() not in self.days or day.month - 1 not in self.months:
+            return None
+        start = self.__resolve(self.on, day, sun, tzinfo)
+        stop = self.__resolve(self.off, day, sun, tzinfo)
+        if stop <= start:
+            stop = self.__resolve(self.off, day + timedelta(days=1), sun, tzinfo)
+        return start, stop
+
+    def next_window(self, after, sun):
+        """Return the first window ending after an aware time, None if none
+        within a year"""
+        day = after.date() - timedelta(days=1)
+        for _ in range(370):
+            window = self.window(day, sun, after.tzinfo)
+            if window is not None and window[1] > after:
+                return window
+            day += timedelta(days=1)
+        return None
+
+
+class Schedule(Stateful):
+    """Switch relais on by schedule rules
+
+    The pending window of every rule is persisted. After a restart a window
+    that started meanwhile and is not over is applied at once, for the
+    remaining time.
+
+    Arguments:
+        rules (iterable): ScheduleRules
+        sun (SunSensor): Sun times and current time of sun relative rules
+        now_func (callable): Returns the current aware time, default that
+            of the sun
+        app_state (AppState): Persistence of the pending windows
+    """
+    NAME = "Schedule"
+    # Windows starting within are passed to the relais at once
+    AHEAD = timedelta(minutes=1)
+
+    def __init__(self, rules, sun, now_func=None, app_state=None):
+        self.rules = list(rules)
+        self.sun = sun
+        self.now_func = now_func if now_func is not None else sun.now_func
+        self.loop = asyncio.get_running_loop()
+        self.heap = []
+        self.handle = None
+        self.app_state = None
+        # Metrics: windows passed to relais
+        self.fire_count = 0
+        pending = {}
+        if app_state is not None:
+            state = app_state.get_state(self.NAME)
+            if state is not None:
+                pending = state.state["pending"]
+            app_state.register_client(self)
+        now = self.now_func()
+        for index, rule in enumerate(self.rules):
+            stored = pending.get(rule.name)
+            window = None
+            if stored is not None and stored["rule"] == rule.spec:
+                window = tuple(datetime.fromisoformat(t) for t in stored["window"])
+                if window[1] <= now:
+                    window = None
+            if window is None:
+                window = rule.next_window(now, sun)
+            if window is not None:
+                heapq.heappush(self.heap, (window[0], index, window[1]))
+        self.app_state = app_state
+        self.__arm()
+
+    @classmethod
+    def load(cls, path, lamps, sun, app_state=None):
+        """Create the schedule of rules configured in a JSON file
+
+        Arguments:
+            path (str): Path of the JSON file, no rules if missing
+            lamps (dict): TimedRelais by the key used as lamp in the rules
+            sun (SunSensor): Sun times and current time
+            app_state (AppState): Persistence of the pending windows
+        """
+        rules = []
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for config in json.load(file):
+                    rules.append(ScheduleRule(
+                        config["name"], lamps[config["lamp"]], config["on"], config["off"],
+                        config.get("days", "*"), config.get("months", "*")))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as err:
+            print(f"Error reading schedule {path}: {err}")
+        return cls(rules, sun, app_state=app_state)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        pending = {self.rules[index].name: {
+                       "rule": self.rules[index].spec,
+                       "window": [start.isoformat(), stop.isoformat()]}
+                   for start, index, stop in self.heap}
+        return State(self.NAME, {"pending": pending})
+
+    def __arm(self):
+        """Sleep until the start of the first window"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.heap:
+            delay = _seconds(self.heap[0][0], self.now_func()) - self.AHEAD.total_seconds()
+            self.handle = self.loop.call_later(max(delay, 0.), self.__fire)
+
+    def __fire(self):
+        """Pass the windows starting now to the relais, plan the next"""
+        self.handle = None
+        now = self.now_func()
+        ahead = self.AHEAD.total_seconds()
+        while self.heap and _seconds(self.heap[0][0], now) <= ahead:
+            start, index, stop = heapq.heappop(self.heap)
+            rule = self.rules[index]
+            rule.relais.update(max(_seconds(start, now), 0.),
+                               min(_seconds(stop, start), _seconds(stop, now)))
+            self.fire_count += 1
+            window = rule.next_window(stop, self.sun)
+            if window is not None:
+                heapq.heappush(self.heap, (window[0], index, window[1]))
+        if self.app_state is not None:
+            self.app_state.request_store()
+        self.__arm()
+
+    def cancel(self):
+        """Stop scheduling"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
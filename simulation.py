@@ -0,0 +1,395 @@
+"""Deterministic simulation of the installation in virtual time
+
+The installation of LightControl runs on a SimGpioMap in an event loop whose
+clock is virtual. When nothing is ready to run, the loop advances its clock
+to the next timer instead of sleeping. Sun events, detector activity and
+meter pulses are all driven by that clock, so a year takes seconds and the
+same seed gives the same result. Edges are injected into the SimGpioMap and
+passed on by the S0EventDispatcher, like those of the hardware.
+
+    python simulation.py --days 365 --seed 1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import random
+import selectors
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from app_state import AppState
+from gpio_map import RelaisState
+from gpio_sim import SimGpioMap
+from io_control import S0EventDispatcher
+from light_control_new import LightControl
+from metrics import process_rss
+from sun import SunSensor
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Selector advancing the virtual time of its loop instead of waiting"""
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events:
+            if timeout is None:
+                # Nothing scheduled, only I/O from other threads can follow
+                return super().select(None)
+            if timeout > 0:
+                self.loop.advance(timeout)
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop running on virtual time
+
+    Arguments:
+        start (float): Initial value of time() in seconds
+    """
+    def __init__(self, start=0.):
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.virtual_time = start
+        # Timers are due within the resolution. That of the monotonic clock,
+        # 1ns, is below the float precision of the time after some months.
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        """Return the virtual time in seconds, the clock of the loop"""
+        return self.virtual_time
+
+    def advance(self, timeout):
+        """Advance the time by timeout, at least to the next timer
+
+        Adding small timeouts to a large time may not change it in floating
+        point, the next timer is reached exactly instead.
+        """
+        self.virtual_time += timeout
+        if self._scheduled:  # pylint: disable=no-member
+            self.virtual_time = max(self.virtual_time,
+                                    self._scheduled[0].when())  # pylint: disable=no-member
+
+
+class RecordingGpio(SimGpioMap):
+    """SimGpioMap accumulating the on time of each relais
+
+    Arguments:
+        clock (callable): Clock in seconds
+    """
+    def __init__(self, clock):
+        super().__init__("simulation", now_func=lambda: int(clock() * 1e9))
+        self.clock = clock
+        self.on_since = [None] * len(self.relais_pins)
+        self.on_time = [0.] * len(self.relais_pins)
+
+    def set_relais(self, relais, state):
+        now = self.clock()
+        if state == RelaisState.ON and self.on_since[relais] is None:
+            self.on_since[relais] = now
+        elif state == RelaisState.OFF and self.on_since[relais] is not None:
+            self.on_time[relais] += now - self.on_since[relais]
+            self.on_since[relais] = None
+        super().set_relais(relais, state)
+
+    def close(self):
+        """Account relais still on"""
+        for relais in range(len(self.relais_pins)):
+            self.set_relais(relais, RelaisState.OFF)
+
+
+class _FlushingMonitor:
+    """Proxy of the LampMonitor of the relais, flushing the light meter first
+
+    On the hardware the pulses reach the monitor as they come, before a
+    switch of the relais ends their segment. The simulation injects them in
+    batches, the pending ones are injected at the power before the switch.
+
+    Arguments:
+        monitor (LampMonitor): Monitor receiving the switches
+        flush (callable): Injects and dispatches the pending pulses
+    """
+    def __init__(self, monitor, flush):
+        self.monitor = monitor
+        self.flush = flush
+
+    def switched(self, lamp, on):
+        """Flush the pulses, then report the switch"""
+        self.flush()
+        self.monitor.switched(lamp, on)
+
+
+class Simulation:
+    """A run of the installation over a number of days
+
+    Detector activity is a Poisson process, its rate follows the hour of day
+    given by ACTIVITY. The HVAC meters pulse as Poisson process of their mean
+    power, the light meter steadily at the power of the lamps switched on. A
+    failed lamp draws no power, the LampMonitor should flag it.
+
+    Arguments:
+        start (datetime): Aware start time
+        days (float): Simulated days
+        seed (int): Seed of the random generator
+        detections (float): Mean detector triggers per detector and day
+        hvac_power (float): Mean power of each HVAC in W
+        lamp_power (float): Power of each lamp in W
+        failed_lamps (dict): Days after the start at which a lamp, by key
+            of LightControl.lamps, fails
+        memory_budget (MemoryBudget): Run in memory budget mode and report
+            the resident set size at the end of each day
+    """
+    # Relative detector activity per hour of the day
+    ACTIVITY = (0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 1.0, 1.5, 1.0, 0.6, 0.6, 0.8,
+                1.0, 0.8, 0.6, 0.8, 1.2, 1.8, 2.0, 1.8, 1.5, 1.0, 0.5, 0.2)
+    START_TIME = 1000.
+    METER_TICK = 900.
+    PULSE_ENERGY = 3.6e6 / 2000  # Ws per pulse, S0Meter.PULSE_PER_KWH
+
+    def __init__(self, start, days=365, seed=0, detections=20, hvac_power=35,
+                 lamp_power=20, failed_lamps=None, memory_budget=None):
+        # pylint: disable=too-many-arguments
+        self.start = start.astimezone(timezone.utc)
+        self.days = days
+        self.rng = random.Random(seed)
+        self.detections = detections
+        self.hvac_power = hvac_power
+        self.lamp_power = lamp_power
+        self.failed_lamps = dict(failed_lamps or {})
+        self.memory_budget = memory_budget
+        self.rss = []
+        self.memory = None
+        self.loop = None
+        self.gpio = None
+        self.dispatcher = None
+        self.light_control = None
+        self.detector_events = {}
+        # Virtual time up to which the pulses of each meter are injected
+        self.injected = {}
+        # Energy of the light meter towards its next pulse, Ws
+        self.light_energy = 0.
+        self.lamp_alerts = []
+        self.sun_events = 0
+        self.mask_transitions = []
+
+    def now(self):
+        """Virtual wall clock, aware datetime in UTC"""
+        return self.start + timedelta(seconds=self.loop.time() - self.START_TIME)
+
+    def monotonic_ns(self):
+        """Virtual monotonic clock in ns"""
+        return int(self.loop.time() * 1e9)
+
+    def run(self):
+        """Run the simulation, return the report"""
+        self.loop = VirtualTimeLoop(self.START_TIME)
+        wall = time.perf_counter()
+        try:
+            with tempfile.TemporaryDirectory() as tmp, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                self.loop.run_until_complete(self.__main(f"{tmp}/state.json"))
+        finally:
+            self.loop.close()
+            if self.memory_budget is not None:
+                self.memory_budget.stop_tracing()
+        report = self.report()
+        report["wall_s"] = round(time.perf_counter() - wall, 3)
+        return report
+
+    async def __main(self, state_file):
+        self.gpio = RecordingGpio(self.loop.time)
+        light_control = LightControl(lambda consumer: self.gpio, state_file,
+                                     memory_budget=self.memory_budget)
+        self.light_control = light_control
+        sun = SunSensor(now_func=lambda: self.now().astimezone(sun.tzinfo))
+        sun_queue = asyncio.Queue()
+        if self.memory_budget is not None:
+            self.memory_budget.start_tracing()
+        light_control.install(self.gpio, AppState(state_file), sun, self.monotonic_ns,
+                              lambda: self.now().timestamp())
+        # Dispatched when edges are injected, not by a reader thread
+        self.dispatcher = S0EventDispatcher(self.gpio, read=False)
+        light_control.connect(self.dispatcher)
+        self.injected = dict.fromkeys(light_control.meters, self.loop.time())
+        monitor = _FlushingMonitor(light_control.lamp_monitor, lambda: self.__inject("light"))
+        for lamp in light_control.lamps.values():
+            lamp.monitor = monitor
+        alert_queue = asyncio.Queue()
+        light_control.lamp_monitor.register_queue(alert_queue)
+        sun.register_queue(sun_queue)
+        for key in light_control.detectors:
+            asyncio.create_task(self.__detect(key))
+        for key in light_control.meters:
+            asyncio.create_task(self.__pulse(key))
+        asyncio.create_task(self.__observe_masks(sun_queue))
+        asyncio.create_task(self.__observe_lamps(alert_queue))
+        if self.memory_budget is not None:
+            asyncio.create_task(self.__sample_memory())
+        await asyncio.sleep(self.days * 86400)
+        if self.memory_budget is not None:
+            self.memory_budget.sample()
+            self.memory = self.memory_budget.report()
+        self.gpio.close()
+        # Includes the tasks of meters, detectors and dimmer
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __detect(self, key):
+        """Trigger a detector at the activity of the hour of day"""
+        s0_index = self.light_control.detector_inputs[key]
+        self.detector_events[key] = 0
+        peak = max(self.ACTIVITY)
+        mean = sum(self.ACTIVITY) / len(self.ACTIVITY)
+        rate = self.detections / 86400 * peak / mean
+        while True:
+            # Thinning of a Poisson process at the peak rate
+            await asyncio.sleep(self.rng.expovariate(rate))
+            hour = self.now().astimezone(self.light_control.sun.tzinfo).hour
+            if self.rng.random() * peak < self.ACTIVITY[hour]:
+                self.detector_events[key] += 1
+                self.gpio.inject(s0_index)
+                self.dispatcher.read_now()
+
+    def __power(self, key):
+        """Momentary mean power of a meter"""
+        if key == "light":
+            days = (self.loop.time() - self.START_TIME) / 86400
+            working = [lamp.relais for name, lamp in self.light_control.lamps.items()
+                       if self.failed_lamps.get(name, math.inf) > days]
+            return self.lamp_power * sum(self.gpio.on_since[relais] is not None
+                                         for relais in working)
+        return self.hvac_power
+
+    def __inject(self, key):
+        """Inject and dispatch the pulses of a meter since the last injection
+
+        The power is constant since. The lamps draw it steadily, the light
+        meter pulses each PULSE_ENERGY. The HVACs vary around it, their
+        pulses are a Poisson process, which restarts at any time.
+        """
+        now = self.loop.time()
+        start, self.injected[key] = self.injected[key], now
+        power = self.__power(key)
+        s0_index = self.light_control.meter_inputs[key]
+        if key == "light":
+            energy = self.light_energy + power * (now - start)
+            if power > 0:
+                due = start + (self.PULSE_ENERGY - self.light_energy) / power
+                while energy >= self.PULSE_ENERGY:
+                    self.gpio.inject(s0_index, int(due * 1e9))
+                    energy -= self.PULSE_ENERGY
+                    due += self.PULSE_ENERGY / power
+            self.light_energy = energy
+        elif power > 0:
+            rate = power / self.PULSE_ENERGY
+            due = start + self.rng.expovariate(rate)
+            while due <= now:
+                self.gpio.inject(s0_index, int(due * 1e9))
+                due += self.rng.expovariate(rate)
+        self.dispatcher.read_now()
+
+    async def __pulse(self, key):
+        """Pulse a meter, in batches per meter tick"""
+        while True:
+            await asyncio.sleep(self.METER_TICK)
+            self.__inject(key)
+
+    async def __observe_masks(self, queue):
+        """Record detector mask changes caused by sun events"""
+        masks = {key: d.mask for key, d in self.light_control.detectors.items()}
+        while True:
+            await queue.get()
+            self.sun_events += 1
+            now = self.now().isoformat(timespec="seconds")
+            # Detectors handled the event by then
+            await asyncio.sleep(1)
+            for key, detector in self.light_control.detectors.items():
+                if detector.mask != masks[key]:
+                    masks[key] = detector.mask
+                    self.mask_transitions.append((now, key, detector.mask))
+
+    async def __observe_lamps(self, queue):
+        """Record the alerts of the LampMonitor"""
+        while True:
+            alert = await queue.get()
+            self.lamp_alerts.append((self.now().isoformat(timespec="seconds"),
+                                     alert.rule, alert.message))
+
+    async def __sample_memory(self):
+        """Record the resident set size at the end of each day"""
+        while True:
+            await asyncio.sleep(86400)
+            self.rss.append(process_rss())
+
+    def report(self):
+        """Return the results of the run"""
+        lamps = self.light_control.lamps
+        monitor = self.light_control.lamp_monitor
+        report = {
+            "start": self.start.isoformat(),
+            "days": self.days,
+            "lamp_on_hours": {key: round(self.gpio.on_time[lamp.relais] / 3600, 2)
+                              for key, lamp in lamps.items()},
+            "lamp_switches": {key: lamp.switch_count for key, lamp in lamps.items()},
+            "detector_events": self.detector_events,
+            "meter_kwh": {key: round(meter.energy, 3)
+                          for key, meter in self.light_control.meters.items()},
+            # Of all simulated days
+            "meter_cost": {key: round(cost.cost(""), 2)
+                           for key, cost in self.light_control.costs.items()},
+            "sun_events": self.sun_events,
+            "mask_transition_count": {
+                key: sum(1 for _, k, _ in self.mask_transitions if k == key)
+                for key in self.light_control.detectors},
+            "mask_transitions": self.mask_transitions,
+            # Learned power steps, None while learning
+            "lamp_steps": {lamp: monitor.step(lamp) and round(monitor.step(lamp), 1)
+                           for lamp in monitor.lamps},
+            "lamp_flagged": dict(monitor.flagged),
+            "lamp_alerts": self.lamp_alerts,
+        }
+        if self.memory_budget is not None:
+            report["rss_mb"] = [round(rss / 2**20, 2) for rss in self.rss]
+            report["memory"] = self.memory
+        return report
+
+
+def main():
+    """Run a simulation as configured on the command line, print the report"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", default="2026-01-01T00:00:00+01:00",
+                        help="Start time, ISO format with UTC offset")
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--detections", type=float, default=20,
+                        help="Mean triggers per detector and day")
+    parser.add_argument("--hvac-power", type=float, default=35, help="Mean W per HVAC")
+    parser.add_argument("--lamp-power", type=float, default=20, help="W per lamp")
+    parser.add_argument("--fail-lamp", nargs=2, action="append", default=[],
+                        metavar=("LAMP", "DAY"),
+                        help="Lamp failing at the day after the start, e.g. garage 10")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the full report including mask transitions and alerts")
+    args = parser.parse_args()
+    simulation = Simulation(datetime.fromisoformat(args.start), args.days, args.seed,
+                            args.detections, args.hvac_power, args.lamp_power,
+                            {lamp: float(day) for lamp, day in args.fail_lamp})
+    report = simulation.run()
+    if not args.json:
+        del report["mask_transitions"], report["lamp_alerts"]
+    json.dump(report, sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,11 @@
-""" A daylight "sensor" based on local time and geo coordinates"""
+""" A daylight "sensor" based on local time and geo coordinates
+
+astral and zoneinfo are imported when the first SunSensor is created.
+"""
 import asyncio
 from enum import IntEnum
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-try:
-    from zoneinfo import ZoneInfo
-except ImportError:
-    from backports.zoneinfo import ZoneInfo
-from astral import Observer, sun
 
 
 class SunEventType(IntEnum):
@@ -23,27 +21,47 @@ class SunEvent:
     event_time: datetime
     now: datetime
 
+
 class SunSensor:
-    """Timed daylight "sensor" based on geo coordinates"""
-    def __init__(self, polling_interval=timedelta(days=1)):
+    """Timed daylight "sensor" based on geo coordinates
+
+    Arguments:
+        polling_interval (timedelta): Maximum time between events
+        now_func (callable): Returns the current time as aware datetime,
+            default the local wall clock
+    """
+    def __init__(self, polling_interval=timedelta(days=1), now_func=None):
+        # pylint: disable=import-outside-toplevel
+        try:
+            from zoneinfo import ZoneInfo
+        except ImportError:
+            from backports.zoneinfo import ZoneInfo
+        from astral import Observer, sun
+
+        self.sun = sun
         self.polling_interval = polling_interval
         self.tzinfo = ZoneInfo("Europe/Berlin")
+        self.now_func = now_func if now_func is not None else self.__now
         self.home = Observer(48.742211, 9.2068, 430)
         self.loop = asyncio.get_running_loop()
         self.wait_event = asyncio.Event()
         self.cur_event = None
         self.loop.call_soon(self.__sun_timeout)
         self.queues = []
+        self.times = {}
+
+    def __now(self):
+        return datetime.now(self.tzinfo)
 
     def __sun_timeout(self):
-        now = datetime.now(self.tzinfo)
-        today_sunrise = sun.sunrise(self.home, now, self.tzinfo)
-        today_sunset = sun.sunset(self.home, now, self.tzinfo)
+        now = self.now_func()
+        today_sunrise = self.sun.sunrise(self.home, now, self.tzinfo)
+        today_sunset = self.sun.sunset(self.home, now, self.tzinfo)
         tomorrow = now + timedelta(days=1)
-        tomorrow_sunrise = sun.sunrise(self.home, tomorrow, self.tzinfo)
-        tomorrow_sunset = sun.sunset(self.home, tomorrow, self.tzinfo)
+        tomorrow_sunrise = self.sun.sunrise(self.home, tomorrow, self.tzinfo)
+        tomorrow_sunset = self.sun.sunset(self.home, tomorrow, self.tzinfo)
         yesterday = now - timedelta(days=1)
-        yesterday_sunset = sun.sunset(self.home, yesterday, self.tzinfo)
+        yesterday_sunset = self.sun.sunset(self.home, yesterday, self.tzinfo)
 
         # Avoid not beeing close before event time and not creating the event.
         # Eventloop time is no world clock, there may be drift.
@@ -76,6 +94,21 @@ class SunSensor:
         sleep_duration = min(tt_rise, tt_set, self.polling_interval).total_seconds()
         self.loop.call_later(sleep_duration, self.__sun_timeout)
 
+    def sun_time(self, event_type, day):
+        """Return the aware time of sunrise or sunset on a date
+
+        Times are computed once per date and kept in a table.
+        """
+        key = (event_type, day)
+        event_time = self.times.get(key)
+        if event_time is None:
+            if len(self.times) > 64:
+                self.times.clear()
+            func = self.sun.sunrise if event_type == SunEventType.SUN_RISE else self.sun.sunset
+            event_time = func(self.home, day, self.tzinfo)
+            self.times[key] = event_time
+        return event_time
+
     async def wait_next(self):
         """Wait for the next sunrise/sunset event, what ever happens first
 
@@ -104,10 +137,10 @@ class SunSensor:
         The event time is selected from passed now and may by in the future
         or the past relative to passed now.
         """
-        now = datetime.now(self.tzinfo) if now is None else now
+        now = self.now_func() if now is None else now
         match event_type:
             case SunEventType.SUN_SET:
-                event_time = sun.sunset(self.home, now, self.tzinfo)
+                event_time = self.sun.sunset(self.home, now, self.tzinfo)
             case SunEventType.SUN_RISE:
-                event_time = sun.sunrise(self.home, now, self.tzinfo)
+                event_time = self.sun.sunrise(self.home, now, self.tzinfo)
         self.send_event(SunEvent(event_type, event_time, now))
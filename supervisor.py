@@ -0,0 +1,99 @@
+"""Supervision of the background tasks of meters, detectors and dimmer
+
+Each component consumes its queue in a coroutine. Supervised, the coroutine
+runs inside a task owned by the Supervisor. An exception is reported and
+the coroutine is started again after a backoff, doubling with every
+failure in a row. The queue belongs to the component, events queued
+meanwhile are consumed after the restart.
+
+The task of a component stays the same across restarts, cancelling it
+stops the coroutine for good.
+"""
+import asyncio
+import traceback
+
+
+class SupervisedTask:
+    """Restart count and uptime of a supervised coroutine
+
+    Arguments:
+        name (str): Name of the task
+        clock (callable): Monotonic clock in seconds, the loop time
+    """
+    def __init__(self, name, clock):
+        self.name = name
+        self.clock = clock
+        self.task = None
+        # Clock time the coroutine was started last, None while not running
+        self.started = None
+        self.last_error = None
+        # Metrics: restarts after an exception
+        self.restarts = 0
+
+    @property
+    def uptime(self):
+        """Seconds since the last (re)start, 0 while not running"""
+        return self.clock() - self.started if self.started is not None else 0.
+
+
+class Supervisor:
+    """Own the background tasks and restart them when they fail
+
+    Arguments:
+        journal (Journal): Record the failures if given
+        backoff (tuple): First and maximum delay of a restart in seconds
+        stable (float): Seconds a coroutine must run to reset the backoff
+    """
+    def __init__(self, journal=None, backoff=(0.1, 30.), stable=60.):
+        self.journal = journal
+        self.backoff = backoff
+        self.stable = stable
+        self.tasks = {}
+
+    def supervise(self, name, coroutine_function):
+        """Run a coroutine in a supervised task, return the asyncio task
+
+        Arguments:
+            name (str): Unique name of the task
+            coroutine_function (callable): Returns the coroutine to run,
+                called again for every restart
+        """
+        entry = SupervisedTask(name, asyncio.get_running_loop().time)
+        self.tasks[name] = entry
+        entry.task = asyncio.create_task(self.__run(entry, coroutine_function), name=name)
+        return entry.task
+
+    async def __run(self, entry, coroutine_function):
+        failures = 0
+        while True:
+            entry.started = entry.clock()
+            try:
+                await coroutine_function()
+                return
+            except Exception as err:  # pylint: disable=broad-except
+                if entry.uptime >= self.stable:
+                    failures = 0
+                entry.last_error = repr(err)
+                entry.restarts += 1
+                delay = min(self.backoff[0] * 2 ** failures, self.backoff[1])
+                failures += 1
+                print(f"Task {entry.name} failed, restart in {delay:.1f}s: {err!r}")
+                traceback.print_exception(err)
+                if self.journal is not None:
+                    self.journal.record(entry.name, "restart", error=entry.last_error,
+                                        delay=delay)
+            finally:
+                entry.started = None
+            await asyncio.sleep(delay)
+
+    def cancel(self):
+        """Cancel all supervised tasks"""
+        for entry in self.tasks.values():
+            entry.task.cancel()
+
+
+def create_task(name, coroutine_function, supervisor=None):
+    """Return a task running a coroutine, supervised if a supervisor is given"""
+    if supervisor is None:
+        return asyncio.create_task(coroutine_function(), name=name)
+    return supervisor.supervise(name, coroutine_function)
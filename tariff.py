@@ -0,0 +1,334 @@
+"""Time of use tariff and cost accounting of the meters
+
+A Tariff assigns a rate bucket, e.g. day or night, to every point in time.
+It precomputes per local date a table of the bucket boundaries as wall
+clock ns. MeterCost prices each pulse when it arrives by comparing its time
+with the end of the current bucket, a table lookup happens only when a
+boundary is crossed. Sorted pulse logs are priced in bulk by a binary
+search per boundary.
+
+The rates may be configured in tariff.json next to the state file:
+
+    {
+        "rates": [["06:00", "day", 0.32], ["22:00", "night", 0.25]],
+        "weekend": [["00:00", "night", 0.25]]
+    }
+
+Rates give the local time a bucket starts, its name and price per kWh. A
+day starts with the last bucket of the day before.
+"""
+import json
+import os
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from app_state import State, Stateful
+
+# As S0Meter
+PULSE_PER_KWH = 2000
+
+
+def _local_date(wall_ns):
+    """Return the local date of a wall clock time in ns"""
+    return datetime.fromtimestamp(wall_ns / 1e9).date()
+
+
+def _local_ns(day, clock):
+    """Return the wall clock ns of a local date and time HH:MM"""
+    hour, minute = (int(part) for part in clock.split(":"))
+    local = datetime(day.year, day.month, day.day, hour, minute).astimezone()
+    return int(local.timestamp()) * 10**9
+
+
+class Tariff:
+    """Time of use rates
+
+    Arguments:
+        rates (list): Rates on weekdays, (start HH:MM, bucket, price per kWh)
+        weekend (list): Rates on Saturday and Sunday, default rates
+    """
+    DEFAULT = {"rates": [["06:00", "day", 0.32], ["22:00", "night", 0.25]]}
+
+    def __init__(self, rates, weekend=None):
+        self.rates = sorted((tuple(rate) for rate in rates), key=lambda r: r[0])
+        self.weekend = sorted((tuple(rate) for rate in weekend), key=lambda r: r[0]) \
+            if weekend else self.rates
+        self.prices = {bucket: price for _, bucket, price in self.rates + self.weekend}
+        self.tables = {}
+
+    @classmethod
+    def load(cls, path):
+        """Create the tariff configured in a JSON file, default if missing"""
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                config = json.load(file)
+        except FileNotFoundError:
+            config = cls.DEFAULT
+        except ValueError as err:
+            print(f"Error reading tariff {path}: {err}, using default")
+            config = cls.DEFAULT
+        try:
+            return cls(config["rates"], config.get("weekend"))
+        except (KeyError, TypeError, ValueError, AttributeError) as err:
+            print(f"Invalid tariff {path}: {err!r}, using default")
+            return cls(cls.DEFAULT["rates"])
+
+    @property
+    def config(self):
+        """JSON compatible configuration, identifies the tariff"""
+        return {"rates": [list(r) for r in self.rates],
+                "weekend": [list(r) for r in self.weekend]}
+
+    def table(self, day):
+        """Return the bucket boundaries of a local date
+
+        Returns the starts in wall clock ns, the buckets starting there and
+        the end of the day. The first start is midnight.
+        """
+        table = self.tables.get(day)
+        if table is None:
+            if len(self.tables) > 64:
+                self.tables.clear()
+            before = self.weekend if (day - timedelta(days=1)).weekday() >= 5 else self.rates
+            rates = self.weekend if day.weekday() >= 5 else self.rates
+            starts = [_local_ns(day, "00:00")]
+            buckets = [before[-1][1]]
+            for clock, bucket, _ in rates:
+                start = _local_ns(day, clock)
+                if start == starts[-1]:
+                    buckets[-1] = bucket
+                elif bucket != buckets[-1]:
+                    starts.append(start)
+                    buckets.append(bucket)
+            table = (starts, buckets, _local_ns(day + timedelta(days=1), "00:00"))
+            self.tables[day] = table
+        return table
+
+    def count(self, stamps):
+        """Return the pulses per local date and bucket
+
+        Arguments:
+            stamps (sequence): Sorted wall clock times in ns, e.g. of
+                PulseLog.read
+
+        Returns a dict of ISO date to dict of bucket to pulses.
+        """
+        result = {}
+        index = 0
+        while index < len(stamps):
+            day = _local_date(stamps[index])
+            starts, buckets, end = self.table(day)
+            counts = result.setdefault(day.isoformat(), {})
+            stops = starts[1:] + [end]
+            for start, stop, bucket in zip(starts, stops, buckets):
+                first = bisect_left(stamps, start, index)
+                last = bisect_left(stamps, stop, first)
+                if last > first:
+                    counts[bucket] = counts.get(bucket, 0) + last - first
+            index = max(bisect_left(stamps, end, index), index + 1)
+        return result
+
+    def cost(self, counts):
+        """Return the cost of pulses per bucket"""
+        return sum(pulses * self.prices.get(bucket, 0.)
+                   for bucket, pulses in counts.items()) / PULSE_PER_KWH
+
+
+class MeterCost(Stateful):
+    """Cost accounting of a meter per local date and tariff bucket
+
+    A pulse sink of S0EventDispatcher, registered after the meter. The
+    pulses and cost of the last STATE_DAYS dates are persisted in the app
+    state, rewritten by every store. All dates kept are written to a
+    history file once per day, when the first pulse of a date is priced.
+    With a pulse log, pulses logged after the last stored one are priced
+    at start, and the logged days are priced anew if the tariff changed.
+
+    Arguments:
+        name (str): Name of the app state
+        tariff (Tariff): Rates to apply
+        app_state (AppState): Persistence of the costs
+        pulse_log (PulseLog): Pulse log of the meter
+        now_func (callable): Monotonic clock in ns of the pulse timestamps
+        wall_func (callable): Wall clock in s since the epoch, default
+            time.time. With now_func maps the pulses to the local date.
+        keep_days (int): Days kept
+        history (str): JSON file of the days kept. Without, days older than
+            STATE_DAYS are lost at a restart.
+    """
+    # Days persisted in the app state, the current and the last month
+    STATE_DAYS = 62
+
+    def __init__(self, name, tariff, app_state, pulse_log=None, now_func=None,
+                 wall_func=None, keep_days=800, history=None):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.tariff = tariff
+        self.pulse_log = pulse_log
+        self.history = history
+        self.now_func = now_func if now_func is not None else time.monotonic_ns
+        self.wall_func = wall_func if wall_func is not None else time.time
+        self.keep_days = keep_days
+        self.days = {}
+        # Wall clock ns of the last priced pulse
+        self.until = None
+        # Current bucket: its span, name and price, the day it counts into
+        self.start = 0
+        self.end = 0
+        self.bucket = None
+        self.price = 0.
+        self.day = None
+        # Running total of the month of the current day, ISO month
+        self.month = None
+        self.month_cost = 0.
+        self._register_state(app_state)
+
+    def _register_state(self, app_state):
+        state = app_state.get_state(self.name)
+        changed = False
+        self.days = self.__load_history()
+        if state is not None:
+            self.days.update(state.state["days"])
+            self.until = state.state["until"]
+            changed = state.state["tariff"] != self.tariff.config
+        if self.pulse_log is not None:
+            if changed:
+                print(f"{self.name}: tariff changed, pricing the pulse log")
+                self.reprice()
+            elif self.until is not None:
+                self.__add(self.tariff.count(self.pulse_log.read(self.until + 1, 1 << 62)))
+            self.until = self.pulse_log.last
+        app_state.register_client(self)
+
+    @property
+    def state(self):
+        """Return the app_state State of the instance"""
+        oldest = (datetime.fromtimestamp(self.wall_func()).date()
+                  - timedelta(days=self.STATE_DAYS)).isoformat()
+        return State(self.name, {"tariff": self.tariff.config, "until": self.until,
+                                 "days": {key: day for key, day in self.days.items()
+                                          if key >= oldest}})
+
+    def __load_history(self):
+        """Return the days of the history file, none if there is no file"""
+        if self.history is None:
+            return {}
+        try:
+            with open(self.history, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            print(f"Error reading cost history {self.history}: {err}")
+            return {}
+
+    def store_history(self):
+        """Write all days kept to the history file, if any"""
+        if self.history is None:
+            return
+        try:
+            with open(self.history + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(self.days, file, separators=(",", ":"))
+            os.replace(self.history + ".tmp", self.history)
+        except (PermissionError, FileNotFoundError) as err:
+            print(f"Error storing cost history {self.history}: {err}")
+
+    def pulses(self, timestamps):
+        """Price a batch of pulses, timestamps in monotonic ns"""
+        if len(timestamps) == 0:
+            return
+        offset = int(self.wall_func() * 1e9) - self.now_func()
+        for timestamp in timestamps:
+            wall = timestamp + offset
+            if not self.start <= wall < self.end:
+                self.__select(wall)
+            day = self.day
+            day["pulses"][self.bucket] += 1
+            day["cost"] += self.price
+            self.month_cost += self.price
+        # The meter logged the pulses before, use the same time
+        self.until = self.pulse_log.last if self.pulse_log is not None else wall
+
+    def __select(self, wall):
+        """Select the bucket a wall clock time falls into"""
+        day = _local_date(wall)
+        starts, buckets, end = self.tariff.table(day)
+        index = max(bisect_right(starts, wall) - 1, 0)
+        self.start = starts[index]
+        self.end = starts[index + 1] if index + 1 < len(starts) else end
+        key = day.isoformat()
+        if key not in self.days:
+            self.days[key] = {"pulses": {}, "cost": 0.}
+            self.__expire(day)
+            self.store_history()
+        self.day = self.days[key]
+        if key[:7] != self.month:
+            self.__total(key[:7])
+        self.bucket = buckets[index]
+        self.day["pulses"].setdefault(self.bucket, 0)
+        self.price = self.tariff.prices[self.bucket] / PULSE_PER_KWH
+
+    def __total(self, month):
+        """Sum the running total of an ISO month"""
+        self.month = month
+        self.month_cost = sum(day["cost"] for key, day in self.days.items()
+                              if key.startswith(month))
+        # The current day may not count into the month anymore
+        self.end = 0
+
+    def __expire(self, day):
+        oldest = (day - timedelta(days=self.keep_days)).isoformat()
+        for key in [key for key in self.days if key < oldest]:
+            del self.days[key]
+
+    def __add(self, counts):
+        """Add pulses per date and bucket as priced by the tariff"""
+        self.end = 0
+        self.month = None
+        for key, buckets in counts.items():
+            day = self.days.setdefault(key, {"pulses": {}, "cost": 0.})
+            pulses = day["pulses"]
+            for bucket, count in buckets.items():
+                pulses[bucket] = pulses.get(bucket, 0) + count
+            day["cost"] += self.tariff.cost(buckets)
+
+    def reprice(self, tariff=None):
+        """Price the days in the pulse log anew, e.g. after rates changed
+
+        Arguments:
+            tariff (Tariff): New tariff, default the current one
+        """
+        if tariff is not None:
+            self.tariff = tariff
+        self.end = 0
+        self.month = None
+        if self.pulse_log is None:
+            return
+        for key, counts in self.tariff.count(self.pulse_log.read(0, 1 << 62)).items():
+            self.days[key] = {"pulses": counts, "cost": self.tariff.cost(counts)}
+        self.store_history()
+
+    def cost(self, prefix=None):
+        """Return the cost of the days starting with prefix
+
+        Arguments:
+            prefix (str): ISO date, month (2026-10) or year, default today
+        """
+        today = datetime.fromtimestamp(self.wall_func()).date().isoformat()
+        prefix = today if prefix is None else prefix
+        if len(prefix) == len(today):
+            day = self.days.get(prefix)
+            return day["cost"] if day is not None else 0.
+        if prefix == today[:7]:
+            if prefix != self.month:
+                self.__total(prefix)
+            return self.month_cost
+        return sum(day["cost"] for key, day in self.days.items() if key.startswith(prefix))
+
+    def totals(self):
+        """Return the cost of today and of the current month
+
+        Both are running totals, no stored days are summed per call.
+        """
+        today = datetime.fromtimestamp(self.wall_func()).date().isoformat()
+        return self.cost(today), self.cost(today[:7])
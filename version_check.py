@@ -1,4 +1,4 @@
-import semver
+"""Check minimum versions of imported modules"""
 
 class ModuleMinimumVersionNotMetError(ImportError):
     """Raised when a minumum version requirement from an import is not met"""
@@ -12,6 +12,11 @@ class ModuleMinimumVersionNotMetError(ImportError):
                f"but minimum required version is {self.exp_ver}"
            
 def check_version(module, exp_ver):
+    """Raise ModuleMinimumVersionNotMetError if module is older than exp_ver
+
+    semver is imported on first use, so importing this module is cheap.
+    """
+    import semver  # pylint: disable=import-outside-toplevel
     if semver.VersionInfo.parse(module.__version__) < semver.VersionInfo.parse(exp_ver):
         raise ModuleMinimumVersionNotMetError(
             exp_ver=exp_ver,